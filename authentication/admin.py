@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile_ver, Share_Buy, Share_Sell,NepseStock,TMSConfiguration
+from .models import Profile_ver, SellOrder, Share_Buy, Share_Sell,NepseStock,TMSConfiguration,TMSSyncJob,TMSBrokerAccount,TMSSyncRun
 
 admin.site.register(NepseStock)
 admin.site.register(TMSConfiguration)
@@ -20,6 +20,12 @@ class ShareBuyAdmin(admin.ModelAdmin):
         return obj.availability_status
     availability_status.short_description = 'Status'
 
+    def save_model(self, request, obj, form, change):
+        """Edits also update the amounts of the sell orders that sold from the purchase"""
+        super().save_model(request, obj, form, change)
+        if change:
+            SellOrder.refresh_for_purchase(obj)
+
 
 @admin.register(Share_Sell)
 class ShareSellAdmin(admin.ModelAdmin):
@@ -39,3 +45,80 @@ class ShareSellAdmin(admin.ModelAdmin):
         if db_field.name == "share":
             kwargs["queryset"] = Share_Buy.objects.filter(remaining_units__gt=0).order_by('scrip', 'transaction_date')
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        """Sales added here become a sell order of their own; edits update the order's amounts"""
+        super().save_model(request, obj, form, change)
+        if obj.order_id is None:
+            order = SellOrder(
+                user=obj.user,
+                scrip=obj.share.scrip,
+                units_sold=obj.units_sold,
+                selling_price=obj.selling_price,
+                transaction_date=obj.transaction_date,
+            )
+            order.calculate(Share_Buy.scrip_wacc(obj.user, obj.share.scrip), obj.share.transaction_date)
+            order.save()
+            obj.order = order
+            obj.save(update_fields=['order'])
+        else:
+            obj.order.refresh_from_lots()
+
+
+class ShareSellLotInline(admin.TabularInline):
+    model = Share_Sell
+    fields = ['share', 'units_sold', 'selling_price', 'transaction_date']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(SellOrder)
+class SellOrderAdmin(admin.ModelAdmin):
+    list_display = ['scrip', 'user', 'units_sold', 'selling_price', 'transaction_date', 'net_amount']
+    list_filter = ['transaction_date', 'scrip']
+    search_fields = ['scrip', 'user__username']
+    date_hierarchy = 'transaction_date'
+    readonly_fields = [
+        'user', 'scrip', 'units_sold', 'selling_price', 'transaction_date', 'wacc', 'holding_period_days', 'gross_amount', 'sebon_fee', 'dp_charge',
+        'broker_commission', 'buy_cost', 'capital_gains_tax', 'net_amount', 'created_at',
+    ]
+    inlines = [ShareSellLotInline]
+
+    def has_add_permission(self, request):
+        """Orders are recorded by selling shares"""
+        return False
+
+
+@admin.register(TMSSyncJob)
+class TMSSyncJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'tms_server_number', 'settlement_type', 'all_accounts', 'full_sync', 'status', 'progress', 'records_saved', 'created_at', 'finished_at']
+    list_filter = ['status', 'settlement_type', 'tms_server_number']
+    search_fields = ['user__username', 'error']
+    readonly_fields = ['created_at', 'started_at', 'heartbeat_at', 'finished_at', 'worker']
+    exclude = ['captcha_image']
+
+
+@admin.register(TMSBrokerAccount)
+class TMSBrokerAccountAdmin(admin.ModelAdmin):
+    list_display = ['user', 'tms_server_number', 'label', 'is_active', 'last_synced_at', 'last_payment_due_date', 'last_success_date', 'session_saved_at']
+    list_filter = ['is_active', 'tms_server_number']
+    search_fields = ['user__username', 'label']
+    exclude = ['session_state']
+
+
+@admin.register(TMSSyncRun)
+class TMSSyncRunAdmin(admin.ModelAdmin):
+    list_display = [
+        'started_at', 'user', 'tms_server_number', 'settlement_type', 'success', 'records_found', 'records_saved',
+        'duration_seconds', 'login_seconds', 'navigate_seconds', 'expand_seconds', 'extract_seconds', 'save_seconds',
+    ]
+    list_filter = ['success', 'tms_server_number', 'settlement_type']
+    search_fields = ['user__username', 'error']
+    date_hierarchy = 'started_at'
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,225 @@
+"""
+Read-only JSON API for holdings, transactions and fee summaries
+
+Used by the mobile and scripting clients under /api/v1/:
+
+- buys/ and sells/ are paged with a keyset cursor on (transaction_date, id):
+  pass the `next` value of one page as `?cursor=` to get the next, so a page
+  costs the same however deep into the history it is
+- `?fields=a,b` limits each item to those fields
+- every response carries an ETag from the user's portfolio version; a
+  matching If-None-Match gets a 304 without reading any transactions
+
+Authentication is the browser session, or HTTP Basic for scripts.
+"""
+import base64
+import binascii
+import json
+from collections import defaultdict
+from decimal import Decimal
+from functools import wraps
+
+from django.contrib.auth import authenticate
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_GET
+
+from . import fees
+from .models import SellOrder, Share_Buy, Share_Sell
+from .pagination import InvalidCursor, keyset_page
+from .portfolio_cache import add_validators, not_modified, portfolio_validators
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+CENT = Decimal('0.01')
+
+
+class APIError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _money(value):
+    return Decimal(value).quantize(CENT)
+
+
+def _basic_auth_user(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith('Basic '):
+        return None
+    try:
+        username, _, password = base64.b64decode(header[6:]).decode('utf-8').partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+def api_view(view):
+    """GET only, session or Basic auth, JSON errors and a conditional ETag response"""
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            user = _basic_auth_user(request)
+            if user is None:
+                response = JsonResponse({'error': 'Authentication required'}, status=401)
+                response['WWW-Authenticate'] = 'Basic realm="api"'
+                return response
+            request.user = user
+        etag, last_modified = portfolio_validators(request, market=False)
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            try:
+                payload = view(request, *args, **kwargs)
+            except APIError as e:
+                return JsonResponse({'error': str(e)}, status=e.status)
+            body = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+            response = add_validators(HttpResponse(body, content_type='application/json'), etag, last_modified)
+        patch_vary_headers(response, ('Cookie', 'Authorization'))
+        return response
+    return wrapper
+
+
+def _page_size(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise APIError('limit must be a number')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _selected_fields(request, serializers):
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(serializers)
+    selected = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in serializers]
+    if unknown:
+        raise APIError(f'Unknown field(s): {", ".join(unknown)}. Available: {", ".join(serializers)}')
+    return selected
+
+
+def _keyset_page(request, queryset, serializers):
+    """One page of queryset ordered by (transaction_date, id), oldest first unless ?order=desc"""
+    fields = _selected_fields(request, serializers)
+    try:
+        rows, next_cursor = keyset_page(
+            queryset,
+            cursor=request.GET.get('cursor'),
+            limit=_page_size(request),
+            descending=request.GET.get('order', 'asc') == 'desc',
+        )
+    except InvalidCursor as e:
+        raise APIError(str(e))
+    return {
+        'results': [{name: serializers[name](row) for name in fields} for row in rows],
+        'next': next_cursor,
+    }
+
+
+BUY_FIELDS = {
+    'id': lambda share: share.id,
+    'scrip': lambda share: share.scrip,
+    'units': lambda share: share.units,
+    'remaining_units': lambda share: share.remaining_units,
+    'buying_price': lambda share: share.buying_price,
+    'transaction_date': lambda share: share.transaction_date,
+    'imported': lambda share: bool(share.tms_import_key),
+    'total_cost': lambda share: _money(share.calculate_costs()['total_amount']),
+}
+
+SELL_FIELDS = {
+    'id': lambda sale: sale.id,
+    'buy_id': lambda sale: sale.share_id,
+    'order_id': lambda sale: sale.order_id,
+    'scrip': lambda sale: sale.share.scrip,
+    'units_sold': lambda sale: sale.units_sold,
+    'selling_price': lambda sale: sale.selling_price,
+    'transaction_date': lambda sale: sale.transaction_date,
+    'transaction_group': lambda sale: sale.transaction_group,
+}
+
+
+@api_view
+def buys_view(request):
+    """Buy transactions, optionally for one ?scrip="""
+    purchases = Share_Buy.objects.filter(user=request.user)
+    if request.GET.get('scrip'):
+        purchases = purchases.filter(scrip=request.GET['scrip'].upper())
+    return _keyset_page(request, purchases, BUY_FIELDS)
+
+
+@api_view
+def sells_view(request):
+    """Sell transactions (one row per FIFO lot sold), optionally for one ?scrip="""
+    sales = Share_Sell.objects.filter(user=request.user).select_related('share')
+    if request.GET.get('scrip'):
+        sales = sales.filter(share__scrip=request.GET['scrip'].upper())
+    return _keyset_page(request, sales, SELL_FIELDS)
+
+
+HOLDING_FIELDS = {
+    'scrip': lambda holding: holding['scrip'],
+    'units': lambda holding: holding['total_units'],
+    'wacc': lambda holding: _money(holding['wacc']),
+    'cost_basis': lambda holding: _money(Decimal(str(holding['wacc'])) * holding['total_units']),
+    'earliest_date': lambda holding: holding['earliest_date'],
+    'lots': lambda holding: [
+        {'buy_id': share.id, 'transaction_date': share.transaction_date, 'remaining_units': share.remaining_units}
+        for share in holding['transactions']
+    ],
+}
+
+
+@api_view
+def holdings_view(request):
+    """Current holdings per scrip with WACC and FIFO lots"""
+    fields = _selected_fields(request, HOLDING_FIELDS)
+    holdings = Share_Sell.get_holdings(request.user)
+    return {'results': [{name: HOLDING_FIELDS[name](holding) for name in fields} for holding in holdings]}
+
+
+@api_view
+def fee_summary_view(request):
+    """
+    Fees paid per scrip: buy side per purchase, sell side per sell order as
+    stored when it was recorded, like the fee breakdown page
+    """
+    purchases = Share_Buy.objects.filter(user=request.user)
+    orders = SellOrder.objects.filter(user=request.user)
+    if request.GET.get('scrip'):
+        purchases = purchases.filter(scrip=request.GET['scrip'].upper())
+        orders = orders.filter(scrip=request.GET['scrip'].upper())
+
+    empty = lambda: defaultdict(Decimal)
+    summary = defaultdict(empty)
+    for share in purchases:
+        costs = share.calculate_costs()
+        scrip = summary[share.scrip]
+        scrip['buy_sebon_fee'] += costs['sebon_fee']
+        scrip['buy_dp_charge'] += costs['dp_charge']
+        scrip['buy_commission'] += costs['broker_commission']
+        scrip['buy_total'] += costs['total_amount']
+
+    for order in orders:
+        scrip = summary[order.scrip]
+        scrip['sell_sebon_fee'] += order.sebon_fee
+        scrip['sell_dp_charge'] += order.dp_charge
+        scrip['sell_commission'] += order.broker_commission
+        scrip['capital_gains_tax'] += order.capital_gains_tax
+        scrip['sell_receivable'] += order.net_amount
+
+    totals = empty()
+    results = []
+    for scrip_name in sorted(summary):
+        amounts = summary[scrip_name]
+        for key, value in amounts.items():
+            totals[key] += value
+        results.append({'scrip': scrip_name, **{key: _money(value) for key, value in sorted(amounts.items())}})
+    return {
+        'results': results,
+        'totals': {key: _money(value) for key, value in sorted(totals.items())},
+        'schedule': fees.fee_schedule(),
+    }
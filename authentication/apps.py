@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        # Registers the signals that invalidate cached portfolio fragments
+        from . import portfolio_cache  # noqa: F401
+        from . import checks  # noqa: F401
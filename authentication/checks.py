@@ -0,0 +1,25 @@
+"""
+System checks, run by manage.py check and before runserver starts
+"""
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+
+
+@register('static_manifest')
+def check_static_manifest(app_configs, **kwargs):
+    """With manifest storage every {% static %} raises ValueError until collectstatic has written the manifest"""
+    backend = import_string(settings.STORAGES['staticfiles']['BACKEND'])
+    if not issubclass(backend, ManifestStaticFilesStorage):
+        return []
+    manifest = os.path.join(settings.STATIC_ROOT or '', backend.manifest_name)
+    if os.path.exists(manifest):
+        return []
+    return [Error(
+        f'STATIC_MANIFEST is on but {manifest} does not exist, so every page using {{% static %}} fails.',
+        hint='Run "python manage.py collectstatic --noinput" as part of the deploy, or unset STATIC_MANIFEST.',
+        id='authentication.E001',
+    )]
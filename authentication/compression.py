@@ -0,0 +1,144 @@
+"""
+Response compression and precompressed static files
+
+CompressionMiddleware compresses text responses of COMPRESS_MIN_SIZE bytes
+or more: with Brotli for clients that accept it, when the optional brotli
+package is installed (pip install brotli), and with gzip otherwise. Smaller
+responses and binary types are sent as they are.
+
+CompressedManifestStaticFilesStorage is ManifestStaticFilesStorage that also
+writes .br and .gz copies of the text assets during collectstatic, so
+serve_static (or a web server with gzip_static/brotli_static) can send them
+without compressing on every request.
+"""
+import gzip
+import logging
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+)
+STATIC_EXTENSIONS = ('.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml')
+# Per response, so a fast level; static files get the slowest, smallest one
+BROTLI_QUALITY = 5
+STATIC_BROTLI_QUALITY = 11
+# Random gzip header padding against BREACH, as in Django's GZipMiddleware
+MAX_RANDOM_BYTES = 100
+
+
+def accepted_encodings(request) -> set:
+    """Content codings from Accept-Encoding, without those refused with q=0"""
+    encodings = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        params = params.replace(' ', '').lower()
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding.strip():
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+def _min_size() -> int:
+    return getattr(settings, 'COMPRESS_MIN_SIZE', 1024)
+
+
+class CompressionMiddleware:
+    """Brotli or gzip for text responses above COMPRESS_MIN_SIZE"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '')
+        # Event streams must reach the client as each event is written, not when gzip flushes
+        if not content_type.startswith(COMPRESSIBLE_TYPES) or content_type.startswith('text/event-stream'):
+            return response
+        if not response.streaming and len(response.content) < _min_size():
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encodings = accepted_encodings(request)
+        if brotli is not None and 'br' in encodings and not response.streaming:
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif 'gzip' in encodings:
+            encoding = 'gzip'
+            if response.streaming:
+                if response.is_async:
+                    return response
+                response.streaming_content = compress_sequence(
+                    response.streaming_content, max_random_bytes=MAX_RANDOM_BYTES)
+                del response.headers['Content-Length']
+                return self._encoded(response, encoding)
+            compressed = compress_string(response.content, max_random_bytes=MAX_RANDOM_BYTES)
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        return self._encoded(response, encoding)
+
+    @staticmethod
+    def _encoded(response, encoding):
+        # The compressed body is no longer byte-identical: a strong ETag becomes weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Hashed static files plus .br/.gz copies of the text assets"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                names.update((name, hashed_name))
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        # After every pass, when the hashed CSS has its final contents
+        for name in sorted(names):
+            if name.endswith(STATIC_EXTENSIONS):
+                self._write_compressed(name)
+
+    def _write_compressed(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            content = f.read()
+        if len(content) < _min_size():
+            return
+        variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content, quality=STATIC_BROTLI_QUALITY)
+        for suffix, compressed in variants.items():
+            if len(compressed) >= len(content):
+                continue
+            try:
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+            except OSError as e:
+                logger.warning("Could not write %s%s: %s", name, suffix, e)
@@ -0,0 +1,49 @@
+"""
+NEPSE secondary market fee schedule
+
+One place for the rates used by the models, when recording a sale and by the
+client-side previews (fee_schedule() is rendered into the pages), so they
+cannot drift apart.
+"""
+from decimal import Decimal
+from typing import Dict
+
+SEBON_FEE_RATE = Decimal('0.00015')
+DP_CHARGE = Decimal('25.00')
+
+# (transaction amount up to, broker commission %) - the last slab has no upper bound
+BROKER_RATE_SLABS = (
+    (Decimal('50000'), Decimal('0.36')),
+    (Decimal('500000'), Decimal('0.33')),
+    (Decimal('2000000'), Decimal('0.31')),
+    (Decimal('10000000'), Decimal('0.27')),
+    (None, Decimal('0.24')),
+)
+
+# Capital gains tax: long term once held LONG_TERM_DAYS or more
+CGT_SHORT_TERM_RATE = Decimal('0.075')
+CGT_LONG_TERM_RATE = Decimal('0.05')
+LONG_TERM_DAYS = 365
+
+
+def broker_rate(amount) -> Decimal:
+    """Broker commission in percent for a transaction amount"""
+    for limit, rate in BROKER_RATE_SLABS:
+        if limit is None or amount <= limit:
+            return rate
+
+
+def capital_gains_tax_rate(holding_period_days: int) -> Decimal:
+    return CGT_LONG_TERM_RATE if holding_period_days >= LONG_TERM_DAYS else CGT_SHORT_TERM_RATE
+
+
+def fee_schedule() -> Dict:
+    """The schedule as plain JSON numbers for the sell preview"""
+    return {
+        'sebon_rate': float(SEBON_FEE_RATE),
+        'dp_charge': float(DP_CHARGE),
+        'broker_slabs': [[float(limit) if limit is not None else None, float(rate)] for limit, rate in BROKER_RATE_SLABS],
+        'cgt_short': float(CGT_SHORT_TERM_RATE),
+        'cgt_long': float(CGT_LONG_TERM_RATE),
+        'long_term_days': LONG_TERM_DAYS,
+    }
@@ -0,0 +1,168 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from authentication.models import SellOrder, Share_Buy
+from authentication.portfolio_data import generate_portfolio
+from authentication.tms_service import save_imported_purchases
+from authentication.utils import PERCENTILES, percentile
+
+OPERATIONS = ('sell', 'import')
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent sells and TMS imports from several threads against the configured database '
+        '(in a throwaway test database) and report throughput, latency and lock errors'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent writer threads, one user each')
+        parser.add_argument('--seconds', type=float, default=10, help='How long the writers run')
+        parser.add_argument('--operations', default=','.join(OPERATIONS), help=f'Comma-separated subset of: {", ".join(OPERATIONS)}')
+        parser.add_argument('--import-rows', type=int, default=20, help='Purchases per simulated TMS import')
+        parser.add_argument('--history', type=int, default=500, help='Generated transactions per user before the run')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the generated data')
+
+    def handle(self, *args, **options):
+        operations = [op.strip() for op in options['operations'].split(',') if op.strip()]
+        unknown = set(operations) - set(OPERATIONS)
+        if unknown or not operations:
+            raise CommandError(f'--operations must be a subset of: {", ".join(OPERATIONS)}')
+
+        # An in-memory test database has no file locking to measure, so SQLite runs use a temporary file
+        temporary = None
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            temporary = tempfile.mkdtemp()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temporary, 'benchmark.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.describe_database()
+            users = self.create_users(options)
+            results = self.run_writers(users, operations, options)
+            self.report(results, options['seconds'])
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if temporary:
+                for name in os.listdir(temporary):
+                    os.remove(os.path.join(temporary, name))
+                os.rmdir(temporary)
+
+    def describe_database(self):
+        settings_dict = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                pragmas = {}
+                for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                    cursor.execute(f'PRAGMA {pragma}')
+                    pragmas[pragma] = cursor.fetchone()[0]
+            transaction_mode = settings_dict['OPTIONS'].get('transaction_mode') or 'DEFERRED'
+            details = ', '.join(f'{name}={value}' for name, value in pragmas.items())
+            self.stdout.write(f'SQLite {settings_dict["NAME"]}: {details}, transactions={transaction_mode}')
+        else:
+            pool = settings_dict['OPTIONS'].get('pool')
+            self.stdout.write(
+                f'{connection.vendor} {settings_dict["HOST"]}/{settings_dict["NAME"]}: '
+                f'CONN_MAX_AGE={settings_dict["CONN_MAX_AGE"]}, pool={pool or "off"}'
+            )
+
+    def create_users(self, options):
+        users = []
+        rng = random.Random(options['seed'])
+        for number in range(options['workers']):
+            user = User.objects.create_user(username=f'writer{number}', password='bench')
+            generate_portfolio(user, options['history'], scrips=10, sell_ratio=0.2, rng=rng)
+            users.append(user)
+        return users
+
+    def run_writers(self, users, operations, options):
+        """{operation: [seconds, ...]} of the successful writes, plus 'errors'"""
+        results = {op: [] for op in operations}
+        results['errors'] = []
+        lock = threading.Lock()
+        start = threading.Barrier(len(users))
+
+        def writer(number, user):
+            rng = random.Random(options['seed'] + number)
+            imported = 0
+            timings = {op: [] for op in operations}
+            errors = []
+            try:
+                start.wait()
+                deadline = time.perf_counter() + options['seconds']
+                while time.perf_counter() < deadline:
+                    op = rng.choice(operations)
+                    began = time.perf_counter()
+                    try:
+                        if op == 'sell':
+                            self.sell(user, rng)
+                        else:
+                            imported += 1
+                            self.tms_import(user, number, imported, options['import_rows'], rng)
+                    except OperationalError as e:
+                        errors.append(f'{op}: {e}')
+                        continue
+                    timings[op].append(time.perf_counter() - began)
+            finally:
+                connections.close_all()
+            with lock:
+                for op, values in timings.items():
+                    results[op].extend(values)
+                results['errors'].extend(errors)
+
+        threads = [threading.Thread(target=writer, args=(number, user)) for number, user in enumerate(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def sell(self, user, rng):
+        """Sell one unit of a random scrip the user still holds, the way share_sell_view does"""
+        held = list(Share_Buy.objects.filter(user=user, remaining_units__gt=0).values_list('scrip', flat=True).distinct())
+        if not held:
+            return
+        scrip = rng.choice(held)
+        shares = Share_Buy.objects.filter(user=user, scrip=scrip, remaining_units__gt=0).order_by('transaction_date', 'id')
+        SellOrder.record(user, shares, 1, rng.randint(200, 2000), date.today())
+
+    def tms_import(self, user, tms_number, batch, rows, rng):
+        """A TMS sync's save step: rows with fresh transaction numbers"""
+        save_imported_purchases(user, [
+            {
+                'scrip': f'SYN{rng.randint(0, 9):03d}',
+                'units': 10,
+                'buying_price': rng.randint(200, 2000),
+                'transaction_date': date.today() - timedelta(days=rng.randint(0, 30)),
+                'transaction_no': f'bench-{batch}-{row}',
+            }
+            for row in range(rows)
+        ], tms_number=tms_number)
+
+    def report(self, results, seconds):
+        header = ''.join(f'{"p" + str(p):>10}' for p in PERCENTILES)
+        self.stdout.write(f'  {"operation":<10}{"done":>7}{"per sec":>9}{header}{"max":>10}')
+        for op, timings in results.items():
+            if op == 'errors' or not timings:
+                continue
+            timings = sorted(t * 1000 for t in timings)
+            cells = ''.join(f'{percentile(timings, p):>8.1f}ms' for p in PERCENTILES)
+            self.stdout.write(f'  {op:<10}{len(timings):>7}{len(timings) / seconds:>9.1f}{cells}{timings[-1]:>8.1f}ms')
+
+        errors = results['errors']
+        if errors:
+            self.stdout.write(self.style.WARNING(f'{len(errors)} writes failed, e.g. {errors[0]}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No writes failed'))
@@ -0,0 +1,90 @@
+import random
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.template import engines
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from authentication.management.commands.benchmark_views import market_feed
+from authentication.models import Share_Buy
+from authentication.portfolio_data import generate_portfolio
+from authentication.utils import percentile
+
+TEMPLATES = (
+    'base.html', 'login.html', 'dashboard.html', 'sharehub_portfolio.html',
+    'sharehub_holding_detail.html', 'fee_breakdown.html', 'share_sell_form.html',
+)
+
+
+class Command(BaseCommand):
+    help = 'Time template compilation and page renders and report HTML size, in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Compilations and requests per template and page')
+        parser.add_argument('--transactions', type=int, default=500, help='Generated history of the benchmark user')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the generated data')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.compile_times(options['repeat'])
+            self.page_renders(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def compile_times(self, repeat):
+        """get_template() with the loader cache emptied each time, against a cache hit"""
+        engine = engines['django'].engine
+        self.stdout.write(self.style.SUCCESS('Template compilation (median)'))
+        self.stdout.write(f'  {"template":<32}{"compile":>10}{"cached":>10}')
+        for name in TEMPLATES:
+            cold, warm = [], []
+            for _ in range(max(1, repeat)):
+                for loader in engine.template_loaders:
+                    if hasattr(loader, 'reset'):
+                        loader.reset()
+                start = time.perf_counter()
+                engine.get_template(name)
+                cold.append((time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+                engine.get_template(name)
+                warm.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(
+                f'  {name:<32}{percentile(sorted(cold), 50):>8.2f}ms{percentile(sorted(warm), 50):>8.3f}ms'
+            )
+
+    def page_renders(self, options):
+        user = User.objects.create_user(username='templatebench', password='bench')
+        prices = generate_portfolio(user, options['transactions'], rng=random.Random(options['seed']))
+        holding = Share_Buy.objects.filter(user=user, remaining_units__gt=0).first()
+        pages = [('login', '/login/', False), ('dashboard', '/dashboard/', True), ('portfolio', '/portfolio/', True)]
+        if holding:
+            pages += [
+                ('holding_detail', f'/holding/{holding.scrip}/', True),
+                ('fee_breakdown', f'/fee-breakdown/{holding.scrip}/', True),
+            ]
+
+        self.stdout.write(self.style.SUCCESS(f'Page renders ({options["transactions"]} transactions)'))
+        self.stdout.write(f'  {"page":<16}{"first":>10}{"p50":>10}{"html":>10}')
+        with mock.patch('authentication.nepse_api_utils.fetch_nepse_stocks_and_ltp', return_value=market_feed(prices)):
+            for name, url, login in pages:
+                client = Client()
+                if login:
+                    client.force_login(user)
+                timings = []
+                for _ in range(max(1, options['repeat'])):
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    timings.append((time.perf_counter() - start) * 1000)
+                first = timings[0]
+                line = f'  {name:<16}{first:>8.1f}ms{percentile(sorted(timings), 50):>8.1f}ms{len(response.content) / 1024:>8.1f}KB'
+                if response.status_code != 200:
+                    self.stdout.write(self.style.WARNING(f'{line}  HTTP {response.status_code}'))
+                else:
+                    self.stdout.write(line)
@@ -0,0 +1,74 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.tms_parser import parse_page
+
+FIXTURES_DIR = Path(__file__).resolve().parents[2] / 'tms_fixtures'
+
+
+class Command(BaseCommand):
+    help = 'Parse the saved TMS page fixtures offline, check the row counts and report rows/second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Times each fixture is parsed')
+        parser.add_argument('--fixtures-dir', default=str(FIXTURES_DIR), help='Directory containing manifest.json')
+        parser.add_argument('--only', help='Only run fixtures whose file name contains this text')
+        parser.add_argument('--profile', action='store_true', help='Print the top cProfile entries for the whole run')
+
+    def handle(self, *args, **options):
+        fixtures_dir = Path(options['fixtures_dir'])
+        try:
+            manifest = json.loads((fixtures_dir / 'manifest.json').read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {fixtures_dir / "manifest.json"}: {e}')
+
+        if options['only']:
+            manifest = [entry for entry in manifest if options['only'] in entry['file']]
+        iterations = max(1, options['iterations'])
+        profiler = cProfile.Profile() if options['profile'] else None
+        failures = []
+        total_rows = 0
+        total_seconds = 0.0
+
+        for entry in manifest:
+            content = (fixtures_dir / entry['file']).read_text()
+            rows = parse_page(content, entry['section'])
+            if len(rows) != entry['rows']:
+                failures.append(entry['file'])
+                self.stdout.write(
+                    self.style.ERROR(f'{entry["file"]}: expected {entry["rows"]} rows, parsed {len(rows)}')
+                )
+                continue
+
+            if profiler:
+                profiler.enable()
+            start = time.perf_counter()
+            for _ in range(iterations):
+                parse_page(content, entry['section'])
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+
+            total_rows += len(rows) * iterations
+            total_seconds += elapsed
+            self.stdout.write(
+                f'{entry["file"]:<32} {len(content) / 1024:7.1f} KB {len(rows):5d} rows '
+                f'{elapsed / iterations * 1000:8.2f} ms/page {len(rows) * iterations / elapsed:10.0f} rows/s'
+            )
+
+        if total_seconds:
+            self.stdout.write(
+                self.style.SUCCESS(f'Overall: {total_rows / total_seconds:.0f} rows/s over {iterations} iterations')
+            )
+        if profiler:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+            self.stdout.write(stream.getvalue())
+        if failures:
+            raise CommandError(f'Row count mismatch in: {", ".join(failures)}')
@@ -0,0 +1,136 @@
+import random
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from authentication.models import SellOrder, Share_Buy
+from authentication.portfolio_data import generate_portfolio
+from authentication.utils import PERCENTILES, percentile
+
+VIEWS = ('index', 'portfolio', 'holding_detail', 'sold_detail', 'fee_breakdown', 'share_sell')
+
+
+def market_feed(prices):
+    """What fetch_nepse_stocks_and_ltp returns, for the generated scrips"""
+    return [
+        {
+            'symbol': scrip, 'companyName': scrip, 'ltp': ltp, 'change': 0, 'changePercent': 0,
+            'high': ltp, 'low': ltp, 'open': ltp, 'close': ltp, 'volume': 0, 'turnover': 0,
+            'today_loss': None, 'today_gain': None,
+        }
+        for scrip, ltp in prices.items()
+    ]
+
+
+class QueryCounter:
+    """connection.execute_wrapper that counts queries (the debug query log stops at 9000)"""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Time the portfolio pages against generated histories of increasing size, in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000,100000', help='Comma-separated transaction counts')
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per view and size')
+        parser.add_argument('--time-limit', type=float, default=60, help='Stop repeating a view after this many seconds')
+        parser.add_argument('--scrips', type=int, default=20, help='Scrips in each generated history')
+        parser.add_argument('--views', default=','.join(VIEWS), help=f'Comma-separated subset of: {", ".join(VIEWS)}')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the generated data')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated numbers')
+        views = [view.strip() for view in options['views'].split(',') if view.strip()]
+        unknown = set(views) - set(VIEWS)
+        if unknown:
+            raise CommandError(f'Unknown view(s): {", ".join(sorted(unknown))}')
+
+        # Generated users never touch the real database
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for size in sizes:
+                self.benchmark_size(size, views, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def benchmark_size(self, size, views, options):
+        user = User.objects.create_user(username=f'bench{size}', password='bench')
+        started = time.perf_counter()
+        prices = generate_portfolio(user, size, scrips=options['scrips'], sell_ratio=0.3, rng=random.Random(options['seed']))
+        self.stdout.write(self.style.SUCCESS(
+            f'{size} transactions: {user.share_purchases.count()} buys, {user.sell_orders.count()} sell orders '
+            f'(generated in {time.perf_counter() - started:.1f}s)'
+        ))
+
+        client = Client()
+        client.force_login(user)
+        requests = self.requests_for(user, views)
+        header = ''.join(f'{"p" + str(p):>10}' for p in PERCENTILES)
+        self.stdout.write(f'  {"view":<16}{"runs":>5}{header}{"max":>10}{"queries":>9}')
+
+        with mock.patch('authentication.nepse_api_utils.fetch_nepse_stocks_and_ltp', return_value=market_feed(prices)):
+            for name, request in requests:
+                request(client)  # warm up templates and the session
+                timings = []
+                deadline = time.perf_counter() + options['time_limit']
+                while len(timings) < max(1, options['requests']) and time.perf_counter() < deadline:
+                    queries = QueryCounter()
+                    with connection.execute_wrapper(queries):
+                        start = time.perf_counter()
+                        status = request(client)
+                        timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                cells = ''.join(f'{percentile(timings, p):>8.1f}ms' for p in PERCENTILES)
+                line = f'  {name:<16}{len(timings):>5}{cells}{timings[-1]:>8.1f}ms{queries.count:>9}'
+                if status >= 300:
+                    # The portfolio views redirect when they fail
+                    self.stdout.write(self.style.WARNING(f'{line}  HTTP {status}'))
+                else:
+                    self.stdout.write(line)
+
+    def requests_for(self, user, views):
+        """(view name, callable(client) -> status) for each view there is data for"""
+        holding = Share_Buy.objects.filter(user=user, remaining_units__gt=0).order_by('-remaining_units').first()
+        sold = SellOrder.objects.filter(user=user).order_by('-transaction_date').first()
+
+        def get(url):
+            return lambda client: client.get(url).status_code
+
+        def sell_one_unit(client):
+            # Sell one unit of the largest lot, then roll it back so every request sees the same data
+            with transaction.atomic():
+                status = client.post('/sell-shares/', {
+                    'share_ids': str(holding.id),
+                    'units_sold': '1',
+                    'selling_price': '1000',
+                    'transaction_date': holding.transaction_date.isoformat(),
+                }).status_code
+                transaction.set_rollback(True)
+            return status
+
+        requests = {
+            'index': get('/'),
+            'portfolio': get('/portfolio/'),
+            'fee_breakdown': get('/fee-breakdown/'),
+        }
+        if holding:
+            requests['holding_detail'] = get(f'/holding/{holding.scrip}/')
+            requests['share_sell'] = sell_one_unit
+        if sold:
+            requests['sold_detail'] = get(f'/sold/{sold.scrip}/')
+        return [(name, requests[name]) for name in views if name in requests]
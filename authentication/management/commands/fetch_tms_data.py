@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from authentication.tms_service import fetch_tms_data
+from authentication.tms_service import fetch_tms_data, fetch_tms_data_multi
 
 
 class Command(BaseCommand):
@@ -9,6 +9,8 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--user-id', type=int, required=True, help='Django user ID to associate the data with')
         parser.add_argument('--tms-number', type=int, help='TMS server number (uses profile setting if not provided)')
+        parser.add_argument('--all-accounts', action='store_true', help="Sync all of the user's broker accounts concurrently")
+        parser.add_argument('--full', action='store_true', help='Re-read every settlement instead of only those since the last sync')
 
     
 
@@ -20,6 +22,9 @@ class Command(BaseCommand):
                 self.style.SUCCESS(f'Starting TMS data fetch for user: {user.username}')
             )
             
+            if options['all_accounts']:
+                return self.sync_all_accounts(user, options['full'])
+
             tms_number = options.get('tms_number')
             if not tms_number:
                 try:
@@ -37,7 +42,8 @@ class Command(BaseCommand):
             
             result = fetch_tms_data(
                 user=user,
-                tms_number=tms_number
+                tms_number=tms_number,
+                full_sync=options['full']
             )
             
             if result['success']:
@@ -52,6 +58,15 @@ class Command(BaseCommand):
                     self.stdout.write(
                         f'  - {record.scrip}: {record.units} units @ Rs.{record.buying_price}'
                     )
+
+                resource_stats = result.get('resource_stats')
+                if resource_stats:
+                    self.stdout.write(
+                        f'Blocked {resource_stats["blocked_requests"]} requests '
+                        f'{resource_stats["blocked_by_type"]}, saved '
+                        f'~{resource_stats["estimated_bytes_saved"] / 1024:.0f} KB and '
+                        f'~{resource_stats["estimated_time_saved_ms"] / 1000:.1f} s of transfer'
+                    )
             else:
                 self.stdout.write(
                     self.style.ERROR(f'Failed to fetch data: {result["error"]}')
@@ -64,4 +79,24 @@ class Command(BaseCommand):
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'Error: {str(e)}')
-            )
\ No newline at end of file
+            )
+
+    def sync_all_accounts(self, user, full_sync=False):
+        self.stdout.write(
+            self.style.WARNING('One browser window per broker account will open. Please login to each one.')
+        )
+        result = fetch_tms_data_multi(user=user, full_sync=full_sync)
+        for tms_number, server in result.get('servers', {}).items():
+            if server['success']:
+                since = ''.join(f', {section} since {day}' for section, day in (server.get('since') or {}).items())
+                self.stdout.write(self.style.SUCCESS(f'TMS{tms_number}: found {server["records_found"]} records{since}'))
+            else:
+                self.stdout.write(self.style.ERROR(f'TMS{tms_number}: {server["error"]}'))
+        if result['success']:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Imported {result["records_saved"]} new records out of {result["records_found"]} found'
+                )
+            )
+        else:
+            self.stdout.write(self.style.ERROR(f'Failed to fetch data: {result["error"]}'))
@@ -0,0 +1,48 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.models import Profile_ver
+from authentication.portfolio_data import generate_portfolio
+
+
+class Command(BaseCommand):
+    help = 'Create users with synthetic buy and FIFO sell history for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help='Users to create')
+        parser.add_argument('--transactions', type=int, default=1000, help='Buys and sell orders per user')
+        parser.add_argument('--scrips', type=int, default=20, help='Scrips traded per user')
+        parser.add_argument('--sell-ratio', type=float, default=0.3, help='Share of transactions that are sells')
+        parser.add_argument('--prefix', default='loadtest', help='Usernames are <prefix>1, <prefix>2, ...')
+        parser.add_argument('--password', default='loadtest', help='Password of the created users')
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable data')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['sell_ratio'] < 1:
+            raise CommandError('--sell-ratio must be at least 0 and below 1')
+        rng = random.Random(options['seed'])
+
+        for number in range(1, options['users'] + 1):
+            username = f'{options["prefix"]}{number}'
+            if User.objects.filter(username=username).exists():
+                raise CommandError(f'User {username} already exists; pick another --prefix')
+            user = User.objects.create_user(username=username, email=f'{username}@example.com', password=options['password'])
+            Profile_ver.objects.create(user=user, uid=f'{username}-{rng.getrandbits(64):x}', is_verified=True)
+
+            generate_portfolio(
+                user,
+                options['transactions'],
+                scrips=options['scrips'],
+                sell_ratio=options['sell_ratio'],
+                rng=rng,
+            )
+            self.stdout.write(
+                f'{username}: {user.share_purchases.count()} buys, {user.sell_orders.count()} sell orders '
+                f'({user.share_sales.count()} lots)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {options["users"]} user(s) with password "{options["password"]}"'
+        ))
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.tms_scheduler import AutoSyncScheduler
+from authentication.tms_service import PLAYWRIGHT_AVAILABLE
+
+
+class Command(BaseCommand):
+    help = 'Keep every TMS-configured user with a stored session synced (incremental, headless)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Sync the accounts that are due now and exit')
+        parser.add_argument('--every', type=int, default=60, help='Minutes between syncs of the same broker account')
+        parser.add_argument('--poll-interval', type=float, default=60, help='Seconds between scans for due accounts')
+        parser.add_argument('--concurrency', type=int, default=4, help='Syncs to run at once')
+        parser.add_argument('--per-server', type=int, default=2, help='Syncs to run at once against one TMS server')
+        parser.add_argument('--spacing', type=float, default=5, help='Minimum seconds between logins to one TMS server')
+        parser.add_argument('--queue-size', type=int, default=20, help='Accounts queued per TMS server before new ones are deferred')
+        parser.add_argument('--full', action='store_true', help='Re-read every settlement instead of only those since the last sync')
+
+    def handle(self, *args, **options):
+        if not PLAYWRIGHT_AVAILABLE:
+            raise CommandError('Playwright is not installed. Please run: pip install playwright && playwright install')
+        if not getattr(settings, 'TMS_STORE_SESSIONS', False):
+            self.stdout.write(self.style.WARNING(
+                'TMS_STORE_SESSIONS is off: sessions are not refreshed and only the ones already stored will sync'
+            ))
+
+        scheduler = AutoSyncScheduler(
+            concurrency=options['concurrency'],
+            per_server=options['per_server'],
+            spacing=options['spacing'],
+            queue_size=options['queue_size'],
+            sync_every=timedelta(minutes=options['every']),
+            full_sync=options['full'],
+            report=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Auto sync started: {options["concurrency"]} at once, {options["per_server"]} per TMS server, '
+            f'every {options["every"]} minutes'
+        ))
+        try:
+            stats = asyncio.run(scheduler.run(once=options['once'], poll_interval=options['poll_interval']))
+        except KeyboardInterrupt:
+            stats = scheduler.stats
+            self.stdout.write(self.style.WARNING('Auto sync stopped'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {stats["synced"]} account(s), saved {stats["saved"]} purchases; '
+            f'{stats["failed"]} failed, {stats["expired"]} session(s) expired, {stats["deferred"]} deferred'
+        ))
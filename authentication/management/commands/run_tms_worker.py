@@ -0,0 +1,67 @@
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from authentication.tms_jobs import arun_job, claim_next_job, requeue_stale_jobs, worker_name
+
+
+class Command(BaseCommand):
+    help = 'Process queued TMS sync jobs (run alongside the web server)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the queued jobs and exit instead of polling')
+        parser.add_argument('--poll-interval', type=float, default=5, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=15, help='Minutes without a heartbeat after which a running job is requeued')
+        parser.add_argument('--concurrency', type=int, default=2, help='TMS syncs to run at once on this worker')
+
+    def handle(self, *args, **options):
+        name = worker_name()
+        self.stdout.write(self.style.SUCCESS(f'TMS worker {name} started (concurrency {options["concurrency"]})'))
+        try:
+            asyncio.run(self.serve(name, options))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('TMS worker stopped'))
+
+    async def serve(self, name, options):
+        """Claim jobs while a slot is free; all syncs share this process' event loop"""
+        stale_after = timedelta(minutes=options['stale_after'])
+        slots = asyncio.Semaphore(max(1, options['concurrency']))
+        running = set()
+
+        while True:
+            requeued = await sync_to_async(requeue_stale_jobs)(stale_after)
+            if requeued:
+                self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale job(s)'))
+
+            await slots.acquire()
+            job = await sync_to_async(claim_next_job)(name)
+            if job is None:
+                slots.release()
+                if options['once']:
+                    break
+                await asyncio.sleep(options['poll_interval'])
+                continue
+
+            task = asyncio.create_task(self.process(job, slots))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+        if running:
+            await asyncio.gather(*running)
+
+    async def process(self, job, slots):
+        try:
+            self.stdout.write(f'Job {job.id}: TMS{job.tms_server_number} {job.settlement_type} for {job.user.username}')
+            result = await arun_job(job)
+            if result['success']:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f'Job {job.id}: found {result["records_found"]}, saved {result["records_saved"]}'
+                    )
+                )
+            else:
+                self.stdout.write(self.style.ERROR(f'Job {job.id} failed: {result["error"]}'))
+        finally:
+            slots.release()
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from authentication.models import TMSSyncRun
+from authentication.utils import PERCENTILES, percentile
+
+
+class Command(BaseCommand):
+    help = 'Percentiles of TMS sync duration and of each phase, per TMS server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Only include syncs started in the last N days')
+        parser.add_argument('--server', type=int, help='Only this TMS server number')
+        parser.add_argument('--settlement-type', help='Only this settlement type (e.g. PaymentDue)')
+        parser.add_argument('--failed', action='store_true', help='Include failed syncs in the timings')
+
+    def handle(self, *args, **options):
+        runs = TMSSyncRun.objects.filter(started_at__gte=timezone.now() - timedelta(days=options['days']))
+        if options['server']:
+            runs = runs.filter(tms_server_number=options['server'])
+        if options['settlement_type']:
+            runs = runs.filter(settlement_type=options['settlement_type'])
+
+        columns = ['duration_seconds', *TMSSyncRun.PHASE_FIELDS.values()]
+        rows = list(runs.values_list('tms_server_number', 'success', 'records_saved', *columns))
+        if not rows:
+            self.stdout.write(self.style.WARNING('No TMS sync runs recorded for this period'))
+            return
+
+        by_server = {}
+        for row in rows:
+            by_server.setdefault(row[0], []).append(row)
+        if len(by_server) > 1:
+            by_server['all'] = rows
+
+        for server, server_rows in by_server.items():
+            succeeded = sum(1 for row in server_rows if row[1])
+            saved = sum(row[2] for row in server_rows)
+            label = 'All servers' if server == 'all' else f'TMS{server}'
+            self.stdout.write(self.style.SUCCESS(
+                f'{label}: {len(server_rows)} syncs, {succeeded / len(server_rows):.0%} succeeded, {saved} purchases saved'
+            ))
+            timed = server_rows if options['failed'] else [row for row in server_rows if row[1]]
+            header = ''.join(f'{"p" + str(p):>10}' for p in PERCENTILES)
+            self.stdout.write(f'  {"phase":<10}{"runs":>6}{header}{"max":>10}')
+            for index, column in enumerate(columns, start=3):
+                values = sorted(row[index] for row in timed if row[index] is not None)
+                if not values:
+                    continue
+                name = column.replace('_seconds', '')
+                cells = ''.join(f'{percentile(values, p):>9.1f}s' for p in PERCENTILES)
+                self.stdout.write(f'  {name:<10}{len(values):>6}{cells}{values[-1]:>9.1f}s')
@@ -0,0 +1,149 @@
+"""
+Live market prices for open pages, as Server-Sent Events (ASGI only)
+
+One MarketBroadcaster per worker process polls the price feed every
+MARKET_STREAM_INTERVAL seconds while at least one page is connected and
+hands each connection only the symbols it asked for whose price moved since
+the last poll. Once the response has started, a connection is a small
+asyncio.Queue and a coroutine waiting on it - no thread and no database
+connection - so hundreds of idle pages cost tens of kilobytes each and one
+feed fetch per interval between them. The poll goes through
+fetch_nepse_stocks_and_ltp, so it shares the MARKET_FEED_CACHE_SECONDS
+snapshot with the page views.
+
+Under WSGI an open response would hold a worker thread for as long as the
+page stays open, so the endpoint answers 204 instead, which tells
+EventSource not to reconnect; pages then keep the prices they were
+rendered with.
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Set
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# Pending events per connection; a client that falls further behind is sent a
+# fresh snapshot instead of the backlog
+QUEUE_SIZE = 10
+# Milliseconds EventSource waits before reconnecting after a dropped connection
+RETRY_MS = 5000
+
+
+def price_map(stocks) -> Dict[str, Dict]:
+    """{symbol: {ltp, change, changePercent}} of a fetch_nepse_stocks_and_ltp() list"""
+    return {
+        stock['symbol']: {
+            'ltp': stock.get('ltp'),
+            'change': stock.get('change'),
+            'changePercent': stock.get('changePercent'),
+        }
+        for stock in stocks if stock.get('symbol')
+    }
+
+
+def price_changes(old: Dict[str, Dict], new: Dict[str, Dict]) -> Dict[str, Dict]:
+    """The symbols of new that are missing from old or priced differently"""
+    return {symbol: price for symbol, price in new.items() if old.get(symbol) != price}
+
+
+def sse_event(kind: str, data) -> str:
+    return f'event: {kind}\ndata: {json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"))}\n\n'
+
+
+class Subscriber:
+    """One open stream: the symbols it follows (None for all) and its pending events"""
+
+    def __init__(self, symbols: Optional[Set[str]]):
+        self.symbols = symbols
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def select(self, prices: Dict[str, Dict]) -> Dict[str, Dict]:
+        if self.symbols is None:
+            return prices
+        return {symbol: prices[symbol] for symbol in self.symbols if symbol in prices}
+
+
+class MarketBroadcaster:
+    """The latest prices of this process and the streams waiting for changes"""
+
+    def __init__(self):
+        self.prices: Dict[str, Dict] = {}
+        self.subscribers: Set[Subscriber] = set()
+        self._poller = None
+
+    def subscribe(self, symbols: Optional[Set[str]]) -> Subscriber:
+        loop = asyncio.get_running_loop()
+        if self._poller is not None and self._poller.get_loop() is not loop:
+            # Only in tests: an earlier event loop left its poller behind
+            self.subscribers.clear()
+            self._poller = None
+        subscriber = Subscriber(symbols)
+        self.subscribers.add(subscriber)
+        if self._poller is None or self._poller.done():
+            self._poller = loop.create_task(self._poll())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _poll(self):
+        """Refresh until the last stream closes; the next subscriber starts a new poller"""
+        interval = getattr(settings, 'MARKET_STREAM_INTERVAL', 15)
+        while self.subscribers:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Market stream refresh failed")
+            await asyncio.sleep(interval)
+
+    async def refresh(self):
+        from .nepse_api_utils import fetch_nepse_stocks_and_ltp
+
+        # The feed uses blocking requests; run it outside the event loop and the request thread
+        stocks = await sync_to_async(fetch_nepse_stocks_and_ltp, thread_sensitive=False)()
+        if not stocks:
+            # Feed and its file cache both unavailable: keep the last prices on screen
+            return
+        prices = price_map(stocks)
+        changes = price_changes(self.prices, prices)
+        self.prices = prices
+        if changes:
+            self.publish(changes)
+
+    def publish(self, changes: Dict[str, Dict]):
+        for subscriber in list(self.subscribers):
+            selected = subscriber.select(changes)
+            if not selected:
+                continue
+            try:
+                subscriber.queue.put_nowait(('prices', selected))
+            except asyncio.QueueFull:
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(('snapshot', subscriber.select(self.prices)))
+
+    async def stream(self, symbols: Optional[Set[str]]):
+        """The SSE body of one connection: a snapshot, then the changes, with keep-alive comments"""
+        heartbeat = getattr(settings, 'MARKET_STREAM_HEARTBEAT', 20)
+        subscriber = self.subscribe(symbols)
+        try:
+            yield f'retry: {RETRY_MS}\n' + sse_event('snapshot', subscriber.select(self.prices))
+            while True:
+                try:
+                    kind, data = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    # Keeps proxies and load balancers from closing an idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                yield sse_event(kind, data)
+        finally:
+            # Also reached when the client disconnects and Django cancels the response
+            self.unsubscribe(subscriber)
+
+
+broadcaster = MarketBroadcaster()
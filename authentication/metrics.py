@@ -0,0 +1,342 @@
+"""
+Prometheus-style metrics, exposed as text at /metrics
+
+Counters and histograms live in plain dicts behind one lock per process, so
+recording a value costs a dict update. Under several worker processes
+(gunicorn, run_tms_worker) set METRICS_DIR to a directory all of them can
+write: each process then snapshots its values to
+<dir>/<host>-<pid>-<start>.json every METRICS_FLUSH_SECONDS, and /metrics
+adds up every snapshot in the directory. So counters never go backwards, a
+scrape folds the snapshots of exited workers on its host into one totals file
+(exited.json) instead of deleting them; the directory holds one file per
+running worker plus that one, however often the app restarts.
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshots of exited workers are summed as they are
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds, tuned for page views and API calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Seconds, for browser-driven TMS syncs
+SYNC_BUCKETS = (5, 10, 20, 30, 60, 120, 300, 600)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Sum of the snapshots of exited workers, in the same format
+TOTALS_FILE = 'exited.json'
+
+_registry: Dict[str, 'Metric'] = {}
+_lock = threading.Lock()
+_state = {'dirty': False, 'flusher': None, 'file': None}
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], object] = {}
+        _registry[name] = self
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            _state['dirty'] = True
+        _start_flusher()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            # [count per bucket..., +Inf count, sum]
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+            _state['dirty'] = True
+        _start_flusher()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the block, whether or not it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Time to build a response, by URL name', ('view', 'method', 'status'))
+http_request_queries = Histogram(
+    'http_request_db_queries', 'Database queries run per request, by URL name', ('view',), COUNT_BUCKETS)
+market_feed_duration = Histogram(
+    'market_feed_fetch_duration_seconds', 'NEPSE price feed fetches, including the cache fallback', ('outcome',))
+market_feed_errors = Counter(
+    'market_feed_upstream_errors_total', 'NEPSE price feed requests that failed')
+market_feed_cache = Counter(
+    'market_feed_cache_total', 'Cache lookups after a failed feed request: hit, stale or miss', ('result',))
+tms_sync_duration = Histogram(
+    'tms_sync_duration_seconds', 'TMS sync duration per server', ('tms', 'success'), SYNC_BUCKETS)
+tms_rows_imported = Counter(
+    'tms_rows_imported_total', 'Purchases saved by TMS syncs', ('tms',))
+sell_orders = Counter(
+    'sell_orders_total', 'Sell orders recorded')
+sell_lots = Histogram(
+    'sell_order_lots', 'Purchase lots a sell order was allocated across (FIFO)', (), COUNT_BUCKETS)
+sell_allocation_duration = Histogram(
+    'sell_allocation_duration_seconds', 'Time to allocate and save a sell order and its lots')
+
+
+def _snapshot() -> Dict:
+    with _lock:
+        _state['dirty'] = False
+        return {
+            metric.name: [[list(key), value if metric.kind == 'counter' else list(value)] for key, value in metric.values.items()]
+            for metric in _registry.values()
+        }
+
+
+def flush():
+    """Write this process's values to METRICS_DIR (no-op without it)"""
+    directory = getattr(settings, 'METRICS_DIR', '')
+    if not directory:
+        return
+    if _state['file'] is None:
+        _state['file'] = os.path.join(directory, f'{socket.gethostname()}-{os.getpid()}-{int(time.time())}.json')
+    temporary = f"{_state['file']}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(temporary, 'w') as f:
+            json.dump(_snapshot(), f)
+        os.replace(temporary, _state['file'])
+    except OSError as e:
+        logger.warning("Could not write metrics to %s: %s", directory, e)
+
+
+def _flush_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        if _state['dirty']:
+            flush()
+
+
+def _start_flusher():
+    """Start the background snapshot thread of this process, once"""
+    if _state['flusher'] is not None or not getattr(settings, 'METRICS_DIR', ''):
+        return
+    with _lock:
+        if _state['flusher'] is not None:
+            return
+        _state['flusher'] = threading.Thread(
+            target=_flush_loop, args=(getattr(settings, 'METRICS_FLUSH_SECONDS', 5),), daemon=True, name='metrics-flush')
+    _state['flusher'].start()
+    atexit.register(flush)
+
+
+def _after_fork():
+    """A forked worker starts from zero with its own file and flush thread"""
+    global _lock
+    _lock = threading.Lock()
+    for metric in _registry.values():
+        metric.values = {}
+    _state.update(dirty=False, flusher=None, file=None)
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _read_snapshot(directory: str, filename: str):
+    try:
+        with open(os.path.join(directory, filename)) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Skipping unreadable metrics file %s: %s", filename, e)
+        return None
+
+
+def _add_snapshot(totals: Dict[str, Dict], snapshot: Dict, names=None):
+    """Add a snapshot's series to totals ({metric name: {label values: value}})"""
+    for name, series in snapshot.items():
+        if names is not None and name not in names:
+            continue
+        target = totals.setdefault(name, {})
+        for key, value in series:
+            key = tuple(key)
+            if isinstance(value, list):
+                current = target.get(key)
+                target[key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                target[key] = target.get(key, 0) + value
+
+
+def _process_exited(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _compact(directory: str):
+    """Fold the snapshots of this host's exited workers into TOTALS_FILE, under a lock"""
+    if fcntl is None:
+        return
+    host = socket.gethostname()
+    try:
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited = []
+            for filename in os.listdir(directory):
+                if not filename.endswith('.json'):
+                    continue
+                # <host>-<pid>-<start>.json
+                owner, _, pid = filename[:-len('.json')].rpartition('-')[0].rpartition('-')
+                if owner == host and pid.isdigit() and _process_exited(int(pid)):
+                    exited.append(filename)
+            if not exited:
+                return
+
+            totals = {}
+            if os.path.exists(os.path.join(directory, TOTALS_FILE)):
+                snapshot = _read_snapshot(directory, TOTALS_FILE)
+                if snapshot is None:
+                    # Rewriting it would lose the history it holds
+                    return
+                _add_snapshot(totals, snapshot)
+            for filename in exited:
+                snapshot = _read_snapshot(directory, filename)
+                if snapshot is not None:
+                    _add_snapshot(totals, snapshot)
+
+            temporary = os.path.join(directory, f'{TOTALS_FILE}.tmp')
+            with open(temporary, 'w') as f:
+                json.dump({name: [[list(key), value] for key, value in series.items()] for name, series in totals.items()}, f)
+            os.replace(temporary, os.path.join(directory, TOTALS_FILE))
+            for filename in exited:
+                os.remove(os.path.join(directory, filename))
+    except OSError as e:
+        logger.warning("Could not compact metrics in %s: %s", directory, e)
+
+
+def _collect() -> Dict[str, Dict]:
+    """{metric name: {label values: value}} for this process, or summed over METRICS_DIR"""
+    directory = getattr(settings, 'METRICS_DIR', '')
+    if not directory:
+        with _lock:
+            return {
+                metric.name: {key: value if metric.kind == 'counter' else list(value) for key, value in metric.values.items()}
+                for metric in _registry.values()
+            }
+
+    flush()
+    _compact(directory)
+    totals = {name: {} for name in _registry}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        snapshot = _read_snapshot(directory, filename)
+        if snapshot is not None:
+            _add_snapshot(totals, snapshot, names=_registry)
+    return totals
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render() -> str:
+    """The Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    totals = _collect()
+    for metric in _registry.values():
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for key, value in sorted(totals.get(metric.name, {}).items()):
+            if metric.kind == 'counter':
+                lines.append(f'{metric.name}{_labels(metric.labels, key)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value):
+                cumulative += count
+                lines.append(f'{metric.name}_bucket{_labels(metric.labels, key, ("le", bound))} {cumulative}')
+            lines.append(f'{metric.name}_count{_labels(metric.labels, key)} {cumulative}')
+            lines.append(f'{metric.name}_sum{_labels(metric.labels, key)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Latency and query count of each request, labelled by URL name"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path.startswith(settings.STATIC_URL or '/static/'):
+            return self.get_response(request)
+
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        http_request_duration.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        http_request_queries.observe(queries[0], view=view)
+        return response
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-19 05:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_tmssyncjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='share_buy',
+            name='tms_import_key',
+            field=models.CharField(blank=True, editable=False, help_text='Idempotency key for rows imported from TMS', max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='share_buy',
+            constraint=models.UniqueConstraint(fields=('user', 'tms_import_key'), name='unique_tms_import_key_per_user'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-19 05:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_share_buy_tms_import_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tmssyncjob',
+            name='all_accounts',
+            field=models.BooleanField(default=False, help_text='Sync every active broker account of the user concurrently'),
+        ),
+        migrations.CreateModel(
+            name='TMSBrokerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tms_server_number', models.IntegerField(help_text='TMS server number (e.g. 51-58)')),
+                ('label', models.CharField(blank=True, help_text='Broker name, for display', max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tms_accounts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['tms_server_number'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'tms_server_number'), name='unique_tms_account_per_user')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-19 05:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_tmsbrokeraccount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tmsbrokeraccount',
+            name='last_payment_due_date',
+            field=models.DateField(blank=True, help_text='Newest Payment Due business date read from TMS; incremental syncs start here', null=True),
+        ),
+        migrations.AddField(
+            model_name='tmsbrokeraccount',
+            name='last_success_date',
+            field=models.DateField(blank=True, help_text='Newest settled (Success) business date read from TMS; incremental syncs start here', null=True),
+        ),
+        migrations.AddField(
+            model_name='tmssyncjob',
+            name='full_sync',
+            field=models.BooleanField(default=False, help_text='Re-read every settlement instead of only those since the last sync'),
+        ),
+    ]
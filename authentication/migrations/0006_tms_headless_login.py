@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0005_incremental_tms_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tmssyncjob',
+            name='captcha_image',
+            field=models.TextField(blank=True, help_text='Base64 PNG of the TMS captcha while waiting for the user'),
+        ),
+        migrations.AlterField(
+            model_name='tmssyncjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('awaiting_login', 'Waiting for captcha'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-19 05:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0006_tms_headless_login'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TMSSyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tms_server_number', models.IntegerField()),
+                ('settlement_type', models.CharField(max_length=40)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('success', models.BooleanField(default=False)),
+                ('records_found', models.PositiveIntegerField(default=0)),
+                ('records_saved', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('duration_seconds', models.FloatField(help_text='Wall time of the whole sync')),
+                ('launch_seconds', models.FloatField(blank=True, null=True)),
+                ('login_seconds', models.FloatField(blank=True, help_text='Includes waiting for the user to solve the captcha', null=True)),
+                ('navigate_seconds', models.FloatField(blank=True, null=True)),
+                ('expand_seconds', models.FloatField(blank=True, null=True)),
+                ('extract_seconds', models.FloatField(blank=True, null=True)),
+                ('save_seconds', models.FloatField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tms_sync_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['tms_server_number', 'started_at'], name='authenticat_tms_ser_f423d3_idx')],
+            },
+        ),
+    ]
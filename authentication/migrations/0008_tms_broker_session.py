@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0007_tmssyncrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tmsbrokeraccount',
+            name='session_saved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tmsbrokeraccount',
+            name='session_state',
+            field=models.TextField(blank=True, help_text='Browser cookies of the last TMS login (Playwright storage state), used by scheduled syncs'),
+        ),
+    ]
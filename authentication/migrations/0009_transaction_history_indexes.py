@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 06:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0008_tms_broker_session'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='share_buy',
+            index=models.Index(fields=['user', 'transaction_date', 'id'], name='authenticat_user_id_1e879f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='share_sell',
+            index=models.Index(fields=['user', 'transaction_date', 'id'], name='authenticat_user_id_d89209_idx'),
+        ),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 5.2.4 on 2026-10-19 06:12
+
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# The fee schedule the existing sales were shown with, copied here so later
+# changes to authentication.fees don't change how this migration converts them
+SEBON_FEE_RATE = Decimal('0.00015')
+DP_CHARGE = Decimal('25.00')
+# (transaction amount up to, broker commission %) - the last slab has no upper bound
+BROKER_RATE_SLABS = (
+    (Decimal('50000'), Decimal('0.36')),
+    (Decimal('500000'), Decimal('0.33')),
+    (Decimal('2000000'), Decimal('0.31')),
+    (Decimal('10000000'), Decimal('0.27')),
+    (None, Decimal('0.24')),
+)
+CGT_SHORT_TERM_RATE = Decimal('0.075')
+CGT_LONG_TERM_RATE = Decimal('0.05')
+# Share_Sell.calculate_profit_loss taxed a sale as long term from 365 days held
+LONG_TERM_DAYS = 365
+
+
+def broker_rate(amount):
+    for limit, rate in BROKER_RATE_SLABS:
+        if limit is None or amount <= limit:
+            return rate
+
+
+def capital_gains_tax_rate(holding_period_days):
+    return CGT_LONG_TERM_RATE if holding_period_days >= LONG_TERM_DAYS else CGT_SHORT_TERM_RATE
+
+
+def create_sell_orders(apps, schema_editor):
+    """
+    One SellOrder per existing sell action: rows sharing a transaction_group, or
+    the date and price for rows recorded before groups existed, within a scrip
+    """
+    Share_Buy = apps.get_model('authentication', 'Share_Buy')
+    Share_Sell = apps.get_model('authentication', 'Share_Sell')
+    SellOrder = apps.get_model('authentication', 'SellOrder')
+
+    # WACC over all purchases per (user, scrip), as Share_Buy.calculate_costs works it out
+    wacc_parts = defaultdict(lambda: [Decimal('0'), 0])
+    for share in Share_Buy.objects.all().iterator():
+        amount = share.units * share.buying_price
+        total = amount + amount * SEBON_FEE_RATE + DP_CHARGE + amount * broker_rate(amount) / 100
+        wacc_parts[(share.user_id, share.scrip)][0] += total
+        wacc_parts[(share.user_id, share.scrip)][1] += share.units
+
+    groups = defaultdict(list)
+    for sale in Share_Sell.objects.select_related('share').order_by('id').iterator():
+        key = sale.transaction_group or f'{sale.transaction_date}_{sale.selling_price}'
+        groups[(sale.user_id, sale.share.scrip, key)].append(sale)
+
+    for (user_id, scrip, _), lots in groups.items():
+        total_cost, total_units = wacc_parts[(user_id, scrip)]
+        wacc = total_cost / total_units if total_units else Decimal('0')
+        units_sold = sum(lot.units_sold for lot in lots)
+        transaction_date = lots[0].transaction_date
+        holding_period_days = (transaction_date - min(lot.share.transaction_date for lot in lots)).days
+        gross = lots[0].selling_price * units_sold
+        sebon_fee = gross * SEBON_FEE_RATE
+        commission = gross * broker_rate(gross) / 100
+        net_sale = gross - sebon_fee - DP_CHARGE - commission
+        buy_cost = wacc * units_sold
+        profit = net_sale - buy_cost
+        cgt = profit * capital_gains_tax_rate(holding_period_days) if profit > 0 else Decimal('0')
+
+        order = SellOrder.objects.create(
+            user_id=user_id,
+            scrip=scrip,
+            units_sold=units_sold,
+            selling_price=lots[0].selling_price,
+            transaction_date=transaction_date,
+            wacc=wacc,
+            holding_period_days=holding_period_days,
+            gross_amount=gross,
+            sebon_fee=sebon_fee,
+            dp_charge=DP_CHARGE,
+            broker_commission=commission,
+            buy_cost=buy_cost,
+            capital_gains_tax=cgt,
+            net_amount=net_sale - cgt,
+        )
+        Share_Sell.objects.filter(id__in=[lot.id for lot in lots]).update(order=order)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0009_transaction_history_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scrip', models.CharField(max_length=20)),
+                ('units_sold', models.PositiveIntegerField()),
+                ('selling_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('transaction_date', models.DateField()),
+                ('wacc', models.DecimalField(decimal_places=4, help_text='Scrip WACC the buy cost was taken at', max_digits=14)),
+                ('holding_period_days', models.IntegerField(default=0, help_text='Days since the earliest lot was bought')),
+                ('gross_amount', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('sebon_fee', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('dp_charge', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('broker_commission', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('buy_cost', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('capital_gains_tax', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('net_amount', models.DecimalField(decimal_places=2, help_text='Receivable after fees and tax', max_digits=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sell_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='share_sell',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lots', to='authentication.sellorder'),
+        ),
+        migrations.AddIndex(
+            model_name='sellorder',
+            index=models.Index(fields=['user', 'transaction_date', 'id'], name='authenticat_user_id_2a236f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sellorder',
+            index=models.Index(fields=['user', 'scrip', 'transaction_date'], name='authenticat_user_id_56af5d_idx'),
+        ),
+        migrations.RunPython(create_sell_orders, migrations.RunPython.noop),
+    ]
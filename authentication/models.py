@@ -1,8 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from decimal import Decimal
 import logging
+import uuid
+
+from . import fees, metrics
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +33,45 @@ class Profile_ver(models.Model):
         """Get the TMS settlement URL based on server number"""
         return f"https://tms{self.tms_server_number}.nepsetms.com.np/tms/me/gen-bank/settlement-buy-info#PaymentDue"
 
+    def get_tms_servers(self):
+        """Server numbers of the user's active broker accounts, or the profile's single server"""
+        servers = list(
+            TMSBrokerAccount.objects.filter(user=self.user, is_active=True)
+            .order_by('tms_server_number')
+            .values_list('tms_server_number', flat=True)
+        )
+        return servers or [self.tms_server_number]
+
+
+class TMSBrokerAccount(models.Model):
+    """One broker (TMS server) the user trades through - No credentials stored"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tms_accounts')
+    tms_server_number = models.IntegerField(help_text="TMS server number (e.g. 51-58)")
+    label = models.CharField(max_length=100, blank=True, help_text="Broker name, for display")
+    is_active = models.BooleanField(default=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    # Incremental sync watermarks, one per settlement section: the newest business
+    # date read off that section's page; an empty one means the next sync reads it all
+    last_payment_due_date = models.DateField(null=True, blank=True, help_text="Newest Payment Due business date read from TMS; incremental syncs start here")
+    last_success_date = models.DateField(null=True, blank=True, help_text="Newest settled (Success) business date read from TMS; incremental syncs start here")
+    session_state = models.TextField(blank=True, help_text="Browser cookies of the last TMS login (Playwright storage state), used by scheduled syncs")
+    session_saved_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['tms_server_number']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'tms_server_number'], name='unique_tms_account_per_user'),
+        ]
+
+    @staticmethod
+    def watermark_field(settlement_type: str) -> str:
+        """Watermark column of a settlement section; every section but Success is a Payment Due page"""
+        return 'last_success_date' if settlement_type == 'Success' else 'last_payment_due_date'
+
+    def __str__(self):
+        return f"{self.user.username} - TMS{self.tms_server_number}{f' ({self.label})' if self.label else ''}"
+
 
 class TMSConfiguration(models.Model):
     """System-level TMS configuration for reference only - No credentials stored"""
@@ -71,30 +114,34 @@ class Share_Buy(models.Model):
     buying_price = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_date = models.DateField()  
     remaining_units = models.PositiveIntegerField(default=0) 
+    tms_import_key = models.CharField(max_length=64, null=True, blank=True, editable=False, help_text="Idempotency key for rows imported from TMS")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'tms_import_key'], name='unique_tms_import_key_per_user'),
+        ]
+        indexes = [
+            # Keyset pagination of a user's history in the API
+            models.Index(fields=['user', 'transaction_date', 'id']),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.pk:  # New record
             self.remaining_units = self.units
         super().save(*args, **kwargs)
 
+    @property
+    def gross_amount(self):
+        return self.units * self.buying_price
+
     def get_broker_rate(self):  
-        total_amount = self.units * self.buying_price
-        if total_amount <= 50000: 
-            return 0.36
-        elif total_amount <= 500000: 
-            return 0.33
-        elif total_amount <= 2000000: 
-            return 0.31
-        elif total_amount <= 10000000: 
-            return 0.27
-        else: 
-            return 0.24
+        return fees.broker_rate(self.units * self.buying_price)
 
     def calculate_costs(self): 
         total_amount = self.units * self.buying_price
-        sebon_fee = total_amount * Decimal('0.00015')
-        dp_charge = Decimal('25')
-        broker_commission = total_amount * (Decimal(str(self.get_broker_rate())) / Decimal('100'))
+        sebon_fee = total_amount * fees.SEBON_FEE_RATE
+        dp_charge = fees.DP_CHARGE
+        broker_commission = total_amount * self.get_broker_rate() / 100
         total_cost = total_amount + sebon_fee + dp_charge + broker_commission
         cost_per_share = total_cost / self.units
         total_amount = cost_per_share*self.units
@@ -107,6 +154,26 @@ class Share_Buy(models.Model):
             'total_amount': total_amount,
         }
 
+    @classmethod
+    def scrip_wacc(cls, user, scrip):
+        """WACC over ALL purchases of a scrip (not just remaining units), so selling does not move it"""
+        return cls.scrip_waccs(user, [scrip]).get(scrip, Decimal('0'))
+
+    @classmethod
+    def scrip_waccs(cls, user, scrips=None):
+        """{scrip: WACC} for several scrips (all of the user's by default) from one query"""
+        purchases = cls.objects.filter(user=user)
+        if scrips is not None:
+            purchases = purchases.filter(scrip__in=set(scrips))
+        totals = {}
+        for share in purchases:
+            total_cost, total_units = totals.get(share.scrip, (Decimal('0'), 0))
+            totals[share.scrip] = (total_cost + share.calculate_costs()['total_amount'], total_units + share.units)
+        return {
+            scrip: total_cost / total_units if total_units > 0 else Decimal('0')
+            for scrip, (total_cost, total_units) in totals.items()
+        }
+
     @property
     def availability_status(self):
         """Show if shares are available for selling"""
@@ -119,19 +186,221 @@ class Share_Buy(models.Model):
         return f"{self.scrip} - {self.units} units @ Rs.{self.buying_price} (Available: {self.remaining_units})"
 
 
+class SellOrder(models.Model):
+    """
+    One sell action as the user entered it. Its Share_Sell rows (`lots`) are the
+    FIFO allocation across purchases; the amounts are worked out once for the
+    whole order when it is recorded, like the broker bills it
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sell_orders')
+    scrip = models.CharField(max_length=20)
+    units_sold = models.PositiveIntegerField()
+    selling_price = models.DecimalField(max_digits=10, decimal_places=2)
+    transaction_date = models.DateField()
+    wacc = models.DecimalField(max_digits=14, decimal_places=4, help_text="Scrip WACC the buy cost was taken at")
+    holding_period_days = models.IntegerField(default=0, help_text="Days since the earliest lot was bought")
+    gross_amount = models.DecimalField(max_digits=16, decimal_places=2)
+    sebon_fee = models.DecimalField(max_digits=14, decimal_places=2)
+    dp_charge = models.DecimalField(max_digits=10, decimal_places=2)
+    broker_commission = models.DecimalField(max_digits=14, decimal_places=2)
+    buy_cost = models.DecimalField(max_digits=16, decimal_places=2)
+    capital_gains_tax = models.DecimalField(max_digits=14, decimal_places=2)
+    net_amount = models.DecimalField(max_digits=16, decimal_places=2, help_text="Receivable after fees and tax")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'transaction_date', 'id']),
+            models.Index(fields=['user', 'scrip', 'transaction_date']),
+        ]
+
+    @classmethod
+    def record(cls, user, shares, units_sold, selling_price, transaction_date, wacc=None):
+        """
+        Sell units_sold from shares (purchases of one scrip in FIFO order): the order
+        and one Share_Sell lot per purchase used, saved together
+        """
+        shares = list(shares)
+        scrip = shares[0].scrip
+        if wacc is None:
+            wacc = Share_Buy.scrip_wacc(user, scrip)
+
+        lots = 0
+        with metrics.sell_allocation_duration.time(), transaction.atomic():
+            order = cls(
+                user=user,
+                scrip=scrip,
+                units_sold=units_sold,
+                selling_price=selling_price,
+                transaction_date=transaction_date,
+            )
+            order.calculate(wacc, shares[0].transaction_date)
+            order.save()
+
+            # transaction_group is kept for API clients that group lots by it
+            transaction_group = str(uuid.uuid4())
+            remaining_to_sell = units_sold
+            for share in shares:
+                if remaining_to_sell <= 0:
+                    break
+                units_from_this_share = min(remaining_to_sell, share.remaining_units)
+                Share_Sell.objects.create(
+                    user=user,
+                    order=order,
+                    share=share,
+                    units_sold=units_from_this_share,
+                    selling_price=selling_price,
+                    transaction_date=transaction_date,
+                    transaction_group=transaction_group,
+                )
+                remaining_to_sell -= units_from_this_share
+                lots += 1
+        metrics.sell_orders.inc()
+        metrics.sell_lots.observe(lots)
+        return order
+
+    def calculate(self, wacc, first_purchase_date):
+        """Set the fee, tax and net amounts from units, price and the scrip's WACC"""
+        self.wacc = wacc
+        self.holding_period_days = (self.transaction_date - first_purchase_date).days
+        self.gross_amount = self.selling_price * self.units_sold
+        self.sebon_fee = self.gross_amount * fees.SEBON_FEE_RATE
+        self.dp_charge = fees.DP_CHARGE
+        self.broker_commission = self.gross_amount * fees.broker_rate(self.gross_amount) / 100
+        self.buy_cost = wacc * self.units_sold
+
+        net_sale = self.gross_amount - self.sebon_fee - self.dp_charge - self.broker_commission
+        profit_before_tax = net_sale - self.buy_cost
+        if profit_before_tax > 0:
+            self.capital_gains_tax = profit_before_tax * fees.capital_gains_tax_rate(self.holding_period_days)
+        else:
+            self.capital_gains_tax = Decimal('0')
+        self.net_amount = net_sale - self.capital_gains_tax
+
+    def refresh_from_lots(self):
+        """
+        Recalculate after one of the lots, or a purchase it sold from, was edited
+        or deleted; the WACC is taken again from the scrip's purchases as they are
+        now. Deletes the order once it has no lots
+        """
+        lots = list(self.lots.select_related('share').order_by('id'))
+        if not lots:
+            self.delete()
+            return
+        self.units_sold = sum(lot.units_sold for lot in lots)
+        self.selling_price = lots[0].selling_price
+        self.transaction_date = lots[0].transaction_date
+        self.calculate(Share_Buy.scrip_wacc(self.user_id, self.scrip), min(lot.share.transaction_date for lot in lots))
+        self.save()
+
+    @classmethod
+    def refresh_for_purchase(cls, share):
+        """Recalculate every order that sold units of share, after the purchase was edited"""
+        with transaction.atomic():
+            for order in cls.objects.filter(lots__share=share).distinct():
+                order.refresh_from_lots()
+
+    @property
+    def broker_rate(self):
+        return fees.broker_rate(self.gross_amount)
+
+    @property
+    def tax_rate(self):
+        return fees.capital_gains_tax_rate(self.holding_period_days)
+
+    @property
+    def net_sale(self):
+        return self.gross_amount - self.sebon_fee - self.dp_charge - self.broker_commission
+
+    @property
+    def profit_before_tax(self):
+        return self.net_sale - self.buy_cost
+
+    @property
+    def final_profit(self):
+        return self.profit_before_tax - self.capital_gains_tax
+
+    def profit_loss(self):
+        """The stored amounts under the keys of Share_Sell.calculate_profit_loss"""
+        return {
+            'gross_sale': self.gross_amount,
+            'sebon_fee': self.sebon_fee,
+            'dp_charge': self.dp_charge,
+            'broker_commission': self.broker_commission,
+            'net_sale': self.net_sale,
+            'receivable_amount': self.net_amount,
+            'total_buy_cost': self.buy_cost,
+            'profit_before_tax': self.profit_before_tax,
+            'tax_amount': self.capital_gains_tax,
+            'final_profit': self.final_profit,
+            'holding_period_days': self.holding_period_days,
+            'tax_rate': self.tax_rate,
+            'tax_rate_percentage': float(self.tax_rate * 100),
+            'wacc': self.wacc,
+        }
+
+    def __str__(self):
+        return f"{self.scrip} - {self.units_sold} units sold @ Rs.{self.selling_price} on {self.transaction_date}"
+
+
 class Share_Sell(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='share_sales')
+    order = models.ForeignKey(SellOrder, on_delete=models.CASCADE, null=True, blank=True, related_name='lots')
     share = models.ForeignKey(Share_Buy, on_delete=models.CASCADE)
     units_sold = models.PositiveIntegerField()
     selling_price = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_date = models.DateField()
     transaction_group = models.CharField(max_length=100, null=True, blank=True, help_text="Groups sell records from the same user transaction") 
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'transaction_date', 'id']),
+        ]
+
     @classmethod
     def get_available_shares(cls, user):
         """Get all shares that have remaining units available for selling for a specific user"""
         return Share_Buy.objects.filter(user=user, remaining_units__gt=0).order_by('scrip', 'transaction_date')
 
+    @classmethod
+    def get_holdings(cls, user):
+        """
+        Sellable holdings, one entry per scrip with its remaining lots in FIFO order
+        and the WACC over all of the scrip's purchases, from a single query
+        """
+        holdings = {}
+        for share in Share_Buy.objects.filter(user=user).order_by('scrip', 'transaction_date', 'id'):
+            data = holdings.setdefault(share.scrip, {
+                'all_cost': Decimal('0'),
+                'all_units': 0,
+                'total_units': 0,
+                'share_ids': [],
+                'earliest_date': None,
+                'transactions': [],
+            })
+            # WACC uses ALL purchases (not just remaining units) so it stays the same as units are sold
+            data['all_cost'] += share.calculate_costs()['total_amount']
+            data['all_units'] += share.units
+            if share.remaining_units > 0:
+                data['total_units'] += share.remaining_units
+                data['share_ids'].append(share.id)
+                data['transactions'].append(share)
+                if data['earliest_date'] is None:
+                    data['earliest_date'] = share.transaction_date
+
+        return [
+            {
+                'scrip': scrip,
+                'total_units': data['total_units'],
+                'wacc': float(data['all_cost'] / data['all_units']) if data['all_units'] > 0 else 0,
+                'earliest_date': data['earliest_date'],
+                'share_ids': ','.join(map(str, data['share_ids'])),  # Comma-separated IDs for selection
+                'transactions': data['transactions'],
+            }
+            for scrip, data in sorted(holdings.items())
+            if data['total_units'] > 0
+        ]
+
     @classmethod
     def get_available_scrips(cls, user):
         """Get list of unique scrips that have units available for selling for a specific user"""
@@ -153,49 +422,28 @@ class Share_Sell(models.Model):
         super().save(*args, **kwargs)
 
     def get_broker_rate(self):  
-        total_amount = self.units_sold * self.selling_price
-        if total_amount <= 50000: 
-            return 0.36
-        elif total_amount <= 500000: 
-            return 0.33
-        elif total_amount <= 2000000: 
-            return 0.31
-        elif total_amount <= 10000000: 
-            return 0.27
-        else: 
-            return 0.24
-
-    def calculate_profit_loss(self):
-        scrip = self.share.scrip
-        user = self.share.user
-        all_buys = Share_Buy.objects.filter(user=user, scrip=scrip)
-        
-        total_cost = Decimal('0')
-        total_units = 0
-        for buy in all_buys:
-            costs = buy.calculate_costs()
-            total_cost += costs['total_amount']
-            total_units += buy.units
-        
-        wacc = total_cost / total_units if total_units > 0 else Decimal('0')
+        return fees.broker_rate(self.units_sold * self.selling_price)
+
+    def calculate_profit_loss(self, wacc=None):
+        """Fees, tax and P&L of this lot; pass the scrip's WACC when it is already known to skip its query"""
+        if wacc is None:
+            wacc = Share_Buy.scrip_wacc(self.share.user_id, self.share.scrip)
         total_buy_amount = wacc * self.units_sold
         
         gross_sale = self.units_sold * self.selling_price
-        sebon_fee = gross_sale * Decimal('0.00015')
-        dp_charge = Decimal('25')
-        broker_commission = gross_sale * (Decimal(str(self.get_broker_rate())) / Decimal('100'))
+        sebon_fee = gross_sale * fees.SEBON_FEE_RATE
+        dp_charge = fees.DP_CHARGE
+        broker_commission = gross_sale * self.get_broker_rate() / 100
         net_sale = gross_sale - sebon_fee - dp_charge - broker_commission
         
         profit_before_tax = net_sale - total_buy_amount
         
         tax_amount = Decimal('0')
         holding_period_days = (self.transaction_date - self.share.transaction_date).days
+        tax_rate = fees.capital_gains_tax_rate(holding_period_days)
         
         if profit_before_tax > 0:
-            if holding_period_days >= 365:  
-                tax_amount = profit_before_tax * Decimal('0.05') 
-            else:  
-                tax_amount = profit_before_tax * Decimal('0.075')  
+            tax_amount = profit_before_tax * tax_rate
         
         final_profit = profit_before_tax - tax_amount
         receivable_amount = net_sale - tax_amount 
@@ -212,8 +460,8 @@ class Share_Sell(models.Model):
             'tax_amount': tax_amount,
             'final_profit': final_profit,
             'holding_period_days': holding_period_days,
-            'tax_rate': Decimal('0.05') if holding_period_days >= 365 else Decimal('0.075'),
-            'tax_rate_percentage': 5 if holding_period_days >= 365 else 7.5,  # Add percentage for templates
+            'tax_rate': tax_rate,
+            'tax_rate_percentage': float(tax_rate * 100),  # Add percentage for templates
             'wacc': wacc,  # Add WACC for reference
         }
 
@@ -223,36 +471,22 @@ class Share_Sell(models.Model):
         Returns costs in similar format to Share_Buy.calculate_costs() for consistency.
         """
         gross_sale = self.units_sold * self.selling_price
-        sebon_fee = gross_sale * Decimal('0.00015')
-        dp_charge = Decimal('25')
-        broker_commission = gross_sale * (Decimal(str(self.get_broker_rate())) / Decimal('100'))
+        sebon_fee = gross_sale * fees.SEBON_FEE_RATE
+        dp_charge = fees.DP_CHARGE
+        broker_commission = gross_sale * self.get_broker_rate() / 100
         
         # Calculate capital gains tax
         holding_period_days = (self.transaction_date - self.share.transaction_date).days
         
         # Get the weighted average cost for this sale
-        scrip = self.share.scrip
-        user = self.share.user
-        all_buys = Share_Buy.objects.filter(user=user, scrip=scrip)
-        
-        total_cost = Decimal('0')
-        total_units = 0
-        for buy in all_buys:
-            costs = buy.calculate_costs()
-            total_cost += costs['total_amount']
-            total_units += buy.units
-        
-        wacc = total_cost / total_units if total_units > 0 else Decimal('0')
+        wacc = Share_Buy.scrip_wacc(self.share.user_id, self.share.scrip)
         total_buy_amount = wacc * self.units_sold
         
         profit_before_tax = gross_sale - sebon_fee - dp_charge - broker_commission - total_buy_amount
         
         capital_gains_tax = Decimal('0')
         if profit_before_tax > 0:
-            if holding_period_days >= 365:  
-                capital_gains_tax = profit_before_tax * Decimal('0.05') 
-            else:  
-                capital_gains_tax = profit_before_tax * Decimal('0.075')
+            capital_gains_tax = profit_before_tax * fees.capital_gains_tax_rate(holding_period_days)
         
         net_amount = gross_sale - sebon_fee - dp_charge - broker_commission - capital_gains_tax
         
@@ -272,4 +506,142 @@ class Share_Sell(models.Model):
         return self.share.scrip
 
     def __str__(self):
-        return f"Sell {self.units_sold} units of {self.share.scrip} @ Rs.{self.selling_price}"
\ No newline at end of file
+        return f"Sell {self.units_sold} units of {self.share.scrip} @ Rs.{self.selling_price}"
+
+class TMSSyncJob(models.Model):
+    """Queued TMS sync, picked up by the run_tms_worker management command"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_AWAITING_LOGIN = 'awaiting_login'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_AWAITING_LOGIN, 'Waiting for captcha'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING, STATUS_AWAITING_LOGIN)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tms_sync_jobs')
+    tms_server_number = models.IntegerField(default=52)
+    settlement_type = models.CharField(max_length=20, default='PaymentDue')
+    all_accounts = models.BooleanField(default=False, help_text="Sync every active broker account of the user concurrently")
+    full_sync = models.BooleanField(default=False, help_text="Re-read every settlement instead of only those since the last sync")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.CharField(max_length=200, blank=True, help_text="Last progress message from the worker")
+    records_found = models.PositiveIntegerField(default=0)
+    records_saved = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True, help_text="Worker that claimed the job (host:pid)")
+    # Headless login hand-off (TMS_HEADLESS): the worker publishes the captcha here;
+    # the user's answer goes back through the tms_login cache, never this table
+    captcha_image = models.TextField(blank=True, help_text="Base64 PNG of the TMS captcha while waiting for the user")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True, help_text="Last sign of life from the worker running the job")
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    def as_status_dict(self):
+        """Payload returned by the job status endpoint"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'tms_server_number': self.tms_server_number,
+            'settlement_type': self.settlement_type,
+            'all_accounts': self.all_accounts,
+            'full_sync': self.full_sync,
+            'records_found': self.records_found,
+            'records_saved': self.records_saved,
+            'error': self.error,
+            'captcha_image': (
+                f'data:image/png;base64,{self.captcha_image}'
+                if self.status == self.STATUS_AWAITING_LOGIN and self.captcha_image else ''
+            ),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __str__(self):
+        target = 'all accounts' if self.all_accounts else f"TMS{self.tms_server_number} {self.settlement_type}"
+        return f"{target} sync for {self.user.username} ({self.status})"
+
+
+class TMSSyncRun(models.Model):
+    """History of finished TMS syncs (one row per server) with per-phase timings"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tms_sync_runs')
+    tms_server_number = models.IntegerField()
+    settlement_type = models.CharField(max_length=40)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    success = models.BooleanField(default=False)
+    records_found = models.PositiveIntegerField(default=0)
+    records_saved = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    duration_seconds = models.FloatField(help_text="Wall time of the whole sync")
+    launch_seconds = models.FloatField(null=True, blank=True)
+    login_seconds = models.FloatField(null=True, blank=True, help_text="Includes waiting for the user to solve the captcha")
+    navigate_seconds = models.FloatField(null=True, blank=True)
+    expand_seconds = models.FloatField(null=True, blank=True)
+    extract_seconds = models.FloatField(null=True, blank=True)
+    save_seconds = models.FloatField(null=True, blank=True)
+
+    PHASE_FIELDS = {
+        'launch': 'launch_seconds',
+        'login': 'login_seconds',
+        'navigate': 'navigate_seconds',
+        'expand': 'expand_seconds',
+        'extract': 'extract_seconds',
+        'save': 'save_seconds',
+    }
+
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['tms_server_number', 'started_at']),
+        ]
+
+    def __str__(self):
+        outcome = 'ok' if self.success else 'failed'
+        return f"TMS{self.tms_server_number} {self.settlement_type} sync for {self.user.username} ({outcome}, {self.duration_seconds:.1f}s)"
+
+
+class PortfolioVersion(models.Model):
+    """
+    Counter bumped on every change to a user's purchases or sales; cached
+    portfolio fragments are keyed on it (see authentication.portfolio_cache)
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='portfolio_version')
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def current(cls, user_id):
+        return cls.objects.filter(user_id=user_id).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def stamp(cls, user_id):
+        """(version, time of the last change), or (0, None) for a user who never traded"""
+        return cls.objects.filter(user_id=user_id).values_list('version', 'updated_at').first() or (0, None)
+
+    @classmethod
+    def bump(cls, user_id):
+        now = timezone.now()
+        if not cls.objects.filter(user_id=user_id).update(version=models.F('version') + 1, updated_at=now):
+            cls.objects.get_or_create(user_id=user_id, defaults={'version': 1, 'updated_at': now})
+
+    def __str__(self):
+        return f"{self.user_id}: v{self.version}"
@@ -2,20 +2,35 @@ import requests
 import os
 import json
 import logging
+import time
 from datetime import datetime, timedelta
 
+from django.conf import settings
+
+from . import metrics
+from .request_profiling import timed
+
 logger = logging.getLogger(__name__)
 
 CACHE_FILE = os.path.join(os.path.dirname(__file__), 'nepse_stocks_cache.json')
 CACHE_TTL_MINUTES = 60
 
+# The last successful fetch, shared by the requests of the next
+# MARKET_FEED_CACHE_SECONDS instead of each calling the API again
+_last_fetch = {'stocks': None, 'at': 0.0}
+
+@timed('nepse_fetch')
 def fetch_nepse_stocks_and_ltp():
     """
     Fetch all NEPSE stocks and their latest LTP using NepseAPI-Unofficial (PriceVolume endpoint only).
     Returns a list of dicts: [{ 'symbol': 'NABIL', 'companyName': 'Nabil Bank Limited', 'ltp': 500 }, ...]
     Uses local cache if API is down.
     """
+    max_age = getattr(settings, 'MARKET_FEED_CACHE_SECONDS', 15)
+    if _last_fetch['stocks'] is not None and time.monotonic() - _last_fetch['at'] < max_age:
+        return _last_fetch['stocks']
     url_price_volume = "https://nepseapi.surajrimal.dev/PriceVolume"
+    started = time.perf_counter()
     try:
         resp_pv = requests.get(url_price_volume, timeout=10)
         resp_pv.raise_for_status()
@@ -52,10 +67,13 @@ def fetch_nepse_stocks_and_ltp():
                 json.dump({'timestamp': datetime.now().isoformat(), 'stocks': stocks}, f)
         except Exception as cache_err:
             logger.warning(f"Could not write NEPSE cache: {cache_err}")
+        _last_fetch.update(stocks=stocks, at=time.monotonic())
+        metrics.market_feed_duration.observe(time.perf_counter() - started, outcome='ok')
         return stocks
     except Exception as e:
         print(f"[NEPSE API] Error: {e}")
         logger.error(f"NepseAPI fetch error: {e}")
+        metrics.market_feed_errors.inc()
         if os.path.exists(CACHE_FILE):
             try:
                 with open(CACHE_FILE, 'r') as f:
@@ -64,11 +82,18 @@ def fetch_nepse_stocks_and_ltp():
                 if datetime.now() - ts < timedelta(minutes=CACHE_TTL_MINUTES):
                     logger.info("Using cached NEPSE stocks data.")
                     print(f"[NEPSE API] Using cached stocks: {len(cache.get('stocks', []))} entries.")
+                    metrics.market_feed_cache.inc(result='hit')
+                    metrics.market_feed_duration.observe(time.perf_counter() - started, outcome='cache')
                     return cache.get('stocks', [])
+                metrics.market_feed_cache.inc(result='stale')
             except Exception as cache_err:
                 print(f"[NEPSE API] Cache read error: {cache_err}")
                 logger.warning(f"Could not read NEPSE cache: {cache_err}")
+                metrics.market_feed_cache.inc(result='miss')
+        else:
+            metrics.market_feed_cache.inc(result='miss')
         print("[NEPSE API] No stocks available from API or cache.")
+        metrics.market_feed_duration.observe(time.perf_counter() - started, outcome='failed')
         return []
         try:
             with open(CACHE_FILE, 'w') as f:
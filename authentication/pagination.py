@@ -0,0 +1,49 @@
+"""
+Keyset pagination on (transaction_date, id)
+
+Shared by the JSON API and the lazily loaded transaction lists. The cursor is
+the (transaction_date, id) of the last row of a page, so fetching a page is
+one indexed range scan however far into the history it is.
+"""
+import base64
+import binascii
+from datetime import date
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(transaction_date, pk) -> str:
+    return base64.urlsafe_b64encode(f'{transaction_date.isoformat()}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        day, pk = raw.split('|')
+        return date.fromisoformat(day), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def keyset_page(queryset, cursor=None, limit=50, descending=False):
+    """
+    Rows of queryset after the cursor, ordered by (transaction_date, id);
+    returns (rows, next_cursor) with next_cursor None on the last page
+    """
+    if cursor:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        if descending:
+            queryset = queryset.filter(Q(transaction_date__lt=cursor_date) | Q(transaction_date=cursor_date, id__lt=cursor_id))
+        else:
+            queryset = queryset.filter(Q(transaction_date__gt=cursor_date) | Q(transaction_date=cursor_date, id__gt=cursor_id))
+    ordering = ('-transaction_date', '-id') if descending else ('transaction_date', 'id')
+    rows = list(queryset.order_by(*ordering)[:limit + 1])
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].transaction_date, rows[-1].id)
+    return rows, None
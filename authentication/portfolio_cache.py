@@ -0,0 +1,133 @@
+"""
+Versions for the cached portfolio template fragments
+
+The row loops of the portfolio, holding and fee breakdown pages are wrapped
+in {% cache %} tags keyed on two versions:
+
+- the user's PortfolioVersion, bumped by the signals below whenever one of
+  their purchases, sell lots or sell orders is saved or deleted (bulk inserts
+  call portfolio_changed() themselves, as they send no signals)
+- a checksum of the market feed, so fragments showing prices are re-rendered
+  once any price in the snapshot moves
+
+Old versions are never read again and simply expire from the cache.
+
+The same versions are the validators of the portfolio pages and the API:
+conditional_portfolio() answers a matching If-None-Match or If-Modified-Since
+with 304 Not Modified before the view runs any of its queries.
+"""
+import zlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import PortfolioVersion, SellOrder, Share_Buy, Share_Sell
+
+
+def portfolio_changed(user_id):
+    PortfolioVersion.bump(user_id)
+
+
+@receiver(post_save, sender=Share_Buy)
+@receiver(post_save, sender=Share_Sell)
+@receiver(post_save, sender=SellOrder)
+@receiver(post_delete, sender=Share_Buy)
+@receiver(post_delete, sender=Share_Sell)
+@receiver(post_delete, sender=SellOrder)
+def _transaction_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    portfolio_changed(instance.user_id)
+
+
+def market_version(stocks) -> str:
+    """Checksum of the prices in a fetch_nepse_stocks_and_ltp() snapshot"""
+    prices = '|'.join(
+        f"{stock.get('symbol')}:{stock.get('ltp')}:{stock.get('change')}:{stock.get('changePercent')}"
+        for stock in stocks
+    )
+    return f'{zlib.crc32(prices.encode()):08x}'
+
+
+def fragment_keys(user, stocks=None) -> dict:
+    """Context for the {% cache %} tags: timeout and the versions they vary on"""
+    return {
+        'fragment_timeout': getattr(settings, 'PORTFOLIO_FRAGMENT_CACHE_SECONDS', 600),
+        'portfolio_version': PortfolioVersion.current(user.id),
+        'market_version': market_version(stocks) if stocks is not None else '',
+    }
+
+
+# Checksum of the last prices this process saw, and when they first appeared
+_market = {'version': None, 'changed_at': None}
+
+
+def market_snapshot():
+    """(stocks, checksum, time the prices last changed) of the current price feed"""
+    from .nepse_api_utils import fetch_nepse_stocks_and_ltp
+    stocks = fetch_nepse_stocks_and_ltp()
+    version = market_version(stocks)
+    if version != _market['version']:
+        _market.update(version=version, changed_at=timezone.now())
+    return stocks, version, _market['changed_at']
+
+
+def portfolio_validators(request, market=True):
+    """ETag and Last-Modified of the user's portfolio, plus the market snapshot if the page shows prices"""
+    version, updated_at = PortfolioVersion.stamp(request.user.id)
+    parts = [str(request.user.id), str(version)]
+    changes = [updated_at]
+    if market:
+        _, checksum, changed_at = market_snapshot()
+        parts.append(checksum)
+        changes.append(changed_at)
+    # Pages embed a CSRF token, which must still match the browser's cookie
+    csrf_secret = request.META.get('CSRF_COOKIE')
+    if csrf_secret:
+        parts.append(f'{zlib.crc32(csrf_secret.encode()):08x}')
+    changes = [changed for changed in changes if changed]
+    return f'"{"-".join(parts)}"', max(changes) if changes else None
+
+
+def add_validators(response, etag, last_modified):
+    """Validators on a 200 or 304, which clients must check before reusing it"""
+    response.headers.setdefault('ETag', etag)
+    if last_modified:
+        response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(request, etag, last_modified):
+    """A 304 response if the client's copy is still current, else None"""
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    return add_validators(response, etag, last_modified) if response is not None else None
+
+
+def conditional_portfolio(market=True):
+    """Conditional GET for a view showing the user's portfolio (and market prices, unless market=False)"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Flash messages are shown, and used up, by the next full render
+            if (request.method not in ('GET', 'HEAD') or not request.user.is_authenticated
+                    or len(messages.get_messages(request))):
+                return view(request, *args, **kwargs)
+            etag, last_modified = portfolio_validators(request, market)
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            return add_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
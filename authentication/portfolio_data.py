@@ -0,0 +1,103 @@
+"""
+Synthetic portfolio history for load and benchmark runs
+
+generate_portfolio() gives one user a few years of buys and FIFO sells across
+a set of scrips, the way the app itself records them (Share_Buy rows, one
+SellOrder per sale with its Share_Sell lots), but written with bulk inserts
+so 100k transactions take seconds rather than hours.
+"""
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from .models import SellOrder, Share_Buy, Share_Sell
+from .portfolio_cache import portfolio_changed
+
+SCRIPS = (
+    'NABIL', 'NICA', 'HDL', 'NTC', 'UPPER', 'SHIVM', 'CHCL', 'API', 'NLIC', 'GBIME',
+    'EBL', 'SCB', 'HBL', 'KBL', 'PRVU', 'SBL', 'ADBL', 'CIT', 'HIDCL', 'NRIC',
+    'SHL', 'TRH', 'OHL', 'NIFRA', 'MBL', 'PCBL', 'SANIMA', 'LSL', 'CZBIL', 'NMB',
+)
+BATCH_SIZE = 1000
+
+
+def scrip_names(count):
+    """count scrip symbols: real NEPSE ones first, then made-up ones"""
+    return [SCRIPS[i] if i < len(SCRIPS) else f'SYN{i:03d}' for i in range(count)]
+
+
+def generate_portfolio(user, transactions, scrips=20, sell_ratio=0.3, start=date(2020, 1, 1), rng=None):
+    """
+    Add about `transactions` buys and sell orders for user, a sell_ratio share of
+    them sells, and return {scrip: last traded price} for a market feed stub
+    """
+    rng = rng or random.Random()
+    names = scrip_names(scrips)
+    prices = {name: Decimal(rng.randint(200, 2000)) for name in names}
+    lots = {name: [] for name in names}  # open lots per scrip, FIFO
+    purchases = []
+    sales = []  # (scrip, units, price, date, lots used)
+    day = start
+
+    for _ in range(transactions):
+        day += timedelta(days=rng.choice((0, 0, 1, 1, 2, 3)))
+        scrip = rng.choice(names)
+        # Random walk, kept well away from zero
+        prices[scrip] = max(Decimal('50'), (prices[scrip] * Decimal(rng.uniform(0.97, 1.035))).quantize(Decimal('0.1')))
+        open_lots = lots[scrip]
+
+        if open_lots and rng.random() < sell_ratio:
+            available = sum(lot.remaining_units for lot in open_lots)
+            # Mostly partial sales, now and then the whole position
+            units = rng.randint(1, available if rng.random() < 0.2 else max(1, available // 2))
+            used = []
+            remaining_to_sell = units
+            while remaining_to_sell:
+                lot = open_lots[0]
+                sold = min(remaining_to_sell, lot.remaining_units)
+                lot.remaining_units -= sold
+                remaining_to_sell -= sold
+                used.append((lot, sold))
+                if not lot.remaining_units:
+                    open_lots.pop(0)
+            sales.append((scrip, units, prices[scrip], day, used))
+        else:
+            units = rng.choice((10, 10, 20, 50, 100, 200, 500))
+            share = Share_Buy(
+                user=user, scrip=scrip, units=units, remaining_units=units,
+                buying_price=prices[scrip], transaction_date=day,
+            )
+            purchases.append(share)
+            open_lots.append(share)
+
+    # remaining_units already reflects the sales; bulk_create skips Share_Buy.save()
+    Share_Buy.objects.bulk_create(purchases, batch_size=BATCH_SIZE)
+
+    wacc_parts = {name: [Decimal('0'), 0] for name in names}
+    for share in purchases:
+        wacc_parts[share.scrip][0] += share.calculate_costs()['total_amount']
+        wacc_parts[share.scrip][1] += share.units
+
+    orders = []
+    for scrip, units, price, day, used in sales:
+        order = SellOrder(user=user, scrip=scrip, units_sold=units, selling_price=price, transaction_date=day)
+        total_cost, total_units = wacc_parts[scrip]
+        order.calculate(total_cost / total_units, used[0][0].transaction_date)
+        orders.append(order)
+    SellOrder.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+
+    # Share_Sell.save() would decrement the lots a second time, so these are bulk inserted too
+    Share_Sell.objects.bulk_create(
+        [
+            Share_Sell(
+                user=user, order=order, share=lot, units_sold=sold,
+                selling_price=order.selling_price, transaction_date=order.transaction_date,
+                transaction_group=f'order-{order.id}',
+            )
+            for order, (_, _, _, _, used) in zip(orders, sales)
+            for lot, sold in used
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    portfolio_changed(user.id)
+    return {name: float(price) for name, price in prices.items()}
@@ -0,0 +1,190 @@
+"""
+Opt-in request profiling (REQUEST_PROFILING=True)
+
+RequestProfilingMiddleware records, per request: wall time, the number and
+time of SQL queries, repeated queries grouped by fingerprint (the same SQL
+with different parameters, i.e. N+1 lookups such as `sale.share`), and the
+time spent in named sections - the NEPSE price fetch and template rendering.
+A REQUEST_PROFILING_SAMPLE_RATE share of requests also runs under cProfile.
+
+Records are kept in an in-memory ring buffer of the last
+REQUEST_PROFILING_BUFFER_SIZE requests, per process, and shown to staff at
+/profiling/. With the setting off the middleware removes itself and the
+section timers cost one context variable lookup.
+"""
+import cProfile
+import io
+import itertools
+import pstats
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+# Queries run this many times in one request are flagged as repeated
+DUPLICATE_THRESHOLD = 2
+PROFILE_LINES = 30
+
+_current: ContextVar[Optional['RequestProfile']] = ContextVar('request_profile', default=None)
+_buffer = deque(maxlen=getattr(settings, 'REQUEST_PROFILING_BUFFER_SIZE', 200))
+_buffer_lock = threading.Lock()
+_ids = itertools.count(1)
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_lists = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)|\((?:\s*\?\s*,)*\s*\?\s*\)')
+
+
+def fingerprint(sql: str) -> str:
+    """SQL with literals and IN lists collapsed, so the same lookup with other values matches"""
+    return _in_lists.sub('(?)', _literals.sub('?', sql))
+
+
+class RequestProfile:
+    """Measurements of one request"""
+
+    def __init__(self, request):
+        self.id = next(_ids)
+        self.method = request.method
+        self.path = request.get_full_path()
+        self.view = ''
+        self.status = None
+        self.started_at = timezone.now()
+        self.started = time.perf_counter()
+        self.wall_ms = 0.0
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.queries: Dict[str, List[float]] = {}
+        self.sections: Dict[str, float] = {}
+        self.profile = ''
+
+    def __call__(self, execute, sql, params, many, context):
+        """connection.execute_wrapper: time every query"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.sql_count += 1
+            self.sql_ms += elapsed
+            self.queries.setdefault(fingerprint(sql), []).append(elapsed)
+
+    def add_section(self, name: str, ms: float):
+        self.sections[name] = self.sections.get(name, 0.0) + ms
+
+    @property
+    def duplicates(self) -> List[Dict]:
+        """Repeated queries, most time first"""
+        repeated = [
+            {'sql': sql, 'count': len(timings), 'ms': sum(timings)}
+            for sql, timings in self.queries.items() if len(timings) >= DUPLICATE_THRESHOLD
+        ]
+        return sorted(repeated, key=lambda query: query['ms'], reverse=True)
+
+    @property
+    def duplicate_count(self) -> int:
+        return sum(query['count'] - 1 for query in self.duplicates)
+
+
+@contextmanager
+def section(name: str):
+    """Time a block into the current request's profile, if it is being profiled"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_section(name, (time.perf_counter() - start) * 1000)
+
+
+def timed(name: str):
+    """Decorator form of section()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def recent_profiles() -> List[RequestProfile]:
+    """The buffered profiles, newest first"""
+    with _buffer_lock:
+        return list(reversed(_buffer))
+
+
+def get_profile(profile_id: int) -> Optional[RequestProfile]:
+    return next((profile for profile in recent_profiles() if profile.id == profile_id), None)
+
+
+def _instrument_templates():
+    """Time top-level template renders (includes are part of their parent's time)"""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, 'profiled', False):
+        return
+    render = Template.render
+
+    @wraps(render)
+    def profiled_render(self, context=None, request=None):
+        with section('template'):
+            return render(self, context, request)
+
+    profiled_render.profiled = True
+    Template.render = profiled_render
+
+
+class RequestProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 0.0)
+        self.ignore = tuple(getattr(settings, 'REQUEST_PROFILING_IGNORE', ('/static/', '/profiling/')))
+        _instrument_templates()
+
+    def __call__(self, request):
+        if request.path.startswith(self.ignore):
+            return self.get_response(request)
+
+        profile = RequestProfile(request)
+        token = _current.set(profile)
+        profiler = cProfile.Profile() if self.sample_rate and random.random() < self.sample_rate else None
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile))
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            _current.reset(token)
+            profile.wall_ms = (time.perf_counter() - profile.started) * 1000
+
+        match = request.resolver_match
+        profile.view = match.view_name if match else ''
+        profile.status = response.status_code
+        if profiler:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            profile.profile = stream.getvalue()
+        with _buffer_lock:
+            _buffer.append(profile)
+        return response
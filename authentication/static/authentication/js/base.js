@@ -0,0 +1,107 @@
+// Theme Toggle
+function initThemeToggle() {
+    const themeToggleButtons = document.querySelectorAll('#themeToggle, #themeToggleAuth');
+    const themeIcons = document.querySelectorAll('.theme-icon');
+    const body = document.body;
+    
+    // Get saved theme or default to 'dark'
+    const savedTheme = localStorage.getItem('theme') || 'dark';
+    body.setAttribute('data-theme', savedTheme);
+    
+    // Update all icons based on current theme
+    themeIcons.forEach(icon => {
+        icon.className = savedTheme === 'dark' ? 'fas fa-sun theme-icon' : 'fas fa-moon theme-icon';
+    });
+    
+    // Add click listeners to all theme toggle buttons
+    themeToggleButtons.forEach(button => {
+        button.addEventListener('click', () => {
+            const currentTheme = body.getAttribute('data-theme');
+            const newTheme = currentTheme === 'dark' ? 'light' : 'dark';
+            
+            body.setAttribute('data-theme', newTheme);
+            localStorage.setItem('theme', newTheme);
+            
+            // Update all theme icons
+            themeIcons.forEach(icon => {
+                icon.className = newTheme === 'dark' ? 'fas fa-sun theme-icon' : 'fas fa-moon theme-icon';
+            });
+        });
+    });
+}
+
+// Mobile Menu Toggle
+function initMobileMenu() {
+    const mobileMenuToggle = document.getElementById('mobileMenuToggle');
+    const mobileMenuToggleAuth = document.getElementById('mobileMenuToggleAuth');
+    const navLinks = document.getElementById('navLinks');
+    const navLinksAuth = document.getElementById('navLinksAuth');
+
+    if (mobileMenuToggle && navLinks) {
+        mobileMenuToggle.addEventListener('click', (e) => {
+            e.preventDefault();
+            e.stopPropagation();
+            navLinks.classList.toggle('active');
+        });
+    }
+
+    if (mobileMenuToggleAuth && navLinksAuth) {
+        mobileMenuToggleAuth.addEventListener('click', (e) => {
+            e.preventDefault();
+            e.stopPropagation();
+            navLinksAuth.classList.toggle('active');
+        });
+    }
+
+    // Close mobile menu when clicking outside
+    document.addEventListener('click', (e) => {
+        if (navLinks && !navLinks.contains(e.target) && !e.target.closest('.mobile-menu-toggle')) {
+            navLinks.classList.remove('active');
+        }
+        if (navLinksAuth && !navLinksAuth.contains(e.target) && !e.target.closest('.mobile-menu-toggle')) {
+            navLinksAuth.classList.remove('active');
+        }
+    });
+
+    // Close mobile menu when clicking on nav links
+    const allNavLinks = document.querySelectorAll('.nav-links a');
+    allNavLinks.forEach(link => {
+        link.addEventListener('click', () => {
+            if (navLinks) navLinks.classList.remove('active');
+            if (navLinksAuth) navLinksAuth.classList.remove('active');
+        });
+    });
+}
+
+// Initialize everything when DOM is loaded
+document.addEventListener('DOMContentLoaded', function() {
+    initThemeToggle();
+    initMobileMenu();
+});
+
+// Auto-hide alerts after 5 seconds
+document.querySelectorAll('.alert').forEach(alert => {
+    setTimeout(() => {
+        alert.style.transition = 'opacity 0.5s ease';
+        alert.style.opacity = '0';
+        setTimeout(() => alert.remove(), 500);
+    }, 5000);
+});
+
+// Form validation and loading states
+document.querySelectorAll('form').forEach(form => {
+    form.addEventListener('submit', function(e) {
+        const submitBtn = form.querySelector('button[type="submit"], input[type="submit"]');
+        if (submitBtn && !submitBtn.disabled) {
+            submitBtn.disabled = true;
+            const originalText = submitBtn.textContent || submitBtn.value;
+            submitBtn.innerHTML = '<span class="loading"></span> Processing...';
+            
+            // Re-enable after 10 seconds to prevent permanent disability
+            setTimeout(() => {
+                submitBtn.disabled = false;
+                submitBtn.textContent = originalText;
+            }, 10000);
+        }
+    });
+});
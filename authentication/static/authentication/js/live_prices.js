@@ -0,0 +1,50 @@
+// Live prices for the holdings on the page. Elements with data-live-scrip
+// carry the units and cost of a holding; the market stream sends the prices
+// of those scrips when the page connects and then only the ones that moved,
+// and the LTP, current value and unrealized P&L inside them are rewritten.
+(function () {
+    const script = document.currentScript;
+    const holdings = document.querySelectorAll('[data-live-scrip]');
+    if (!holdings.length || !('EventSource' in window)) {
+        return;
+    }
+
+    const bySymbol = {};
+    holdings.forEach(holding => {
+        const symbol = holding.dataset.liveScrip;
+        (bySymbol[symbol] = bySymbol[symbol] || []).push(holding);
+    });
+
+    function setText(holding, field, text) {
+        holding.querySelectorAll('[data-live="' + field + '"]').forEach(el => {
+            el.textContent = text;
+        });
+    }
+
+    function update(prices) {
+        Object.keys(prices).forEach(symbol => {
+            const ltp = Number(prices[symbol].ltp);
+            if (!ltp) {
+                return;
+            }
+            (bySymbol[symbol] || []).forEach(holding => {
+                const value = ltp * Number(holding.dataset.liveUnits);
+                const pnl = value - Number(holding.dataset.liveInvestment);
+                setText(holding, 'ltp', ltp.toFixed(2));
+                setText(holding, 'value', value.toFixed(2));
+                holding.querySelectorAll('[data-live="pnl"]').forEach(el => {
+                    el.textContent = (pnl > 0 ? '+' : '') + 'Rs. ' + pnl.toFixed(2);
+                    el.classList.toggle('positive', pnl > 0);
+                    el.classList.toggle('negative', pnl < 0);
+                    el.classList.toggle('neutral', pnl === 0);
+                });
+            });
+        });
+    }
+
+    const url = script.dataset.streamUrl + '?symbols=' + encodeURIComponent(Object.keys(bySymbol).join(','));
+    const source = new EventSource(url);
+    ['snapshot', 'prices'].forEach(kind => {
+        source.addEventListener(kind, event => update(JSON.parse(event.data)));
+    });
+})();
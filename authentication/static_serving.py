@@ -0,0 +1,42 @@
+"""
+Serving collected static files from Django (SERVE_STATIC=True)
+
+For single-node installs with no web server in front. Content-hashed names
+written by ManifestStaticFilesStorage never change, so they are sent with a
+one-year immutable Cache-Control; anything else is revalidated hourly.
+Clients that accept Brotli or gzip get the .br/.gz copy collectstatic wrote
+next to the file, when there is one.
+"""
+import os
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.static import serve
+
+from .compression import accepted_encodings
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MAX_AGE = 60 * 60
+
+
+# Preferred first; served with the Content-Encoding mimetypes guesses from the suffix
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+def serve_static(request, path):
+    encodings = accepted_encodings(request)
+    for encoding, suffix in PRECOMPRESSED:
+        if encoding in encodings and os.path.isfile(os.path.join(settings.STATIC_ROOT, path + suffix)):
+            response = serve(request, path + suffix, document_root=settings.STATIC_ROOT)
+            response.headers.pop('Content-Disposition', None)
+            break
+    else:
+        response = serve(request, path, document_root=settings.STATIC_ROOT)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if HASHED_NAME.search(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=MAX_AGE)
+    return response
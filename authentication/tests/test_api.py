@@ -0,0 +1,101 @@
+import base64
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from authentication.models import SellOrder, Share_Buy, Share_Sell
+from authentication.pagination import encode_cursor
+
+
+class APIPagingTests(TestCase):
+    """buys/ and sells/ page with a keyset cursor on (transaction_date, id)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('trader', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        start = date(2024, 1, 1)
+        # Four buys a day, so dates tie inside and across page boundaries
+        for i in range(23):
+            Share_Buy.objects.create(
+                user=cls.user, scrip='NABIL' if i % 2 else 'NICA', units=100, buying_price=Decimal('500') + i,
+                transaction_date=start + timedelta(days=i // 4),
+            )
+        Share_Buy.objects.create(user=other, scrip='NABIL', units=5, buying_price=Decimal('500'), transaction_date=start)
+        for i in range(5):
+            shares = Share_Buy.objects.filter(user=cls.user, scrip='NABIL').order_by('transaction_date', 'id')
+            SellOrder.record(cls.user, shares, 150, Decimal('600'), start + timedelta(days=10 + i // 2), wacc=Decimal('510'))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def walk(self, name, **params):
+        """ids of every item and the number of pages, following `next`"""
+        ids, pages, cursor = [], 0, None
+        while True:
+            query = dict(params, cursor=cursor) if cursor else params
+            response = self.client.get(reverse(name), query)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids += [item['id'] for item in body['results']]
+            pages += 1
+            cursor = body['next']
+            if cursor is None:
+                return ids, pages
+
+    def test_buys_pages_cover_every_row_once(self):
+        expected = list(
+            Share_Buy.objects.filter(user=self.user).order_by('transaction_date', 'id').values_list('id', flat=True)
+        )
+        ids, pages = self.walk('api_buys', limit=5)
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 5)
+
+        ids, _ = self.walk('api_buys', limit=4, order='desc')
+        self.assertEqual(ids, expected[::-1])
+
+    def test_sells_pages_cover_every_lot_once(self):
+        lots = Share_Sell.objects.filter(user=self.user).order_by('transaction_date', 'id')
+        self.assertGreater(lots.count(), 5)
+        ids, _ = self.walk('api_sells', limit=3)
+        self.assertEqual(ids, list(lots.values_list('id', flat=True)))
+
+    def test_scrip_filter_pages(self):
+        expected = list(
+            Share_Buy.objects.filter(user=self.user, scrip='NICA').order_by('transaction_date', 'id')
+            .values_list('id', flat=True)
+        )
+        ids, _ = self.walk('api_buys', limit=5, scrip='nica')
+        self.assertEqual(ids, expected)
+
+    def test_last_page_has_no_next(self):
+        body = self.client.get(reverse('api_buys'), {'limit': 500}).json()
+        self.assertEqual(len(body['results']), 23)
+        self.assertIsNone(body['next'])
+
+    def test_tampered_cursor_is_rejected(self):
+        garbage = base64.urlsafe_b64encode(b'2024-01-01|not-an-id').decode()
+        for cursor in ('not a cursor!', garbage, encode_cursor(date(2024, 1, 1), 1)[:-3] + '***'):
+            response = self.client.get(reverse('api_buys'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_invalid_limit_is_rejected(self):
+        response = self.client.get(reverse('api_buys'), {'limit': 'all'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_fields_limit_each_item(self):
+        body = self.client.get(reverse('api_buys'), {'fields': 'id, scrip', 'limit': 3}).json()
+        self.assertEqual([set(item) for item in body['results']], [{'id', 'scrip'}] * 3)
+
+        body = self.client.get(reverse('api_sells'), {'fields': 'order_id,units_sold'}).json()
+        self.assertTrue(body['results'])
+        self.assertTrue(all(set(item) == {'order_id', 'units_sold'} for item in body['results']))
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get(reverse('api_buys'), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['error'])
@@ -0,0 +1,32 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from authentication.checks import check_static_manifest
+
+MANIFEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'authentication.compression.CompressedManifestStaticFilesStorage'},
+}
+
+
+class StaticManifestCheckTests(SimpleTestCase):
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+
+    def test_plain_storage_needs_no_manifest(self):
+        self.assertEqual(check_static_manifest(None), [])
+
+    def test_manifest_storage_requires_collectstatic(self):
+        with override_settings(STORAGES=MANIFEST_STORAGES, STATIC_ROOT=self.static_root):
+            errors = check_static_manifest(None)
+            self.assertEqual([error.id for error in errors], ['authentication.E001'])
+
+            with open(os.path.join(self.static_root, 'staticfiles.json'), 'w') as f:
+                json.dump({'paths': {}, 'version': '1.1'}, f)
+            self.assertEqual(check_static_manifest(None), [])
@@ -0,0 +1,142 @@
+import gzip
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.files.storage import FileSystemStorage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from authentication import compression
+from authentication.compression import CompressedManifestStaticFilesStorage, CompressionMiddleware, accepted_encodings
+from authentication.static_serving import serve_static
+
+PAGE = ('<tr><td>NABIL</td><td>100</td><td>523.50</td></tr>\n' * 200).encode()
+
+
+def request(accept_encoding=None):
+    headers = {'HTTP_ACCEPT_ENCODING': accept_encoding} if accept_encoding is not None else {}
+    return RequestFactory().get('/', **headers)
+
+
+class AcceptEncodingTests(SimpleTestCase):
+
+    def test_codings_refused_with_q_zero_are_dropped(self):
+        self.assertEqual(accepted_encodings(request('gzip, deflate, br')), {'gzip', 'deflate', 'br'})
+        self.assertEqual(accepted_encodings(request('GZIP;q=0.5, br;q=0')), {'gzip'})
+        self.assertEqual(accepted_encodings(request('gzip; q=0.0, identity')), {'identity'})
+        self.assertEqual(accepted_encodings(request('gzip;q=x')), set())
+        self.assertEqual(accepted_encodings(request()), set())
+
+
+@override_settings(COMPRESS_MIN_SIZE=1024)
+class CompressionMiddlewareTests(SimpleTestCase):
+
+    def respond(self, response, accept_encoding='gzip, deflate, br'):
+        return CompressionMiddleware(lambda request: response)(request(accept_encoding))
+
+    def test_gzip_with_a_weak_etag(self):
+        response = HttpResponse(PAGE, content_type='text/html; charset=utf-8')
+        response['ETag'] = '"abc"'
+        with mock.patch.object(compression, 'brotli', None):
+            response = self.respond(response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), PAGE)
+
+    def test_weak_etag_stays_as_it_is(self):
+        response = HttpResponse(PAGE, content_type='text/html')
+        response['ETag'] = 'W/"abc"'
+        self.assertEqual(self.respond(response, 'gzip')['ETag'], 'W/"abc"')
+
+    def test_brotli_when_accepted_and_installed(self):
+        fake_brotli = SimpleNamespace(compress=mock.Mock(return_value=b'tiny'))
+        with mock.patch.object(compression, 'brotli', fake_brotli):
+            response = self.respond(HttpResponse(PAGE, content_type='application/json'))
+            self.assertEqual((response['Content-Encoding'], response.content), ('br', b'tiny'))
+            fake_brotli.compress.assert_called_once_with(PAGE, quality=compression.BROTLI_QUALITY)
+
+            response = self.respond(HttpResponse(PAGE, content_type='application/json'), 'gzip, br;q=0')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_refused_gzip_is_not_sent(self):
+        with mock.patch.object(compression, 'brotli', None):
+            response = self.respond(HttpResponse(PAGE, content_type='text/html'), 'gzip;q=0, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, PAGE)
+        # Caches still need to know the body depends on the header
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_left_alone(self):
+        cases = {
+            'small': HttpResponse(PAGE[:1000], content_type='text/html'),
+            'binary': HttpResponse(PAGE, content_type='image/png'),
+            'event stream': StreamingHttpResponse(iter([PAGE]), content_type='text/event-stream'),
+            'already encoded': HttpResponse(PAGE, content_type='text/html', headers={'Content-Encoding': 'gzip'}),
+        }
+        for name, response in cases.items():
+            with self.subTest(name):
+                encoding = response.get('Content-Encoding')
+                response = self.respond(response)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                self.assertFalse(response.has_header('Vary'))
+
+    def test_streaming_gzip(self):
+        response = self.respond(StreamingHttpResponse(iter([PAGE, PAGE]), content_type='text/csv'), 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), PAGE + PAGE)
+
+
+@override_settings(COMPRESS_MIN_SIZE=1024)
+class PrecompressedStaticTests(SimpleTestCase):
+    """collectstatic writes .gz copies next to the hashed files; serve_static sends them"""
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, content in (('base.css', PAGE), ('tiny.css', b'body{margin:0}'), ('logo.png', PAGE)):
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(content)
+
+    def collect(self):
+        source = FileSystemStorage(location=self.source)
+        storage = CompressedManifestStaticFilesStorage(location=self.root, base_url='/static/')
+        paths = {}
+        for name in ('base.css', 'tiny.css', 'logo.png'):
+            with source.open(name) as f:
+                storage.save(name, f)
+            paths[name] = (storage, name)
+        with mock.patch.object(compression, 'brotli', None):
+            list(storage.post_process(paths))
+        return storage
+
+    def test_text_assets_get_a_gzip_copy(self):
+        storage = self.collect()
+        hashed = storage.stored_name('base.css')
+        self.assertRegex(hashed, r'^base\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.root, hashed + '.gz'), 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), PAGE)
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'base.css.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, storage.stored_name('tiny.css') + '.gz')))
+        self.assertFalse(any(name.startswith('logo') and name.endswith('.gz') for name in os.listdir(self.root)))
+
+    def test_served_when_accepted(self):
+        hashed = self.collect().stored_name('base.css')
+        with override_settings(STATIC_ROOT=self.root):
+            response = serve_static(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='br, gzip'), hashed)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Content-Type'], 'text/css')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertFalse(response.has_header('Content-Disposition'))
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), PAGE)
+
+            response = serve_static(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip;q=0'), hashed)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(b''.join(response.streaming_content), PAGE)
@@ -0,0 +1,170 @@
+import base64
+import sys
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from authentication import portfolio_cache
+from authentication.models import SellOrder, Share_Buy
+
+from .utils import fake_market
+
+STOCKS = [{'symbol': 'NABIL', 'ltp': 520.0, 'change': 5.0, 'changePercent': 0.97}]
+
+
+class ConditionalPortfolioTests(TestCase):
+    """Portfolio pages answer a current If-None-Match with 304 before the view runs"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('trader', password='pw')
+        Share_Buy.objects.create(
+            user=cls.user, scrip='NABIL', units=100, buying_price=Decimal('500'), transaction_date=date(2024, 1, 1),
+        )
+
+    def setUp(self):
+        market = fake_market(STOCKS)
+        market.start()
+        self.addCleanup(market.stop)
+        reset = mock.patch.dict(portfolio_cache._market, {'version': None, 'changed_at': None})
+        reset.start()
+        self.addCleanup(reset.stop)
+        self.client.force_login(self.user)
+
+    def set_prices(self, stocks):
+        sys.modules['authentication.nepse_api_utils'].fetch_nepse_stocks_and_ltp.return_value = list(stocks)
+
+    def get(self, url, etag=None, **headers):
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        with mock.patch('authentication.views.render', wraps=render) as rendered:
+            response = self.client.get(url, **headers)
+        response.rendered = rendered.called
+        return response
+
+    def test_matching_etag_skips_the_view(self):
+        url = reverse('sharehub_portfolio')
+        first = self.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.rendered)
+        self.assertIn('private', first['Cache-Control'])
+
+        again = self.get(url, first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertFalse(again.rendered)
+        self.assertEqual(again['ETag'], first['ETag'])
+
+    def test_weak_etag_of_a_compressed_page_matches(self):
+        url = reverse('sharehub_portfolio')
+        first = self.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertTrue(first['ETag'].startswith('W/"'))
+
+        again = self.get(url, first['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(again.status_code, 304)
+        self.assertFalse(again.rendered)
+
+    def test_buy_invalidates_the_etag(self):
+        url = reverse('sharehub_portfolio')
+        etag = self.get(url)['ETag']
+        Share_Buy.objects.create(
+            user=self.user, scrip='NABIL', units=10, buying_price=Decimal('510'), transaction_date=date(2024, 2, 1),
+        )
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.rendered)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_sell_invalidates_the_etag(self):
+        url = reverse('sharehub_portfolio')
+        etag = self.get(url)['ETag']
+        SellOrder.record(self.user, Share_Buy.objects.filter(user=self.user), 10, Decimal('600'), date(2024, 3, 1))
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_pending_message_bypasses_304(self):
+        url = reverse('sharehub_portfolio')
+        etag = self.get(url)['ETag']
+        storage = CookieStorage(RequestFactory().get('/'))
+        storage.add(messages.SUCCESS, 'Transaction saved')
+        carrier = HttpResponse()
+        storage.update(carrier)
+        self.client.cookies['messages'] = carrier.cookies['messages'].value
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Transaction saved')
+        # Shown once; the next request may reuse the cached page again
+        self.assertEqual(self.get(url, etag).status_code, 304)
+
+    def test_price_change_invalidates_only_market_pages(self):
+        portfolio = reverse('sharehub_portfolio')
+        transactions = reverse('portfolio_transactions', args=['buy'])
+        portfolio_etag = self.get(portfolio)['ETag']
+        transactions_etag = self.get(transactions)['ETag']
+
+        self.set_prices([dict(STOCKS[0], ltp=530.0, change=15.0)])
+
+        response = self.get(portfolio, portfolio_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], portfolio_etag)
+        self.assertEqual(self.get(transactions, transactions_etag).status_code, 304)
+
+    def test_post_is_never_answered_with_304(self):
+        etag = self.get(reverse('sharehub_portfolio'))['ETag']
+        response = self.client.post(reverse('sharehub_portfolio'), HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(response.status_code, 304)
+
+
+class ConditionalAPITests(TestCase):
+    """API responses carry the portfolio ETag; a current one gets 304 without reading transactions"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('trader', password='pw')
+        Share_Buy.objects.create(
+            user=cls.user, scrip='NABIL', units=100, buying_price=Decimal('500'), transaction_date=date(2024, 1, 1),
+        )
+
+    def basic_auth(self):
+        token = base64.b64encode(b'trader:pw').decode()
+        return {'HTTP_AUTHORIZATION': f'Basic {token}'}
+
+    def test_matching_etag_skips_the_query(self):
+        url = reverse('api_buys')
+        first = self.client.get(url, **self.basic_auth())
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Authorization', first['Vary'])
+
+        with mock.patch('authentication.api.keyset_page') as page:
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'], **self.basic_auth())
+        self.assertEqual(again.status_code, 304)
+        page.assert_not_called()
+        self.assertIn('Authorization', again['Vary'])
+
+    def test_session_etag_changes_with_the_portfolio(self):
+        self.client.force_login(self.user)
+        url = reverse('api_holdings')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        SellOrder.record(self.user, Share_Buy.objects.filter(user=self.user), 10, Decimal('600'), date(2024, 3, 1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['units'], 90)
+
+    def test_unauthenticated_request_gets_401(self):
+        response = self.client.get(reverse('api_buys'))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Basic', response['WWW-Authenticate'])
@@ -0,0 +1,57 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from authentication.models import SellOrder, Share_Buy
+
+from .utils import fake_market
+
+
+class RecentActivityTests(TestCase):
+    """The activity feed lists sell actions, not their FIFO lots, and only reads the latest ones"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+        self.client.force_login(self.user)
+
+    def buy(self, scrip, units, day):
+        return Share_Buy.objects.create(
+            user=self.user, scrip=scrip, units=units, buying_price=Decimal('500'), transaction_date=date(2024, 1, day),
+        )
+
+    def dashboard(self):
+        with fake_market(), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response.context['recent_activities'], queries
+
+    def test_multi_lot_sale_is_one_activity(self):
+        lots = [self.buy('NABIL', 10, 1), self.buy('NABIL', 10, 2)]
+        SellOrder.record(self.user, lots, 15, Decimal('600'), date(2024, 2, 1))
+
+        activities, _ = self.dashboard()
+        self.assertEqual(
+            [(a['action'], a['scrip'], a['units'], a['date']) for a in activities],
+            [('Sold', 'NABIL', 15, date(2024, 2, 1)), ('Bought', 'NABIL', 10, date(2024, 1, 2)),
+             ('Bought', 'NABIL', 10, date(2024, 1, 1))],
+        )
+
+    def test_only_the_latest_sells_are_read(self):
+        share = self.buy('NABIL', 1000, 1)
+        for day in range(2, 22):
+            SellOrder.record(self.user, [share], 1, Decimal('600'), date(2024, 1, day))
+            share.refresh_from_db()
+
+        activities, queries = self.dashboard()
+        self.assertEqual([a['date'].day for a in activities], [21, 20, 19, 18, 17, 16])
+        sell_feed = [
+            query['sql'] for query in queries.captured_queries
+            if 'FROM "authentication_sellorder"' in query['sql'] and 'ORDER BY' in query['sql']
+        ]
+        self.assertEqual(len(sell_feed), 1)
+        self.assertIn('LIMIT 10', sell_feed[0])
@@ -0,0 +1,115 @@
+import json
+import re
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from authentication import fees
+from authentication.models import SellOrder, Share_Buy
+
+from .utils import fake_market
+
+SCHEDULE_RE = re.compile(r'<script id="fee-schedule" type="application/json">(.*?)</script>')
+
+
+class FeeScheduleTests(SimpleTestCase):
+
+    def test_broker_rate_slabs(self):
+        self.assertEqual(fees.broker_rate(Decimal('50000')), Decimal('0.36'))
+        self.assertEqual(fees.broker_rate(Decimal('50000.01')), Decimal('0.33'))
+        self.assertEqual(fees.broker_rate(Decimal('2000000')), Decimal('0.31'))
+        self.assertEqual(fees.broker_rate(Decimal('10000000')), Decimal('0.27'))
+        self.assertEqual(fees.broker_rate(Decimal('10000000.01')), Decimal('0.24'))
+
+    def test_long_term_from_365_days(self):
+        self.assertEqual(fees.capital_gains_tax_rate(364), fees.CGT_SHORT_TERM_RATE)
+        self.assertEqual(fees.capital_gains_tax_rate(365), fees.CGT_LONG_TERM_RATE)
+
+    def test_schedule_is_plain_json(self):
+        schedule = json.loads(json.dumps(fees.fee_schedule()))
+        self.assertEqual(schedule['sebon_rate'], 0.00015)
+        self.assertEqual(schedule['broker_slabs'][-1], [None, 0.24])
+        self.assertEqual(schedule['long_term_days'], fees.LONG_TERM_DAYS)
+
+
+class SaleTaxBoundaryTests(TestCase):
+    """Recorded orders and the legacy per-lot figures agree on which sales are long term"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+
+    def sell_after(self, days):
+        share = Share_Buy.objects.create(
+            user=self.user, scrip=f'S{days}', units=100, buying_price=Decimal('500'), transaction_date=date(2023, 1, 1),
+        )
+        order = SellOrder.record(self.user, [share], 100, Decimal('700'), date(2023, 1, 1) + timedelta(days=days))
+        return order, order.lots.get().calculate_profit_loss()
+
+    def test_held_exactly_365_days_is_long_term(self):
+        order, lot = self.sell_after(365)
+        self.assertEqual(order.holding_period_days, 365)
+        self.assertEqual(order.tax_rate, fees.CGT_LONG_TERM_RATE)
+        self.assertEqual(lot['tax_rate'], fees.CGT_LONG_TERM_RATE)
+        self.assertEqual(lot['tax_rate_percentage'], 5.0)
+        self.assertEqual(order.capital_gains_tax, lot['tax_amount'].quantize(Decimal('0.01')))
+
+    def test_held_364_days_is_short_term(self):
+        order, lot = self.sell_after(364)
+        self.assertEqual(order.tax_rate, fees.CGT_SHORT_TERM_RATE)
+        self.assertEqual(lot['tax_rate'], fees.CGT_SHORT_TERM_RATE)
+        self.assertEqual(lot['tax_rate_percentage'], 7.5)
+
+    def test_purchase_costs_use_the_schedule(self):
+        share = Share_Buy(user=self.user, scrip='NABIL', units=1000, buying_price=Decimal('600'))
+        costs = share.calculate_costs()
+        self.assertEqual(costs['sebon_fee'], Decimal('600000') * fees.SEBON_FEE_RATE)
+        self.assertEqual(costs['dp_charge'], fees.DP_CHARGE)
+        self.assertEqual(costs['broker_commission'], Decimal('600000') * Decimal('0.31') / 100)
+
+    def test_pages_render_the_schedule(self):
+        Share_Buy.objects.create(
+            user=self.user, scrip='NABIL', units=10, buying_price=Decimal('500'), transaction_date=date(2024, 1, 1),
+        )
+        self.client.force_login(self.user)
+        with fake_market([{'symbol': 'NABIL', 'ltp': 520.0, 'change': 1.0, 'changePercent': 0.2}]):
+            for url in (reverse('share_buy'), reverse('sharehub_holding_detail', args=['NABIL'])):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+                schedule = SCHEDULE_RE.search(response.content.decode())
+                self.assertIsNotNone(schedule, url)
+                self.assertEqual(json.loads(schedule.group(1)), fees.fee_schedule())
+
+
+class SellPreviewDataTests(TestCase):
+    """The sell form previews from one payload of FIFO lots, WACC and the fee schedule"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+        self.client.force_login(self.user)
+
+    def buy(self, user, scrip, units, price, day, remaining=None):
+        share = Share_Buy.objects.create(
+            user=user, scrip=scrip, units=units, buying_price=Decimal(price), transaction_date=date(2024, 1, day),
+        )
+        if remaining is not None:
+            Share_Buy.objects.filter(pk=share.pk).update(remaining_units=remaining)
+        return share
+
+    def test_payload(self):
+        later = self.buy(self.user, 'NABIL', 50, '520', 20)
+        earlier = self.buy(self.user, 'NABIL', 100, '500', 5, remaining=40)
+        self.buy(self.user, 'HDL', 10, '1200', 1, remaining=0)
+        self.buy(User.objects.create_user('other', password='pw'), 'NICA', 10, '800', 1)
+
+        with self.assertNumQueries(3):  # session, user, purchases
+            payload = self.client.get(reverse('share_sell_preview_data')).json()
+
+        self.assertEqual(payload['fees'], fees.fee_schedule())
+        self.assertEqual(list(payload['scrips']), ['NABIL'])
+        nabil = payload['scrips']['NABIL']
+        self.assertEqual(nabil['units'], 90)
+        self.assertEqual(nabil['lots'], [[earlier.id, '2024-01-05', 40], [later.id, '2024-01-20', 50]])
+        self.assertAlmostEqual(nabil['wacc'], float(Share_Buy.scrip_wacc(self.user, 'NABIL')), places=4)
@@ -0,0 +1,99 @@
+import re
+from datetime import date, timedelta
+from decimal import Decimal
+from html import unescape
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from authentication.models import SellOrder, Share_Buy
+from authentication.views import TRANSACTION_PAGE_SIZE
+
+from .utils import fake_market
+
+ROW_RE = re.compile(r"confirmDelete\('(buy|sell)', (\d+),")
+NEXT_URL_RE = re.compile(r'data-next-url="([^"]+)"')
+
+
+class HoldingHistoryPagingTests(TestCase):
+    """A holding's history pages its buys and sell orders with keyset cursors"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('trader', password='pw')
+        start = date(2024, 1, 1)
+        # Three buys a day, so dates tie inside and across page boundaries
+        buys = [
+            Share_Buy.objects.create(
+                user=cls.user, scrip='NABIL', units=100, buying_price=Decimal('500') + i,
+                transaction_date=start + timedelta(days=i // 3),
+            )
+            for i in range(40)
+        ]
+        Share_Buy.objects.create(user=cls.user, scrip='NICA', units=10, buying_price=Decimal('700'), transaction_date=start)
+        # Sales on the same days as buys, each from one lot
+        for i in range(20):
+            SellOrder.record(
+                cls.user, [Share_Buy.objects.get(pk=buys[i].pk)], 10, Decimal('600'), start + timedelta(days=i // 2),
+                wacc=Decimal('520'),
+            )
+
+        key = lambda item: item[:3]
+        expected = [(b.transaction_date, 0, b.id, 'buy', b.id) for b in Share_Buy.objects.filter(scrip='NABIL')]
+        expected += [
+            (order.transaction_date, 1, order.id, 'sell', order.lots.get().id)
+            for order in SellOrder.objects.filter(scrip='NABIL')
+        ]
+        cls.expected = [(kind, row_id) for *_, kind, row_id in sorted(expected, key=key, reverse=True)]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def walk(self):
+        """(kind, id) of every history row, following Load more from the detail page"""
+        rows, pages, url = [], 0, reverse('sharehub_holding_detail', args=['NABIL'])
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            content = response.content.decode()
+            page_rows = [(kind, int(row_id)) for kind, row_id in ROW_RE.findall(content)]
+            self.assertLessEqual(len(page_rows), TRANSACTION_PAGE_SIZE)
+            rows.extend(page_rows)
+            pages += 1
+            next_url = NEXT_URL_RE.search(content)
+            url = unescape(next_url.group(1)) if next_url else None
+        return rows, pages
+
+    def test_walk_every_page(self):
+        with fake_market([{'symbol': 'NABIL', 'ltp': 650}]):
+            rows, pages = self.walk()
+        self.assertEqual(rows, self.expected)
+        self.assertEqual(pages, -(-len(self.expected) // TRANSACTION_PAGE_SIZE))
+
+    def test_summary_from_stored_order_amounts(self):
+        with fake_market([{'symbol': 'NABIL', 'ltp': 650}]):
+            response = self.client.get(reverse('sharehub_holding_detail', args=['NABIL']))
+        orders = SellOrder.objects.filter(user=self.user, scrip='NABIL')
+        self.assertEqual(response.context['sold_units'], 200)
+        self.assertEqual(response.context['realized_pnl'], sum(order.final_profit for order in orders))
+        self.assertEqual(response.context['total_sold_receivable'], sum(order.net_amount for order in orders))
+
+    def test_page_queries_do_not_grow_with_history(self):
+        url = reverse('holding_transactions', args=['NABIL'])
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        for i in range(50):
+            Share_Buy.objects.create(
+                user=self.user, scrip='NABIL', units=5, buying_price=Decimal('400'), transaction_date=date(2023, 1, 1),
+            )
+        with CaptureQueriesContext(connection) as later:
+            response = self.client.get(url)
+        self.assertEqual(len(later), len(first))
+        self.assertEqual(len(ROW_RE.findall(response.content.decode())), TRANSACTION_PAGE_SIZE)
+
+    def test_tampered_cursor(self):
+        response = self.client.get(reverse('holding_transactions', args=['NABIL']), {'buy': 'bm90LWEtY3Vyc29y'})
+        self.assertEqual(response.status_code, 400)
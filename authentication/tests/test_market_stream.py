@@ -0,0 +1,98 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from authentication import market_stream
+from authentication.market_stream import QUEUE_SIZE, MarketBroadcaster, price_changes, price_map, sse_event
+
+from .utils import fake_market
+
+
+def stock(symbol, ltp, change=0.0):
+    return {'symbol': symbol, 'ltp': ltp, 'change': change, 'changePercent': 0.0, 'name': symbol}
+
+
+class PriceChangeTests(SimpleTestCase):
+
+    def test_only_moved_or_new_symbols(self):
+        old = price_map([stock('NABIL', 520.0), stock('HDL', 1200.0)])
+        new = price_map([stock('NABIL', 520.0), stock('HDL', 1210.0, 10.0), stock('NICA', 800.0), {'ltp': 1}])
+        self.assertEqual(list(new), ['NABIL', 'HDL', 'NICA'])
+        self.assertEqual(price_changes(old, new), {
+            'HDL': {'ltp': 1210.0, 'change': 10.0, 'changePercent': 0.0},
+            'NICA': {'ltp': 800.0, 'change': 0.0, 'changePercent': 0.0},
+        })
+
+    def test_event_format(self):
+        self.assertEqual(sse_event('prices', {'NABIL': {'ltp': 520}}), 'event: prices\ndata: {"NABIL":{"ltp":520}}\n\n')
+
+
+@override_settings(MARKET_STREAM_HEARTBEAT=3600)
+class BroadcasterTests(SimpleTestCase):
+    """Each stream gets the changes of its own symbols; a stream that falls behind gets a snapshot"""
+
+    def setUp(self):
+        self.broadcaster = MarketBroadcaster()
+        # No background polling: the tests publish and refresh themselves
+        self.broadcaster._poll = mock.AsyncMock()
+        self.broadcaster.prices = price_map([stock('NABIL', 520.0), stock('HDL', 1200.0)])
+
+    def pending(self, subscriber):
+        events = []
+        while not subscriber.queue.empty():
+            events.append(subscriber.queue.get_nowait())
+        return events
+
+    async def test_publish_selects_the_subscribed_symbols(self):
+        nabil = self.broadcaster.subscribe({'NABIL'})
+        everything = self.broadcaster.subscribe(None)
+        self.broadcaster.publish({'HDL': {'ltp': 1210.0}})
+        self.assertEqual(self.pending(nabil), [])
+        self.assertEqual(self.pending(everything), [('prices', {'HDL': {'ltp': 1210.0}})])
+
+    async def test_overflow_is_replaced_by_a_snapshot(self):
+        subscriber = self.broadcaster.subscribe({'NABIL', 'NICA'})
+        for step in range(QUEUE_SIZE + 1):
+            self.broadcaster.publish({'NABIL': {'ltp': 521.0 + step}})
+        self.assertEqual(self.pending(subscriber), [('snapshot', {'NABIL': self.broadcaster.prices['NABIL']})])
+
+    async def test_refresh_publishes_changes_and_keeps_prices_without_a_feed(self):
+        subscriber = self.broadcaster.subscribe(None)
+        with fake_market([stock('NABIL', 520.0), stock('HDL', 1190.0, -10.0)]):
+            await self.broadcaster.refresh()
+        self.assertEqual(self.pending(subscriber), [('prices', {'HDL': {'ltp': 1190.0, 'change': -10.0, 'changePercent': 0.0}})])
+
+        prices = self.broadcaster.prices
+        with fake_market([]):
+            await self.broadcaster.refresh()
+        self.assertIs(self.broadcaster.prices, prices)
+        self.assertEqual(self.pending(subscriber), [])
+
+    async def test_stream_sends_a_snapshot_then_changes(self):
+        stream = self.broadcaster.stream({'NABIL'})
+        first = await anext(stream)
+        self.assertEqual(first, f'retry: {market_stream.RETRY_MS}\n' + sse_event('snapshot', {'NABIL': self.broadcaster.prices['NABIL']}))
+
+        self.broadcaster.publish({'NABIL': {'ltp': 530.0}})
+        self.assertEqual(await anext(stream), sse_event('prices', {'NABIL': {'ltp': 530.0}}))
+        await stream.aclose()
+        self.assertEqual(self.broadcaster.subscribers, set())
+
+
+class MarketStreamViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+
+    def test_wsgi_gets_no_content(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('market_stream')).status_code, 204)
+
+    @override_settings(MARKET_STREAM_MAX_CLIENTS=0)
+    async def test_asgi_connections_are_capped(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('market_stream'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '60')
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from authentication import metrics
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+class FreshMetrics:
+    """Every registered metric starts empty and gets its values back afterwards"""
+
+    def setUp(self):
+        super().setUp()
+        for metric in metrics._registry.values():
+            patcher = mock.patch.object(metric, 'values', {})
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@override_settings(METRICS_DIR='')
+class RenderTests(FreshMetrics, SimpleTestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        for seconds in (0.003, 0.02, 0.02, 30):
+            metrics.http_request_duration.observe(seconds, view='dashboard', method='GET', status=200)
+        metrics.sell_orders.inc()
+        metrics.sell_orders.inc(2)
+
+        lines = metrics.render().splitlines()
+        labels = 'view="dashboard",method="GET",status="200"'
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.005"}} 1', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.01"}} 1', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.025"}} 3', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="10"}} 3', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 4', lines)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 4', lines)
+        self.assertIn('sell_orders_total 3', lines)
+
+    def test_label_values_are_escaped(self):
+        metrics.market_feed_cache.inc(result='a "quoted"\\path\n')
+        self.assertIn('market_feed_cache_total{result="a \\"quoted\\"\\\\path\\n"} 1', metrics.render())
+
+
+@override_settings(METRICS_DIR='', METRICS_TOKEN='')
+class MetricsEndpointTests(FreshMetrics, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('trader', password='pw')
+
+    def series(self, metric):
+        return metrics._collect()[metric.name]
+
+    def test_requests_are_timed_by_url_name(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('share_sell_preview_data'))
+        self.client.get('/static/css/missing.css')
+
+        [(key, series)] = self.series(metrics.http_request_duration).items()
+        self.assertEqual(key, ('share_sell_preview_data', 'GET', '200'))
+        self.assertEqual(sum(series[:-1]), 1)
+        [(key, series)] = self.series(metrics.http_request_queries).items()
+        # Session, user and the purchases
+        self.assertEqual(sum(series[:-1]), 1)
+        self.assertEqual(series[-1], 3)
+
+    def test_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertContains(response, '# TYPE sell_orders_total counter')
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        # Staff sessions don't bypass a configured token
+        self.client.force_login(User.objects.create_user('admin', password='pw', is_staff=True))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+
+@skipIf(metrics.fcntl is None, 'snapshots are only compacted where fcntl is available')
+class MetricsDirectoryTests(SimpleTestCase):
+    """Snapshots of exited workers are folded into one file, without losing counts"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.host = socket.gethostname()
+
+    def write(self, filename, orders):
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            json.dump({'sell_orders_total': [[[], orders]], 'sell_order_lots': [[[], [orders] + [0] * 10 + [orders]]]}, f)
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def test_exited_snapshots_are_folded_into_totals(self):
+        dead = exited_pid()
+        self.write(f'{self.host}-{dead}-100.json', 3)
+        self.write(f'{self.host}-{dead}-200.json', 2)
+        self.write(f'{self.host}-{os.getpid()}-300.json', 7)
+        self.write(f'other-host-{dead}-100.json', 5)
+
+        metrics._compact(self.directory)
+        self.assertEqual(self.files(), sorted([
+            metrics.TOTALS_FILE, f'{self.host}-{os.getpid()}-300.json', f'other-host-{dead}-100.json',
+        ]))
+
+        self.write(f'{self.host}-{dead}-400.json', 1)
+        with override_settings(METRICS_DIR=self.directory), mock.patch.object(metrics, 'flush'):
+            totals = metrics._collect()
+        self.assertEqual(len(self.files()), 3)
+        self.assertEqual(totals['sell_orders_total'][()], 3 + 2 + 7 + 5 + 1)
+        self.assertEqual(totals['sell_order_lots'][()][0], 18)
+
+        with open(os.path.join(self.directory, metrics.TOTALS_FILE)) as f:
+            self.assertEqual(json.load(f)['sell_orders_total'], [[[], 6]])
+
+    def test_unreadable_totals_are_left_alone(self):
+        with open(os.path.join(self.directory, metrics.TOTALS_FILE), 'w') as f:
+            f.write('{not json')
+        self.write(f'{self.host}-{exited_pid()}-100.json', 3)
+        with self.assertLogs('authentication.metrics', 'WARNING'):
+            metrics._compact(self.directory)
+        self.assertEqual(len(self.files()), 2)
@@ -0,0 +1,104 @@
+from datetime import date
+from decimal import Decimal
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+from authentication.models import SellOrder, Share_Buy, Share_Sell
+
+BEFORE_SELL_ORDERS = [('authentication', '0009_transaction_history_indexes')]
+AMOUNT_KEYS = (
+    'gross_sale', 'sebon_fee', 'dp_charge', 'broker_commission', 'net_sale', 'receivable_amount',
+    'total_buy_cost', 'profit_before_tax', 'tax_amount', 'final_profit', 'holding_period_days',
+)
+
+
+class SellOrderMigrationTests(TransactionTestCase):
+    """0010_sellorder turns the existing sell lots into orders billed like one sale each"""
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(BEFORE_SELL_ORDERS)
+        apps = executor.loader.project_state(BEFORE_SELL_ORDERS).apps
+        User = apps.get_model('auth', 'User')
+        OldShareBuy = apps.get_model('authentication', 'Share_Buy')
+        OldShareSell = apps.get_model('authentication', 'Share_Sell')
+
+        user = User.objects.create(username='trader')
+        self.user_id = user.id
+
+        def buy(scrip, units, price, day):
+            return OldShareBuy.objects.create(
+                user=user, scrip=scrip, units=units, remaining_units=units, buying_price=Decimal(price), transaction_date=day,
+            )
+
+        def sell(share, units, price, day, group=None):
+            share.remaining_units -= units
+            share.save()
+            return OldShareSell.objects.create(
+                user=user, share=share, units_sold=units, selling_price=Decimal(price), transaction_date=day,
+                transaction_group=group,
+            )
+
+        nabil_1 = buy('NABIL', 100, '500', date(2024, 1, 1))
+        nabil_2 = buy('NABIL', 50, '600', date(2024, 6, 1))
+        nabil_3 = buy('NABIL', 30, '550', date(2024, 7, 1))
+        nica = buy('NICA', 20, '1000', date(2024, 1, 1))
+        # Grouped sale across two purchases, in the 0.33% broker slab
+        sell(nabil_1, 100, '700', date(2024, 12, 1), group='g1')
+        sell(nabil_2, 20, '700', date(2024, 12, 1), group='g1')
+        # Recorded before transaction groups: the lots of one sale share date and price
+        sell(nabil_2, 10, '650', date(2025, 1, 10))
+        sell(nabil_3, 10, '650', date(2025, 1, 10))
+        # One lot held exactly 365 days, and one sold at a loss
+        sell(nica, 20, '1200', date(2024, 12, 31))
+        sell(nabil_3, 20, '400', date(2025, 2, 1), group='g2')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def assertAmountsEqual(self, stored, expected):
+        for key in AMOUNT_KEYS:
+            with self.subTest(key=key):
+                self.assertLessEqual(abs(Decimal(stored[key]) - Decimal(expected[key])), Decimal('0.01'))
+
+    def reference(self, order):
+        """calculate_profit_loss of the whole order as one lot of its earliest purchase"""
+        lots = list(order.lots.select_related('share'))
+        first_share = min((lot.share for lot in lots), key=lambda share: share.transaction_date)
+        sale = Share_Sell(
+            user_id=order.user_id, share=first_share, units_sold=order.units_sold,
+            selling_price=order.selling_price, transaction_date=order.transaction_date,
+        )
+        return sale.calculate_profit_loss(wacc=Share_Buy.scrip_wacc(order.user_id, order.scrip))
+
+    def test_every_lot_gets_one_order(self):
+        self.assertFalse(Share_Sell.objects.filter(order__isnull=True).exists())
+        orders = SellOrder.objects.filter(user_id=self.user_id).order_by('transaction_date', 'id')
+        self.assertEqual(
+            [(order.scrip, order.units_sold, order.lots.count()) for order in orders],
+            [('NABIL', 120, 2), ('NICA', 20, 1), ('NABIL', 20, 2), ('NABIL', 20, 1)],
+        )
+
+    def test_order_amounts_match_calculate_profit_loss(self):
+        for order in SellOrder.objects.filter(user_id=self.user_id):
+            with self.subTest(order=str(order)):
+                self.assertAmountsEqual(order.profit_loss(), self.reference(order))
+                self.assertLessEqual(abs(order.wacc - Share_Buy.scrip_wacc(self.user_id, order.scrip)), Decimal('0.0001'))
+
+    def test_single_lot_orders_match_their_lot(self):
+        for order in SellOrder.objects.filter(user_id=self.user_id):
+            lots = list(order.lots.all())
+            if len(lots) == 1:
+                with self.subTest(order=str(order)):
+                    self.assertAmountsEqual(order.profit_loss(), lots[0].calculate_profit_loss())
+
+    def test_long_term_and_loss(self):
+        nica = SellOrder.objects.get(user_id=self.user_id, scrip='NICA')
+        self.assertEqual(nica.holding_period_days, 365)
+        self.assertLessEqual(abs(nica.capital_gains_tax - nica.profit_before_tax * Decimal('0.05')), Decimal('0.01'))
+
+        loss = SellOrder.objects.get(user_id=self.user_id, scrip='NABIL', selling_price=Decimal('400'))
+        self.assertLess(loss.profit_before_tax, 0)
+        self.assertEqual(loss.capital_gains_tax, 0)
@@ -0,0 +1,63 @@
+import random
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db.models import Sum
+from django.test import TestCase
+
+from authentication.models import SellOrder, Share_Buy, Share_Sell
+from authentication.portfolio_data import generate_portfolio
+
+
+class GeneratePortfolioTests(TestCase):
+    """Bulk-written history must look exactly like history the app recorded itself"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('loadtest', password='pw')
+
+    def test_history_is_consistent_fifo(self):
+        prices = generate_portfolio(self.user, 400, scrips=5, sell_ratio=0.4, rng=random.Random(7))
+        self.assertEqual(len(prices), 5)
+        orders = SellOrder.objects.filter(user=self.user)
+        self.assertEqual(Share_Buy.objects.filter(user=self.user).count() + orders.count(), 400)
+        self.assertGreater(orders.count(), 50)
+
+        for order in orders.prefetch_related('lots'):
+            self.assertEqual(sum(lot.units_sold for lot in order.lots.all()), order.units_sold)
+            self.assertTrue(all(lot.transaction_group == f'order-{order.id}' for lot in order.lots.all()))
+
+        sold = dict(Share_Sell.objects.filter(user=self.user).values_list('share').annotate(Sum('units_sold')))
+        for share in Share_Buy.objects.filter(user=self.user).order_by('scrip', 'transaction_date', 'id'):
+            self.assertEqual(share.remaining_units, share.units - sold.get(share.id, 0), share)
+
+        # FIFO: per scrip, no lot has units left while a later lot was sold from
+        for scrip in prices:
+            lots = list(Share_Buy.objects.filter(user=self.user, scrip=scrip).order_by('transaction_date', 'id'))
+            touched = [lot.remaining_units < lot.units for lot in lots]
+            if True in touched:
+                last_sold = len(touched) - touched[::-1].index(True) - 1
+                self.assertTrue(all(lot.remaining_units == 0 for lot in lots[:last_sold]), scrip)
+
+    def test_seeded_runs_repeat(self):
+        other = User.objects.create_user('loadtest2', password='pw')
+        self.assertEqual(
+            generate_portfolio(self.user, 100, rng=random.Random(1)),
+            generate_portfolio(other, 100, rng=random.Random(1)),
+        )
+        fields = ('scrip', 'units', 'remaining_units', 'buying_price', 'transaction_date')
+        self.assertEqual(
+            list(Share_Buy.objects.filter(user=self.user).order_by('id').values_list(*fields)),
+            list(Share_Buy.objects.filter(user=other).order_by('id').values_list(*fields)),
+        )
+
+    def test_command(self):
+        out = StringIO()
+        call_command('generate_portfolio_data', '--users', '2', '--transactions', '50', '--prefix', 'bench', '--seed', '3', stdout=out)
+        self.assertEqual(User.objects.filter(username__in=['bench1', 'bench2']).count(), 2)
+        self.assertIn('Created 2 user(s)', out.getvalue())
+
+        with self.assertRaisesMessage(CommandError, 'bench1 already exists'):
+            call_command('generate_portfolio_data', '--prefix', 'bench', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, '--sell-ratio'):
+            call_command('generate_portfolio_data', '--sell-ratio', '1', stdout=StringIO())
@@ -0,0 +1,38 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from authentication.models import Share_Buy
+
+from .utils import fake_market
+
+
+class PortfolioCurrentValueTests(TestCase):
+    """A holding's current value is its LTP times the units held, never an estimate"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+        Share_Buy.objects.create(
+            user=self.user, scrip='NABIL', units=100, buying_price=Decimal('500'), transaction_date=date(2024, 1, 1),
+        )
+        self.client.force_login(self.user)
+
+    def current_value(self, stocks):
+        with fake_market(stocks):
+            response = self.client.get(reverse('sharehub_portfolio'))
+        self.assertEqual(response.status_code, 200)
+        html = response.content.decode()
+        start = html.index('Current Value</span>')
+        return html[start:html.index('</div>', start)]
+
+    def test_value_at_ltp(self):
+        value = self.current_value([{'symbol': 'NABIL', 'ltp': 523.5, 'change': 3.5, 'changePercent': 0.67}])
+        self.assertIn('<span data-live="value">52350.00</span>', value)
+
+    def test_no_price_shows_a_dash(self):
+        value = self.current_value([])
+        self.assertIn('&mdash;', value)
+        self.assertNotIn('Rs.', value)
@@ -0,0 +1,75 @@
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from authentication import request_profiling
+from authentication.models import Share_Buy
+from authentication.request_profiling import RequestProfile, fingerprint
+
+from .utils import fake_market
+
+
+class FingerprintTests(SimpleTestCase):
+
+    def test_same_lookup_with_other_values_matches(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM share WHERE id = 12 AND scrip = \'NABIL\''),
+            fingerprint('SELECT * FROM share WHERE id = 7 AND scrip = \'O\'\'HARA\''),
+        )
+        self.assertEqual(fingerprint('WHERE id IN (%s, %s, %s)'), fingerprint('WHERE id IN (%s)'))
+
+    def test_repeated_queries_are_flagged(self):
+        profile = RequestProfile(SimpleNamespace(method='GET', get_full_path=lambda: '/'))
+        execute = lambda sql, params, many, context: None
+        for share_id in (1, 2, 3):
+            profile(execute, f'SELECT * FROM share WHERE id = {share_id}', None, False, {})
+        profile(execute, 'SELECT * FROM sale', None, False, {})
+
+        self.assertEqual(profile.sql_count, 4)
+        self.assertEqual([(query['sql'], query['count']) for query in profile.duplicates], [('SELECT * FROM share WHERE id = ?', 3)])
+        self.assertEqual(profile.duplicate_count, 2)
+
+
+class RequestProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        request_profiling._buffer.clear()
+        self.addCleanup(request_profiling._buffer.clear)
+        self.user = User.objects.create_user('trader', password='pw', is_staff=True)
+        for day in (1, 2):
+            Share_Buy.objects.create(
+                user=self.user, scrip='NABIL', units=10, buying_price=Decimal('500'), transaction_date=date(2024, 1, day),
+            )
+        self.client.force_login(self.user)
+
+    @override_settings(REQUEST_PROFILING=True)
+    def test_requests_are_recorded_for_staff(self):
+        with fake_market():
+            self.assertEqual(self.client.get(reverse('sharehub_portfolio')).status_code, 200)
+        self.client.get('/static/css/missing.css')
+
+        [profile] = request_profiling.recent_profiles()
+        self.assertEqual((profile.view, profile.status), ('sharehub_portfolio', 200))
+        self.assertGreater(profile.sql_count, 0)
+        self.assertGreater(profile.wall_ms, profile.sql_ms)
+        self.assertIn('template', profile.sections)
+
+        response = self.client.get(reverse('request_profiles'))
+        self.assertContains(response, 'sharehub_portfolio')
+        response = self.client.get(reverse('request_profiles'), {'id': profile.id})
+        self.assertContains(response, profile.path)
+        self.assertEqual(self.client.get(reverse('request_profiles'), {'id': 'x'}).status_code, 404)
+
+    @override_settings(REQUEST_PROFILING=True)
+    def test_page_is_staff_only(self):
+        self.client.force_login(User.objects.create_user('other', password='pw'))
+        self.assertEqual(self.client.get(reverse('request_profiles')).status_code, 302)
+
+    def test_off_by_default(self):
+        with fake_market():
+            self.client.get(reverse('sharehub_portfolio'))
+        self.assertEqual(request_profiling.recent_profiles(), [])
@@ -0,0 +1,62 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from authentication.models import SellOrder, Share_Buy
+
+
+class SellOrderRefreshTests(TestCase):
+    """Stored order amounts follow edits of the purchases and lots they were worked out from"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+        self.first = Share_Buy.objects.create(
+            user=self.user, scrip='NABIL', units=100, buying_price=Decimal('500'), transaction_date=date(2024, 1, 10),
+        )
+        self.second = Share_Buy.objects.create(
+            user=self.user, scrip='NABIL', units=100, buying_price=Decimal('520'), transaction_date=date(2024, 3, 1),
+        )
+        self.order = SellOrder.record(
+            self.user, [self.first], 60, Decimal('700'), date(2024, 6, 1),
+        )
+        self.client.force_login(self.user)
+
+    def expected(self, first_purchase_date):
+        order = SellOrder(
+            user=self.user, scrip='NABIL', units_sold=self.order.units_sold,
+            selling_price=self.order.selling_price, transaction_date=self.order.transaction_date,
+        )
+        order.calculate(Share_Buy.scrip_wacc(self.user, 'NABIL'), first_purchase_date)
+        return order
+
+    def assertMatches(self, order, expected):
+        self.assertEqual(order.holding_period_days, expected.holding_period_days)
+        for field in ('wacc', 'buy_cost', 'capital_gains_tax', 'net_amount'):
+            places = Decimal(1).scaleb(-order._meta.get_field(field).decimal_places)
+            self.assertEqual(getattr(order, field), getattr(expected, field).quantize(places), field)
+
+    def test_edit_buy_recalculates_its_orders(self):
+        old_buy_cost = self.order.buy_cost
+        response = self.client.post(reverse('edit_buy_transaction', args=[self.first.id]), {
+            'units': 100, 'buying_price': '450', 'transaction_date': '2023-05-01',
+        })
+        self.assertEqual(response.status_code, 302)
+
+        self.order.refresh_from_db()
+        self.assertLess(self.order.buy_cost, old_buy_cost)
+        self.assertEqual(self.order.holding_period_days, (date(2024, 6, 1) - date(2023, 5, 1)).days)
+        self.assertMatches(self.order, self.expected(date(2023, 5, 1)))
+
+    def test_lot_edit_takes_the_current_wacc(self):
+        Share_Buy.objects.filter(pk=self.second.pk).update(buying_price=Decimal('900'))
+        lot = self.order.lots.get()
+        lot.units_sold = 50
+        lot.save()
+        self.order.refresh_from_lots()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.units_sold, 50)
+        self.assertMatches(self.order, self.expected(date(2024, 1, 10)))
@@ -0,0 +1,60 @@
+import os
+import runpy
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase
+
+SETTINGS_FILE = os.path.join(settings.BASE_DIR, 'project', 'settings.py')
+
+
+def database_settings(**environ):
+    """DATABASES['default'] as project/settings.py builds it under the given environment"""
+    names = ('DB_ENGINE', 'DB_NAME', 'DB_POOL', 'DB_PGBOUNCER', 'DB_CONN_MAX_AGE', 'SQLITE_TUNED', 'SQLITE_BUSY_TIMEOUT')
+    with mock.patch.dict(os.environ, {'EMAIL_PORT': '587'}):
+        for name in names:
+            os.environ.pop(name, None)
+        os.environ.update(environ)
+        return runpy.run_path(SETTINGS_FILE)['DATABASES']['default']
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    """The database is picked and tuned from the environment"""
+
+    def test_tuned_sqlite_by_default(self):
+        database = database_settings()
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(database['OPTIONS']['timeout'], 20)
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('PRAGMA journal_mode=WAL;', database['OPTIONS']['init_command'])
+
+        database = database_settings(SQLITE_TUNED='False', SQLITE_BUSY_TIMEOUT='5')
+        self.assertEqual(database['OPTIONS'], {'timeout': 5})
+
+    def test_tuned_sqlite_connection_uses_wal(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # A connection of its own, outside the test database
+        connection = ConnectionHandler({'default': {}, 'wal': database_settings(DB_NAME=os.path.join(directory, 'db.sqlite3'))})['wal']
+        self.addCleanup(connection.close)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_postgresql(self):
+        database = database_settings(DB_ENGINE='postgresql', DB_NAME='shares', DB_CONN_MAX_AGE='120')
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((database['NAME'], database['CONN_MAX_AGE']), ('shares', 120))
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('DISABLE_SERVER_SIDE_CURSORS', database)
+
+    def test_postgresql_pool_behind_pgbouncer(self):
+        database = database_settings(DB_ENGINE='postgres', DB_POOL='True', DB_PGBOUNCER='True')
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 2, 'max_size': 10, 'timeout': 10})
+        self.assertTrue(database['DISABLE_SERVER_SIDE_CURSORS'])
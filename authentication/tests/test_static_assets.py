@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.staticfiles import finders
+from django.template import engines
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from authentication.static_serving import IMMUTABLE_MAX_AGE, MAX_AGE, serve_static
+
+
+class BaseTemplateAssetTests(TestCase):
+    """The shared CSS and JavaScript are static files, not inlined into every page"""
+
+    def test_pages_link_the_static_assets(self):
+        response = self.client.get(reverse('login'))
+        self.assertContains(response, '<link href="/static/authentication/css/base.css" rel="stylesheet">', html=True)
+        self.assertContains(response, '<script src="/static/authentication/js/base.js"></script>', html=True)
+        self.assertNotIn('<style>', response.content.decode().split('</head>')[0])
+        for path in ('authentication/css/base.css', 'authentication/js/base.js'):
+            self.assertIsNotNone(finders.find(path), path)
+
+    def test_compiled_templates_are_cached(self):
+        engine = engines['django']
+        self.assertIs(engine.get_template('base.html').template, engine.get_template('base.html').template)
+
+
+class ServeStaticCacheTests(SimpleTestCase):
+    """SERVE_STATIC sends hashed names as immutable and revalidates the rest hourly"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.root, 'css'))
+        for name in ('base.css', 'base.0123456789ab.css'):
+            with open(os.path.join(self.root, 'css', name), 'w') as f:
+                f.write('body { margin: 0; }')
+
+    def get(self, path):
+        with override_settings(STATIC_ROOT=self.root):
+            response = serve_static(RequestFactory().get(f'/static/{path}'), path)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hashed_names_are_immutable(self):
+        response = self.get('css/base.0123456789ab.css')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={IMMUTABLE_MAX_AGE}, immutable')
+
+    def test_other_files_are_revalidated(self):
+        response = self.get('css/base.css')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={MAX_AGE}')
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from authentication import tms_service
+from authentication.models import TMSSyncJob
+from authentication.tms_jobs import finish_job
+from authentication.tms_service import run_in_tms_loop
+
+
+class TMSLoopTests(SimpleTestCase):
+    """The sync wrappers run on one long-lived loop thread, never on the caller's loop"""
+
+    async def thread_name(self):
+        return threading.current_thread().name
+
+    def test_coroutines_share_the_loop_thread(self):
+        self.assertEqual(run_in_tms_loop(self.thread_name()), 'tms-event-loop')
+        self.assertIs(tms_service._TMSLoopThread.get_loop(), tms_service._TMSLoopThread.get_loop())
+
+    def test_callable_while_another_loop_is_running(self):
+        async def view():
+            # What an async view calling a sync wrapper does under ASGI
+            return run_in_tms_loop(self.thread_name())
+
+        self.assertEqual(asyncio.run(view()), 'tms-event-loop')
+
+    def test_wrapper_reports_missing_playwright(self):
+        with mock.patch.object(tms_service, 'PLAYWRIGHT_AVAILABLE', False):
+            result = tms_service.fetch_tms_data(User(id=1))
+        self.assertFalse(result['success'])
+        self.assertIn('Playwright', result['error'])
+
+
+class InlineFetchViewTests(TransactionTestCase):
+    """TMS_SYNC_MODE=inline awaits the async fetcher inside the request"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+        self.client.force_login(self.user)
+
+    @override_settings(TMS_SYNC_MODE='inline')
+    def test_fetch_is_awaited_in_the_request(self):
+        result = {'success': True, 'records_found': 2, 'records_saved': 0, 'data': []}
+        with mock.patch.object(tms_service, 'afetch_tms_data', mock.AsyncMock(return_value=result)) as afetch:
+            response = self.client.post(reverse('fetch_tms_data'), {'tms_number': '58', 'full_sync': 'on'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        afetch.assert_awaited_once_with(self.user, tms_number=58, settlement_type='PaymentDue', full_sync=True)
+        self.assertFalse(TMSSyncJob.objects.exists())
+
+
+class WorkerConcurrencyTests(TransactionTestCase):
+    """run_tms_worker runs up to --concurrency syncs at once on its event loop"""
+
+    def test_jobs_overlap_up_to_the_concurrency(self):
+        user = User.objects.create_user('trader', password='pw')
+        for tms_number in (52, 58, 61):
+            TMSSyncJob.objects.create(user=user, tms_server_number=tms_number)
+        active = []
+        peak = []
+
+        async def arun_job(job):
+            active.append(job.id)
+            peak.append(len(active))
+            await asyncio.sleep(0.05)
+            active.remove(job.id)
+            result = {'success': True, 'records_found': 1, 'records_saved': 1}
+            await sync_to_async(finish_job)(job, result)
+            return result
+
+        with mock.patch('authentication.management.commands.run_tms_worker.arun_job', arun_job):
+            call_command('run_tms_worker', '--once', '--concurrency', '2', stdout=StringIO())
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(TMSSyncJob.objects.filter(status=TMSSyncJob.STATUS_SUCCEEDED).count(), 3)
@@ -0,0 +1,96 @@
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from authentication import tms_service
+from authentication.models import Share_Buy
+from authentication.tms_service import save_imported_purchases, tms_import_key
+
+
+def purchase(transaction_no, scrip='NABIL', units=10, price='500.00', day=date(2025, 3, 4)):
+    return {
+        'scrip': scrip,
+        'units': units,
+        'buying_price': Decimal(price),
+        'transaction_no': transaction_no,
+        'transaction_date': day,
+    }
+
+
+class SaveImportedPurchasesTests(TestCase):
+    """Imports insert each TMS transaction once and report only the rows they inserted"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+
+    def test_rerun_inserts_nothing(self):
+        rows = [purchase('1001'), purchase('1002', scrip='NICA'), purchase(None, scrip='SBL')]
+        saved = save_imported_purchases(self.user, rows, 52)
+        self.assertEqual(len(saved), 3)
+        self.assertTrue(all(record.pk for record in saved))
+        self.assertEqual(
+            {record.tms_import_key for record in saved},
+            {tms_import_key(52, row) for row in rows},
+        )
+
+        self.assertEqual(save_imported_purchases(self.user, [dict(row) for row in rows], 52), [])
+        self.assertEqual(Share_Buy.objects.filter(user=self.user).count(), 3)
+
+    def test_same_transaction_on_another_server_is_a_new_row(self):
+        save_imported_purchases(self.user, [purchase('1001')], 52)
+        self.assertEqual(len(save_imported_purchases(self.user, [purchase('1001')], 58)), 1)
+
+    def test_manually_entered_rows_are_matched(self):
+        Share_Buy.objects.create(
+            user=self.user, scrip='NABIL', units=10, buying_price=Decimal('500.00'), transaction_date=date(2025, 3, 4),
+        )
+        # Two identical fills on the day, one of them already typed in by hand
+        saved = save_imported_purchases(self.user, [purchase('1001'), purchase('1002')], 52)
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(Share_Buy.objects.filter(user=self.user, scrip='NABIL').count(), 2)
+        # A different price is a different purchase
+        self.assertEqual(len(save_imported_purchases(self.user, [purchase('1003', price='501.00')], 52)), 1)
+
+    def test_rows_inserted_concurrently_are_not_counted(self):
+        rows = [purchase('1001'), purchase('1002'), purchase('1003')]
+        real_key = tms_service.tms_import_key
+
+        def key_then_concurrent_insert(tms_number, data):
+            key = real_key(tms_number, data)
+            if data['transaction_no'] == '1002':
+                # Another sync commits the same transaction after our keys were read
+                Share_Buy.objects.create(
+                    user=self.user, scrip='NABIL', units=10, buying_price=Decimal('500.00'),
+                    transaction_date=date(2025, 3, 4), tms_import_key=key,
+                )
+            return key
+
+        with mock.patch.object(tms_service, 'tms_import_key', key_then_concurrent_insert):
+            saved = save_imported_purchases(self.user, rows, 52)
+        self.assertEqual([record.tms_import_key for record in saved], ['tms52:1001', 'tms52:1003'])
+        self.assertEqual(Share_Buy.objects.filter(user=self.user).count(), 3)
+
+    def test_import_key_is_unique_per_user(self):
+        Share_Buy.objects.create(
+            user=self.user, scrip='NABIL', units=10, buying_price=Decimal('500'),
+            transaction_date=date(2025, 3, 4), tms_import_key='tms52:1001',
+        )
+        other = User.objects.create_user('other', password='pw')
+        Share_Buy.objects.create(
+            user=other, scrip='NABIL', units=10, buying_price=Decimal('500'),
+            transaction_date=date(2025, 3, 4), tms_import_key='tms52:1001',
+        )
+        # Manual rows have no key and never collide
+        for _ in range(2):
+            Share_Buy.objects.create(
+                user=self.user, scrip='NABIL', units=10, buying_price=Decimal('500'), transaction_date=date(2025, 3, 4),
+            )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Share_Buy.objects.create(
+                user=self.user, scrip='NICA', units=5, buying_price=Decimal('700'),
+                transaction_date=date(2025, 3, 5), tms_import_key='tms52:1001',
+            )
@@ -0,0 +1,95 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from authentication import tms_instrumentation
+from authentication.models import TMSSyncRun
+from authentication.tms_instrumentation import SyncInstrumentation, record_sync_run
+from authentication.utils import percentile
+
+
+class SyncInstrumentationTests(SimpleTestCase):
+
+    def test_repeated_phases_accumulate_in_phase_order(self):
+        clock = [0.0, 1.0, 3.0, 3.5, 4.0, 4.5, 5.0, 10.0]
+        with mock.patch.object(tms_instrumentation.time, 'perf_counter', side_effect=clock):
+            instrumentation = SyncInstrumentation(52, 'PaymentDue', user_id=1)
+            with instrumentation.phase('navigate'):
+                pass
+            with instrumentation.phase('login'):
+                pass
+            with instrumentation.phase('navigate'):
+                pass
+            with self.assertLogs('authentication.tms_instrumentation', 'INFO') as logs:
+                summary = instrumentation.summary(True, records_found=4, records_saved=3)
+        self.assertEqual(list(summary['timings'].items()), [('login', 0.5), ('navigate', 2.5)])
+        self.assertEqual(summary['duration'], 10.0)
+        self.assertEqual(logs.records[0].tms['event'], 'summary')
+
+    def test_events_are_not_formatted_unless_emitted(self):
+        formatted = []
+
+        class Row:
+            def __repr__(self):
+                formatted.append(self)
+                return 'row'
+
+        instrumentation = SyncInstrumentation(52)
+        with mock.patch.object(tms_instrumentation.logger, 'isEnabledFor', return_value=False):
+            instrumentation.event('row', cells=Row())
+        self.assertEqual(formatted, [])
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 11))
+        self.assertEqual([percentile(values, p) for p in (50, 90, 99)], [5, 9, 10])
+        self.assertIsNone(percentile([], 50))
+
+
+class SyncRunHistoryTests(TestCase):
+    """Every finished sync leaves a TMSSyncRun that tms_sync_stats reports on"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+
+    def run_summary(self, tms_number, duration, success=True, **timings):
+        now = timezone.now()
+        return {
+            'tms_number': tms_number, 'settlement_type': 'PaymentDue', 'user_id': self.user.id, 'success': success,
+            'records_found': 2, 'records_saved': 1, 'error': '' if success else 'Timed out',
+            'started_at': now - timedelta(seconds=duration), 'finished_at': now, 'duration': duration,
+            'timings': timings,
+        }
+
+    def test_summary_is_stored_with_its_phases(self):
+        run = record_sync_run(self.run_summary(52, 12.5, login=8.0, extract=1.5))
+        self.assertEqual((run.login_seconds, run.extract_seconds, run.expand_seconds), (8.0, 1.5, None))
+        self.assertEqual(run.duration_seconds, 12.5)
+
+        # A launch shared by several servers has no server of its own
+        self.assertIsNone(record_sync_run(self.run_summary(None, 1.0)))
+
+    def test_stats_per_server(self):
+        for duration in range(1, 11):
+            record_sync_run(self.run_summary(52, float(duration), login=duration / 2))
+        record_sync_run(self.run_summary(52, 500.0, success=False))
+        record_sync_run(self.run_summary(58, 20.0))
+        old = record_sync_run(self.run_summary(58, 900.0))
+        TMSSyncRun.objects.filter(pk=old.pk).update(started_at=timezone.now() - timedelta(days=60))
+
+        out = StringIO()
+        call_command('tms_sync_stats', '--server', '52', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('TMS52: 11 syncs, 91% succeeded, 11 purchases saved', lines[0])
+        # The failed 500s run is left out of the timings
+        self.assertEqual(lines[2].split(), ['duration', '10', '5.0s', '9.0s', '10.0s', '10.0s'])
+        self.assertEqual(lines[3].split(), ['login', '10', '2.5s', '4.5s', '5.0s', '5.0s'])
+
+        out = StringIO()
+        call_command('tms_sync_stats', stdout=out)
+        self.assertIn('TMS58: 1 syncs', out.getvalue())
+        self.assertIn('All servers: 12 syncs', out.getvalue())
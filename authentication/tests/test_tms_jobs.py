@@ -0,0 +1,206 @@
+import asyncio
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from authentication.models import TMSSyncJob
+from authentication.tms_jobs import (
+    _keep_alive, claim_next_job, enqueue_tms_sync, finish_job, publish_captcha, requeue_stale_jobs, submit_login_answer,
+    take_login_answer, touch_job, update_job_progress, withdraw_captcha,
+)
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'tms_login': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tms-login-tests'},
+}
+
+
+class QueueTests(TestCase):
+    """Views only queue a sync; a worker claims it and the page polls its status"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+
+    def test_double_submit_reuses_the_active_job(self):
+        job = enqueue_tms_sync(self.user, 52)
+        self.assertEqual(enqueue_tms_sync(self.user, 52).pk, job.pk)
+        self.assertNotEqual(enqueue_tms_sync(self.user, 58).pk, job.pk)
+        self.assertNotEqual(enqueue_tms_sync(self.user, 52, 'Success').pk, job.pk)
+        self.assertEqual(TMSSyncJob.objects.count(), 3)
+
+    def test_full_sync_upgrades_a_queued_job_only(self):
+        job = enqueue_tms_sync(self.user, 52)
+        enqueue_tms_sync(self.user, 52, full_sync=True)
+        job.refresh_from_db()
+        self.assertTrue(job.full_sync)
+
+        running = enqueue_tms_sync(self.user, 58)
+        claim_next_job('host:1')
+        claim_next_job('host:1')
+        enqueue_tms_sync(self.user, 58, full_sync=True)
+        running.refresh_from_db()
+        self.assertFalse(running.full_sync)
+
+    def test_oldest_job_is_claimed_first(self):
+        first = enqueue_tms_sync(self.user, 52)
+        second = enqueue_tms_sync(self.user, 58)
+        TMSSyncJob.objects.filter(pk=second.pk).update(created_at=first.created_at - timedelta(minutes=1))
+
+        claimed = claim_next_job('host:1')
+        self.assertEqual(claimed.pk, second.pk)
+        self.assertEqual((claimed.status, claimed.worker), (TMSSyncJob.STATUS_RUNNING, 'host:1'))
+        self.assertEqual(claim_next_job('host:2').pk, first.pk)
+        self.assertIsNone(claim_next_job('host:3'))
+
+    @override_settings(TMS_SYNC_MODE='queue')
+    def test_fetch_view_queues_and_redirects(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('fetch_tms_data'), {'tms_number': '58', 'settlement_type': 'Success'})
+        job = TMSSyncJob.objects.get()
+        self.assertRedirects(response, f"{reverse('fetch_tms_data')}?job={job.id}", fetch_redirect_response=False)
+        self.assertEqual((job.tms_server_number, job.settlement_type, job.status), (58, 'Success', TMSSyncJob.STATUS_QUEUED))
+
+    def test_status_view_is_private_to_the_owner(self):
+        job = enqueue_tms_sync(self.user, 52)
+        url = reverse('tms_sync_status', args=[job.id])
+
+        self.client.force_login(self.user)
+        status = self.client.get(url).json()
+        self.assertEqual((status['id'], status['status'], status['captcha_image']), (job.id, TMSSyncJob.STATUS_QUEUED, ''))
+
+        self.client.force_login(User.objects.create_user('other', password='pw'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LoginAnswerHandOffTests(TestCase):
+    """The headless TMS login answer reaches the worker without touching the database"""
+
+    def setUp(self):
+        caches['tms_login'].clear()
+        self.user = User.objects.create_user('trader', password='pw')
+        self.job = TMSSyncJob.objects.create(user=self.user, status=TMSSyncJob.STATUS_RUNNING)
+        publish_captcha(self.job.id, 52, b'png')
+        self.job.refresh_from_db()
+
+    def assertPasswordNotInDatabase(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT * FROM {TMSSyncJob._meta.db_table}')
+            for row in cursor.fetchall():
+                self.assertNotIn('s3cret', ' '.join(str(value) for value in row))
+
+    def test_answer_is_taken_once(self):
+        self.assertTrue(submit_login_answer(self.job, 'client', 's3cret', 'ab12'))
+        self.assertPasswordNotInDatabase()
+
+        answer = take_login_answer(self.job.id)
+        self.assertEqual(answer, {'username': 'client', 'password': 's3cret', 'captcha': 'ab12'})
+        self.assertIsNone(take_login_answer(self.job.id))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, TMSSyncJob.STATUS_RUNNING)
+        self.assertEqual(self.job.captcha_image, '')
+
+    def test_rejected_unless_awaiting_login(self):
+        withdraw_captcha(self.job.id)
+        self.assertFalse(submit_login_answer(self.job, 'client', 's3cret', 'ab12'))
+        self.assertIsNone(take_login_answer(self.job.id))
+
+    def test_new_captcha_discards_old_answer(self):
+        submit_login_answer(self.job, 'client', 's3cret', 'ab12')
+        publish_captcha(self.job.id, 52, b'png', error='Invalid captcha')
+        self.assertIsNone(take_login_answer(self.job.id))
+
+    def test_finished_and_requeued_jobs_drop_unread_answers(self):
+        submit_login_answer(self.job, 'client', 's3cret', 'ab12')
+        finish_job(self.job, {'success': False, 'error': 'Timed out'})
+        self.assertIsNone(take_login_answer(self.job.id))
+
+        other = TMSSyncJob.objects.create(user=self.user, tms_server_number=58)
+        publish_captcha(other.id, 58, b'png')
+        TMSSyncJob.objects.filter(pk=other.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        submit_login_answer(other, 'client', 's3cret', 'cd34')
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=30)), 1)
+        self.assertIsNone(take_login_answer(other.id))
+
+    def test_login_view(self):
+        self.client.force_login(self.user)
+        url = reverse('tms_sync_login', args=[self.job.id])
+        response = self.client.post(url, {'username': 'client', 'password': 's3cret', 'captcha': 'ab12'})
+        self.assertEqual(response.status_code, 200)
+        self.assertPasswordNotInDatabase()
+        self.assertEqual(take_login_answer(self.job.id)['password'], 's3cret')
+
+        response = self.client.post(url, {'username': 'client', 'password': 's3cret', 'captcha': 'ab12'})
+        self.assertEqual(response.status_code, 409)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StaleJobTests(TestCase):
+    """Only jobs whose worker stopped sending heartbeats go back to the queue"""
+
+    def setUp(self):
+        caches['tms_login'].clear()
+        self.user = User.objects.create_user('trader', password='pw')
+        TMSSyncJob.objects.create(user=self.user)
+        self.job = claim_next_job('host:1')
+
+    def age(self, **fields):
+        TMSSyncJob.objects.filter(pk=self.job.pk).update(**{
+            name: timezone.now() - delta for name, delta in fields.items()
+        })
+
+    def test_long_running_job_with_heartbeats_is_kept(self):
+        self.age(started_at=timedelta(hours=2), heartbeat_at=timedelta(hours=2))
+        update_job_progress(self.job.id, 'Expanding settlement rows')
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=15)), 0)
+
+        self.age(heartbeat_at=timedelta(hours=1))
+        publish_captcha(self.job.id, 52, b'png')
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=15)), 0)
+
+    def test_silent_job_is_requeued(self):
+        self.age(heartbeat_at=timedelta(minutes=20))
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=15)), 1)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, TMSSyncJob.STATUS_QUEUED)
+        self.assertEqual(self.job.worker, '')
+
+    def test_old_run_cannot_finish_a_reclaimed_job(self):
+        stale_run = TMSSyncJob.objects.get(pk=self.job.pk)
+        self.age(heartbeat_at=timedelta(minutes=20))
+        requeue_stale_jobs(timedelta(minutes=15))
+        # Reclaimed by the same worker process, so only the claim time tells the runs apart
+        TMSSyncJob.objects.filter(pk=self.job.pk).update(started_at=timezone.now() - timedelta(minutes=1))
+        claim_next_job('host:1')
+        publish_captcha(self.job.id, 52, b'png')
+        new_run = TMSSyncJob.objects.get(pk=self.job.pk)
+        submit_login_answer(new_run, 'client', 's3cret', 'ab12')
+
+        self.assertFalse(touch_job(stale_run))
+        with self.assertLogs('authentication.tms_jobs', 'WARNING'):
+            self.assertFalse(finish_job(stale_run, {'success': True, 'records_found': 3, 'records_saved': 3}))
+        job = TMSSyncJob.objects.get(pk=self.job.pk)
+        self.assertEqual(job.status, TMSSyncJob.STATUS_AWAITING_LOGIN)
+        self.assertIsNotNone(take_login_answer(self.job.id))
+
+        self.assertTrue(finish_job(job, {'success': True, 'records_found': 3, 'records_saved': 2}))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.records_saved), (TMSSyncJob.STATUS_SUCCEEDED, 2))
+
+    async def test_keep_alive_stops_a_run_that_lost_its_job(self):
+        sync = asyncio.ensure_future(asyncio.sleep(60))
+        keep_alive = asyncio.ensure_future(_keep_alive(self.job, sync, interval=0))
+        await asyncio.sleep(0.05)
+        self.assertFalse(sync.done())
+        self.assertFalse(keep_alive.done())
+
+        await TMSSyncJob.objects.filter(pk=self.job.pk).aupdate(status=TMSSyncJob.STATUS_QUEUED, worker='')
+        with self.assertLogs('authentication.tms_jobs', 'WARNING'):
+            await keep_alive
+        with self.assertRaises(asyncio.CancelledError):
+            await sync
@@ -0,0 +1,199 @@
+import asyncio
+import os
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from authentication import tms_parser
+from authentication.tms_service import TMSDataFetcher
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tms_fixtures')
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+class SettlementHtmlTests(SimpleTestCase):
+    """parse_settlement_html on the saved Payment Due pages"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.expanded = fixture('payment_due_expanded.html')
+        cls.flat = fixture('payment_due_flat.html')
+
+    def test_expanded_rows(self):
+        rows = tms_parser.parse_settlement_html(self.expanded)
+        self.assertEqual(len(rows), 182)
+        self.assertEqual(rows[0], {
+            'scrip': 'NABIL',
+            'units': 300,
+            'buying_price': Decimal('373.30'),
+            'transaction_no': '2025852224245415',
+            'transaction_date': date(2025, 3, 3),
+            'business_date': date(2025, 3, 3),
+        })
+        # Thousands separators and the rate column of a later row
+        self.assertEqual(rows[2]['buying_price'], Decimal('1483.10'))
+        self.assertEqual(rows[-1]['business_date'], date(2025, 5, 12))
+        self.assertEqual(len({row['transaction_no'] for row in rows}), 182)
+
+    def test_flat_page_takes_the_page_business_date(self):
+        rows = tms_parser.parse_settlement_html(self.flat, fallback_date=date(2030, 1, 1))
+        self.assertEqual([row['scrip'] for row in rows], ['CHCL', 'SHIVM', 'SHIVM', 'NLIC', 'NICA'])
+        self.assertEqual(rows[3]['units'], 1000)
+        self.assertEqual(rows[3]['buying_price'], Decimal('601.00'))
+        self.assertEqual(rows[3]['transaction_no'], '2025845540953121')
+        self.assertEqual({row['business_date'] for row in rows}, {date(2025, 3, 4)})
+        self.assertEqual({row['transaction_date'] for row in rows}, {date(2025, 3, 4)})
+
+    def test_since_is_inclusive(self):
+        rows = tms_parser.parse_settlement_html(self.expanded)
+        for since in (date(2025, 3, 3), date(2025, 4, 1), date(2025, 5, 9), date(2025, 5, 12)):
+            with self.subTest(since=since):
+                expected = [row for row in rows if row['business_date'] >= since]
+                self.assertEqual(tms_parser.parse_settlement_html(self.expanded, since=since), expected)
+        self.assertEqual(len(tms_parser.parse_settlement_html(self.expanded, since=date(2025, 5, 12))), 7)
+
+        flat = tms_parser.parse_settlement_html(self.flat, since=date(2025, 3, 4))
+        self.assertEqual(len(flat), 5)
+
+    def test_nothing_new_stops_without_the_flat_fallback(self):
+        # Every settlement is older than the watermark: no rows, not every table row
+        self.assertEqual(tms_parser.parse_settlement_html(self.expanded, since=date(2025, 5, 13)), [])
+        self.assertEqual(tms_parser.parse_settlement_html(self.flat, since=date(2025, 3, 5)), [])
+
+
+class SuccessHtmlTests(SimpleTestCase):
+    """parse_success_html on the saved Success page"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.page = fixture('success_expanded.html')
+
+    def test_rows(self):
+        rows = tms_parser.parse_success_html(self.page)
+        self.assertEqual(len(rows), 285)
+        self.assertEqual(rows[0], {
+            'scrip': 'API',
+            'units': 1000,
+            'buying_price': Decimal('952.40'),
+            'total_amount': Decimal('952400.00'),
+            'transaction_no': '2025496763311233',
+            'status': 'SETTLED',
+            'business_date': date(2025, 3, 3),
+        })
+        self.assertEqual(rows[-1]['business_date'], date(2025, 6, 12))
+
+    def test_since_is_inclusive(self):
+        rows = tms_parser.parse_success_html(self.page)
+        last = rows[-1]['business_date']
+        for since in (date(2025, 3, 3), date(2025, 5, 1), last):
+            with self.subTest(since=since):
+                expected = [row for row in rows if row['business_date'] >= since]
+                self.assertEqual(tms_parser.parse_success_html(self.page, since=since), expected)
+        self.assertEqual(len(tms_parser.parse_success_html(self.page, since=last)), 7)
+
+    def test_nothing_new(self):
+        self.assertEqual(tms_parser.parse_success_html(self.page, since=date(2025, 6, 13)), [])
+
+
+class SettlementJsonTests(SimpleTestCase):
+    """parse_settlement_json on the grid data of the Success section"""
+
+    def test_success_rows(self):
+        rows = tms_parser.parse_settlement_json(fixture('success.json'), tms_parser.SECTION_SUCCESS)
+        self.assertEqual(len(rows), 99)
+        self.assertEqual(rows[0]['scrip'], 'SHIVM')
+        self.assertEqual(rows[0]['units'], 25)
+        self.assertEqual(rows[0]['buying_price'], Decimal('1696.6'))
+        self.assertEqual(rows[0]['transaction_no'], '2025352723593839')
+        self.assertEqual(rows[0]['business_date'], date(2025, 3, 3))
+        self.assertEqual(rows[-1]['business_date'], date(2025, 4, 17))
+
+    def test_payment_due_section(self):
+        payload = {'data': [{'businessDate': '2025-03-04', 'details': [
+            {'transactionNo': '1', 'stockSymbol': 'nabil', 'rate': '1,200.50', 'quantity': 10, 'amount': 12005},
+            {'transactionNo': '2', 'stockSymbol': 'NICA', 'rate': 0, 'quantity': 10},
+        ]}]}
+        rows = tms_parser.parse_settlement_json(payload)
+        self.assertEqual(rows, [{
+            'scrip': 'NABIL',
+            'units': 10,
+            'buying_price': Decimal('1200.50'),
+            'transaction_no': '1',
+            'transaction_date': date(2025, 3, 4),
+            'business_date': date(2025, 3, 4),
+        }])
+
+    def test_parse_page_detects_json(self):
+        self.assertEqual(
+            tms_parser.parse_page(fixture('success.json'), tms_parser.SECTION_SUCCESS),
+            tms_parser.parse_settlement_json(fixture('success.json'), tms_parser.SECTION_SUCCESS),
+        )
+
+
+class FakeButton:
+    def __init__(self, row):
+        self.row = row
+
+    async def click(self):
+        self.row.page.clicked.append(self.row.business_date)
+
+
+class FakeRow:
+    def __init__(self, page, business_date):
+        self.page = page
+        self.business_date = business_date
+
+    async def query_selector(self, selector):
+        self.page.scanned.append(self.business_date)
+        return FakeButton(self)
+
+
+class FakeGridPage:
+    """The master rows of a settlement grid, as expand_rows_since reads them"""
+
+    def __init__(self, dates):
+        self.dates = dates
+        self.rows = [FakeRow(self, day) for day in dates]
+        self.scanned = []
+        self.clicked = []
+
+    async def eval_on_selector_all(self, selector, script):
+        return [day.isoformat() for day in self.dates]
+
+    async def query_selector_all(self, selector):
+        return self.rows
+
+
+@mock.patch('authentication.tms_service.asyncio.sleep', mock.AsyncMock())
+class ExpandRowsSinceTests(SimpleTestCase):
+    """Incremental syncs only expand the settlements on or after the watermark"""
+
+    def expand(self, dates, since):
+        page = FakeGridPage(dates)
+        expanded = asyncio.run(TMSDataFetcher(52).expand_rows_since(page, since))
+        return page, expanded
+
+    def test_newest_first_grid_stops_at_the_first_old_settlement(self):
+        dates = [date(2025, 5, 12), date(2025, 5, 9), date(2025, 5, 8), date(2025, 5, 7)]
+        page, expanded = self.expand(dates, date(2025, 5, 9))
+        self.assertEqual(expanded, 2)
+        self.assertEqual(page.clicked, [date(2025, 5, 12), date(2025, 5, 9)])
+        self.assertEqual(page.scanned, page.clicked)
+
+    def test_oldest_first_grid_skips_old_settlements(self):
+        dates = [date(2025, 5, 7), date(2025, 5, 8), date(2025, 5, 9), date(2025, 5, 12)]
+        page, expanded = self.expand(dates, date(2025, 5, 9))
+        self.assertEqual(page.clicked, [date(2025, 5, 9), date(2025, 5, 12)])
+
+    def test_nothing_new(self):
+        page, expanded = self.expand([date(2025, 5, 12), date(2025, 5, 9)], date(2025, 5, 13))
+        self.assertEqual(expanded, 0)
+        self.assertEqual(page.scanned, [])
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase, override_settings
+
+from authentication.tms_resources import FALLBACK_ESTIMATES, TMSResourceBlocker, get_resource_policy
+
+BASE_URL = 'https://tms52.nepsetms.com.np/login'
+
+
+class FakeRoute:
+    def __init__(self, url, resource_type):
+        self.request = SimpleNamespace(url=url, resource_type=resource_type)
+        self.outcome = None
+
+    async def abort(self, reason):
+        self.outcome = reason
+
+    async def continue_(self):
+        self.outcome = 'continued'
+
+
+class ResourcePolicyTests(SimpleTestCase):
+    """Images load for the captcha at login; on data pages only what the grid needs"""
+
+    def setUp(self):
+        self.blocker = TMSResourceBlocker(BASE_URL)
+
+    def test_login_phase_keeps_images(self):
+        self.assertFalse(self.blocker.should_block('https://tms52.nepsetms.com.np/captcha.png', 'image'))
+        self.assertTrue(self.blocker.should_block('https://tms52.nepsetms.com.np/font.woff2', 'font'))
+
+    def test_data_phase_blocks_images_but_not_stylesheets(self):
+        self.blocker.set_phase('data')
+        self.assertTrue(self.blocker.should_block('https://tms52.nepsetms.com.np/logo.png', 'image'))
+        self.assertFalse(self.blocker.should_block('https://tms52.nepsetms.com.np/kendo.css', 'stylesheet'))
+        self.assertFalse(self.blocker.should_block('data:image/png;base64,AAAA', 'image'))
+
+    def test_third_party_requests_are_blocked(self):
+        self.assertTrue(self.blocker.should_block('https://www.google-analytics.com/analytics.js', 'script'))
+        self.assertFalse(self.blocker.should_block('https://cdn.nepsetms.com.np/app.js', 'script'))
+        # A navigation is never blocked, wherever it goes
+        self.assertFalse(self.blocker.should_block('https://example.com/', 'document'))
+
+    def test_unknown_phase_keeps_the_current_one(self):
+        with self.assertLogs('authentication.tms_resources', 'WARNING'):
+            self.blocker.set_phase('checkout')
+        self.assertEqual(self.blocker.phase, 'login')
+
+    @override_settings(TMS_RESOURCE_POLICY={'data': {'block_types': ['image', 'stylesheet']}})
+    def test_settings_override_merges_over_defaults(self):
+        policy = get_resource_policy()
+        self.assertEqual(policy['data'], {'block_types': ['image', 'stylesheet'], 'block_third_party': True})
+        self.assertEqual(policy['login']['block_types'], ['font', 'media'])
+
+    def test_route_handler_and_summary(self):
+        self.blocker.set_phase('data')
+        routes = [
+            FakeRoute('https://tms52.nepsetms.com.np/logo.png', 'image'),
+            FakeRoute('https://tms52.nepsetms.com.np/logo2.png', 'image'),
+            FakeRoute('https://tms52.nepsetms.com.np/api/settlement', 'xhr'),
+            FakeRoute('https://fonts.example.com/font.woff2', 'font'),
+        ]
+
+        async def handle():
+            for route in routes:
+                await self.blocker._handle_route(route)
+
+        asyncio.run(handle())
+        self.assertEqual([route.outcome for route in routes], ['blockedbyclient', 'blockedbyclient', 'continued', 'blockedbyclient'])
+
+        summary = self.blocker.summary()
+        self.assertEqual(summary['blocked_requests'], 3)
+        self.assertEqual(summary['blocked_by_type'], {'image': 2, 'font': 1})
+        self.assertEqual(
+            summary['estimated_bytes_saved'], 2 * FALLBACK_ESTIMATES['image'][0] + FALLBACK_ESTIMATES['font'][0],
+        )
+
+    def test_observed_sizes_replace_the_fallback_estimate(self):
+        self.blocker.loaded['image'] = 2
+        self.blocker.loaded_bytes['image'] = 5000
+        self.blocker.loaded_ms['image'] = 40.0
+        self.blocker.blocked['image'] = 4
+        summary = self.blocker.summary()
+        self.assertEqual(summary['estimated_bytes_saved'], 10000)
+        self.assertEqual(summary['estimated_time_saved_ms'], 80)
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from authentication.models import Profile_ver, TMSBrokerAccount
+from authentication.tms_scheduler import AutoSyncScheduler, due_accounts
+
+
+class DueAccountTests(TestCase):
+
+    def account(self, username, tms_number, configured=True, **fields):
+        user = User.objects.filter(username=username).first() or User.objects.create_user(username, password='pw')
+        Profile_ver.objects.get_or_create(user=user, defaults={'uid': username, 'tms_configured': configured})
+        return TMSBrokerAccount.objects.create(user=user, tms_server_number=tms_number, **dict({'session_state': '{}'}, **fields))
+
+    def test_least_recently_synced_first(self):
+        now = timezone.now()
+        recent = self.account('recent', 52, last_synced_at=now - timedelta(minutes=10))
+        older = self.account('older', 52, last_synced_at=now - timedelta(hours=3))
+        never = self.account('never', 58)
+        self.account('no-session', 52, session_state='')
+        self.account('inactive', 58, is_active=False)
+        self.account('unconfigured', 52, configured=False)
+
+        self.assertEqual(due_accounts(timedelta(hours=1)), [(never.user_id, 58), (older.user_id, 52)])
+        self.assertEqual(due_accounts(timedelta(minutes=5))[-1], (recent.user_id, 52))
+        self.assertEqual(due_accounts(timedelta(minutes=5), limit=1), [(never.user_id, 58)])
+
+
+class SchedulerTests(SimpleTestCase):
+    """Each server gets its own bounded queue; its logins start `spacing` apart"""
+
+    async def run_syncs(self, scheduler, accounts, duration=0.05):
+        loop = asyncio.get_running_loop()
+        started = []
+        running = []
+        peak = []
+
+        async def sync_account(user_id, tms_number):
+            started.append((tms_number, loop.time()))
+            running.append(user_id)
+            peak.append(len(running))
+            await asyncio.sleep(duration)
+            running.remove(user_id)
+
+        scheduler.sync_account = sync_account
+        scheduler.slots = asyncio.Semaphore(scheduler.concurrency)
+        scheduler.enqueue(accounts)
+        await asyncio.gather(*(queue.join() for queue in scheduler.queues.values()))
+        for worker in scheduler.workers:
+            worker.cancel()
+        await asyncio.gather(*scheduler.workers, return_exceptions=True)
+        return started, max(peak)
+
+    async def test_starts_on_one_server_are_spaced(self):
+        scheduler = AutoSyncScheduler(concurrency=4, per_server=2, spacing=0.1)
+        started, _ = await self.run_syncs(scheduler, [(1, 52), (2, 52), (3, 52), (4, 58)])
+
+        by_server = {}
+        for tms_number, at in started:
+            by_server.setdefault(tms_number, []).append(at)
+        gaps = [b - a for a, b in zip(by_server[52], by_server[52][1:])]
+        self.assertEqual(len(gaps), 2)
+        self.assertTrue(all(gap >= 0.09 for gap in gaps), gaps)
+        # Another host is not held up by the first one's spacing
+        self.assertLess(by_server[58][0] - by_server[52][0], 0.05)
+
+    async def test_concurrency_is_bounded_across_servers(self):
+        scheduler = AutoSyncScheduler(concurrency=2, per_server=2, spacing=0)
+        started, peak = await self.run_syncs(scheduler, [(1, 52), (2, 52), (3, 58), (4, 58), (5, 61)])
+        self.assertEqual(len(started), 5)
+        self.assertEqual(peak, 2)
+        self.assertEqual(scheduler.pending, set())
+
+    async def test_full_queue_defers_and_known_accounts_are_skipped(self):
+        scheduler = AutoSyncScheduler(per_server=1, queue_size=2)
+        scheduler.slots = asyncio.Semaphore(0)
+        self.assertEqual(scheduler.enqueue([(1, 52), (2, 52), (3, 52), (4, 58)]), (3, 1))
+        self.assertEqual(scheduler.enqueue([(1, 52), (4, 58)]), (0, 0))
+        self.assertEqual(scheduler.stats['deferred'], 1)
+
+        scheduler.attempted[(3, 52)] = 0.0
+        self.assertEqual(scheduler.enqueue([(3, 52)], once=True), (0, 0))
+        for worker in scheduler.workers:
+            worker.cancel()
+        await asyncio.gather(*scheduler.workers, return_exceptions=True)
@@ -0,0 +1,158 @@
+import asyncio
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from authentication import tms_parser, tms_service
+from authentication.models import Profile_ver, Share_Buy, TMSBrokerAccount
+from authentication.tms_service import afetch_tms_data_multi, mark_accounts_synced, sync_watermarks
+
+FLAT_PAGE_WITHOUT_DATE = (
+    '<table><tr><th>S.N</th><th>TRANSACTION NO</th><th>STOCK SYMBOL</th><th>RATE (NPR)</th>'
+    '<th>QUANTITY</th><th>AMOUNT (NPR)</th></tr>'
+    '<tr><td>1</td><td>2025599873802643</td><td>CHCL</td><td>1,512.10</td><td>20</td><td>30,242.00</td></tr></table>'
+)
+
+
+def settlement_row(business_date, settlement_type, **extra):
+    return dict({'scrip': 'NABIL', 'units': 10, 'business_date': business_date, 'settlement_type': settlement_type}, **extra)
+
+
+class SyncWatermarkTests(TestCase):
+    """Incremental syncs keep one watermark per (server, settlement section)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+        Profile_ver.objects.create(user=self.user, uid='x', tms_server_number=52, tms_configured=True)
+        TMSBrokerAccount.objects.create(user=self.user, tms_server_number=52)
+
+    def test_sections_advance_independently(self):
+        mark_accounts_synced(self.user, [52], [settlement_row(date(2025, 3, 4), 'PaymentDue')])
+        self.assertEqual(sync_watermarks(self.user, [52]), {52: {'PaymentDue': date(2025, 3, 4)}})
+
+        # A later Success sync still reads the whole settled history
+        self.assertEqual(sync_watermarks(self.user, [52], ['Success']), {52: {}})
+        mark_accounts_synced(self.user, [52], [
+            settlement_row(date(2025, 2, 1), 'Success'),
+            settlement_row(date(2025, 2, 10), 'Success'),
+        ])
+        self.assertEqual(
+            sync_watermarks(self.user, [52]),
+            {52: {'PaymentDue': date(2025, 3, 4), 'Success': date(2025, 2, 10)}},
+        )
+
+    def test_watermark_never_moves_back(self):
+        mark_accounts_synced(self.user, [52], [settlement_row(date(2025, 3, 4), 'PaymentDue')])
+        mark_accounts_synced(self.user, [52], [settlement_row(date(2025, 1, 1), 'PaymentDue')])
+        self.assertEqual(sync_watermarks(self.user, [52])[52]['PaymentDue'], date(2025, 3, 4))
+
+    def test_no_rows_or_fallback_dates_keep_full_sync(self):
+        Profile_ver.objects.filter(user=self.user).update(last_tms_sync=timezone.now() - timedelta(days=1))
+        rows = [{'scrip': 'NABIL', 'units': 10, 'transaction_date': date.today(), 'settlement_type': 'PaymentDue'}]
+        mark_accounts_synced(self.user, [52], rows)
+        mark_accounts_synced(self.user, [52], [])
+
+        self.assertEqual(sync_watermarks(self.user, [52]), {52: {}})
+        account = TMSBrokerAccount.objects.get(user=self.user)
+        self.assertIsNotNone(account.last_synced_at)
+
+    def test_flat_page_without_date_uses_fallback_only_for_transaction_date(self):
+        rows = tms_parser.parse_settlement_html(FLAT_PAGE_WITHOUT_DATE, fallback_date=date(2030, 1, 1))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['transaction_date'], date(2030, 1, 1))
+        self.assertNotIn('business_date', rows[0])
+
+    def test_profile_only_user_gets_an_account_for_the_watermark(self):
+        other = User.objects.create_user('profile-only', password='pw')
+        Profile_ver.objects.create(user=other, uid='y', tms_server_number=58, tms_configured=True)
+        mark_accounts_synced(other, [58], [settlement_row(date(2025, 3, 4), 'PaymentDue')])
+        self.assertEqual(sync_watermarks(other, [58]), {58: {'PaymentDue': date(2025, 3, 4)}})
+
+    def test_multi_server_rows_carry_their_server(self):
+        TMSBrokerAccount.objects.create(user=self.user, tms_server_number=58)
+        mark_accounts_synced(self.user, [52, 58], [
+            settlement_row(date(2025, 3, 4), 'PaymentDue', tms_number=52),
+            settlement_row(date(2025, 3, 1), 'Success', tms_number=58),
+        ])
+        self.assertEqual(
+            sync_watermarks(self.user, [52, 58]),
+            {52: {'PaymentDue': date(2025, 3, 4)}, 58: {'Success': date(2025, 3, 1)}},
+        )
+
+
+class FakePlaywright:
+    """async_playwright() whose browser only counts launches and closes"""
+
+    def __init__(self):
+        self.browser = SimpleNamespace(close=mock.AsyncMock())
+        self.chromium = SimpleNamespace(launch=mock.AsyncMock(return_value=self.browser))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class MultiServerSyncTests(TestCase):
+    """Every broker account is scraped at once in one browser, then imported together"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('trader', password='pw')
+        Profile_ver.objects.create(user=self.user, uid='x', tms_server_number=52, tms_configured=True)
+        for tms_number in (52, 58, 61):
+            TMSBrokerAccount.objects.create(user=self.user, tms_server_number=tms_number)
+        self.playwright = FakePlaywright()
+
+    async def scrape_server(self, fetcher, browser, settlement_types):
+        self.started.append(fetcher.tms_number)
+        # Every server is under way before any of them finishes
+        async with asyncio.timeout(5):
+            while len(self.started) < len(self.servers):
+                await asyncio.sleep(0.01)
+        if fetcher.tms_number == 61:
+            return {'success': False, 'tms_number': 61, 'rows': [], 'error': 'Login timed out'}
+        rows = [settlement_row(
+            date(2025, 3, 4), 'PaymentDue', tms_number=fetcher.tms_number, transaction_no=f'{fetcher.tms_number}01',
+            buying_price=Decimal('500'), transaction_date=date(2025, 3, 4),
+        )]
+        return {'success': True, 'tms_number': fetcher.tms_number, 'rows': rows}
+
+    async def sync(self, servers, **kwargs):
+        self.servers = servers
+        self.started = []
+        scrape_server = lambda fetcher, browser, settlement_types: self.scrape_server(fetcher, browser, settlement_types)
+        with mock.patch.object(tms_service, 'PLAYWRIGHT_AVAILABLE', True), \
+                mock.patch.object(tms_service, 'async_playwright', lambda: self.playwright, create=True), \
+                mock.patch.object(tms_service.TMSDataFetcher, 'scrape_server', scrape_server), \
+                self.assertLogs('authentication', 'INFO'):
+            return await afetch_tms_data_multi(self.user, **kwargs)
+
+    async def test_one_failing_server_does_not_abort_the_others(self):
+        result = await self.sync([52, 58, 61])
+        self.assertEqual(sorted(self.started), [52, 58, 61])
+        self.playwright.chromium.launch.assert_awaited_once()
+        self.playwright.browser.close.assert_awaited_once()
+
+        self.assertTrue(result['success'])
+        self.assertEqual((result['records_found'], result['records_saved']), (2, 2))
+        self.assertEqual(result['error'], 'TMS61: Login timed out')
+        self.assertEqual({n: server['records_saved'] for n, server in result['servers'].items()}, {52: 1, 58: 1, 61: 0})
+        keys = [key async for key in Share_Buy.objects.values_list('tms_import_key', flat=True).order_by('tms_import_key')]
+        self.assertEqual(keys, ['tms52:5201', 'tms58:5801'])
+
+        # Only the servers that synced move their watermark
+        watermarks = await sync_to_async(sync_watermarks)(self.user, [52, 58, 61])
+        self.assertEqual(watermarks, {52: {'PaymentDue': date(2025, 3, 4)}, 58: {'PaymentDue': date(2025, 3, 4)}, 61: {}})
+
+    async def test_rerun_imports_nothing_twice(self):
+        await self.sync([52, 58], tms_numbers=[52, 58])
+        result = await self.sync([52, 58], tms_numbers=['58', 52, 58])
+        self.assertEqual(sorted(result['servers']), [52, 58])
+        self.assertEqual((result['records_found'], result['records_saved']), (2, 0))
@@ -0,0 +1,13 @@
+import sys
+import types
+from unittest import mock
+
+
+def fake_market(stocks=()):
+    """
+    Patch the NEPSE price feed with fixed prices, so views that fetch it run
+    without network access (and without importing requests)
+    """
+    module = types.ModuleType('authentication.nepse_api_utils')
+    module.fetch_nepse_stocks_and_ltp = mock.Mock(return_value=list(stocks))
+    return mock.patch.dict(sys.modules, {'authentication.nepse_api_utils': module})
@@ -0,0 +1,121 @@
+"""
+Instrumentation for TMS syncs
+
+Events are logged with lazy %-style arguments and the fields are also passed
+as `extra={'tms': {...}}`, so nothing is formatted unless a handler emits the
+record and a structured formatter can pick the fields up. Per-row detail is
+only logged when DEBUG is enabled for the logger.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Phases of a sync, in the order they run
+PHASES = ('launch', 'login', 'navigate', 'expand', 'extract', 'save')
+
+
+class SyncInstrumentation:
+    """Per-sync phase timers, counters and the closing summary record"""
+
+    def __init__(self, tms_number: Optional[int] = None, settlement_type: str = '', user_id: Optional[int] = None):
+        self.tms_number = tms_number
+        self.settlement_type = settlement_type
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.started_at = timezone.now()
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    @property
+    def debug(self) -> bool:
+        """Guard for per-row logging in hot loops"""
+        return logger.isEnabledFor(logging.DEBUG)
+
+    def _fields(self, **fields) -> Dict:
+        return {'tms_number': self.tms_number, 'settlement_type': self.settlement_type, 'user_id': self.user_id, **fields}
+
+    def event(self, name: str, level: int = logging.INFO, **fields):
+        """Log a named event; formatting only happens if the record is emitted"""
+        if logger.isEnabledFor(level):
+            logger.log(level, "tms.%s tms=%s %s", name, self.tms_number, fields, extra={'tms': self._fields(event=name, **fields)})
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a phase; repeated phases (e.g. one navigate per section) accumulate"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            self.event('phase', logging.DEBUG, phase=name, seconds=round(elapsed, 3))
+
+    def merge(self, other: 'SyncInstrumentation'):
+        """Add another sync's phases and counters (multi-server totals)"""
+        for name, seconds in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+
+    def summary(self, success: bool, records_found: int = 0, records_saved: int = 0, error: str = '') -> Dict:
+        """Build and log the one summary record of this sync"""
+        summary = {
+            'tms_number': self.tms_number,
+            'settlement_type': self.settlement_type,
+            'user_id': self.user_id,
+            'success': success,
+            'records_found': records_found,
+            'records_saved': records_saved,
+            'error': error,
+            'started_at': self.started_at,
+            'finished_at': timezone.now(),
+            'duration': round(time.perf_counter() - self.started, 3),
+            'timings': {name: round(self.timings[name], 3) for name in PHASES if name in self.timings},
+            'counters': dict(self.counters),
+        }
+        logger.log(
+            logging.INFO if success else logging.WARNING,
+            "tms.summary tms=%s type=%s success=%s found=%s saved=%s duration=%.1fs phases=%s",
+            self.tms_number, self.settlement_type, success, records_found, records_saved,
+            summary['duration'], summary['timings'],
+            extra={'tms': dict(summary, event='summary')},
+        )
+        return summary
+
+
+def record_sync_run(summary: Dict):
+    """Store a per-server sync summary as a TMSSyncRun; a failure here never fails the sync"""
+    from .models import TMSSyncRun
+
+    if summary.get('user_id') is None or summary.get('tms_number') is None:
+        return None
+    phases = {
+        field: summary['timings'][phase]
+        for phase, field in TMSSyncRun.PHASE_FIELDS.items()
+        if phase in summary['timings']
+    }
+    try:
+        return TMSSyncRun.objects.create(
+            user_id=summary['user_id'],
+            tms_server_number=summary['tms_number'],
+            settlement_type=summary['settlement_type'][:40],
+            started_at=summary['started_at'],
+            finished_at=summary['finished_at'],
+            success=summary['success'],
+            records_found=summary['records_found'],
+            records_saved=summary['records_saved'],
+            error=summary['error'] or '',
+            duration_seconds=summary['duration'],
+            **phases,
+        )
+    except Exception as e:
+        logger.warning("Could not record TMS sync run: %s", e)
+        return None
@@ -0,0 +1,307 @@
+"""
+DB-backed job queue for TMS syncs
+
+Views enqueue a TMSSyncJob and return immediately; the run_tms_worker
+management command claims queued jobs and drives the Playwright session,
+so web workers are never pinned by a browser waiting on a manual login.
+"""
+import asyncio
+import base64
+import logging
+import os
+import socket
+from datetime import timedelta
+from typing import Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .models import TMSSyncJob
+
+logger = logging.getLogger(__name__)
+
+# Seconds a headless sync waits for the user to answer a captcha
+LOGIN_ANSWER_TIMEOUT = 300
+# Seconds between heartbeats of a running job; requeue_stale_jobs only resets
+# jobs whose heartbeat is much older than this
+HEARTBEAT_INTERVAL = 30
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_tms_sync(user: User, tms_number: int, settlement_type: str = "PaymentDue", all_accounts: bool = False, full_sync: bool = False) -> TMSSyncJob:
+    """
+    Queue a sync for the user, reusing their queued/running job for the same
+    server and settlement type so double submits don't open two browsers.
+    all_accounts=True syncs every active broker account (both sections) in one job.
+    full_sync=True ignores the incremental watermark.
+    """
+    with transaction.atomic():
+        existing = TMSSyncJob.objects.filter(
+            user=user,
+            tms_server_number=tms_number,
+            settlement_type=settlement_type,
+            all_accounts=all_accounts,
+            status__in=TMSSyncJob.ACTIVE_STATUSES,
+        ).first()
+        if existing:
+            if full_sync and not existing.full_sync and existing.status == TMSSyncJob.STATUS_QUEUED:
+                existing.full_sync = True
+                existing.save(update_fields=['full_sync'])
+            return existing
+        job = TMSSyncJob.objects.create(
+            user=user,
+            tms_server_number=tms_number,
+            settlement_type=settlement_type,
+            all_accounts=all_accounts,
+            full_sync=full_sync,
+            progress='Waiting for a worker',
+        )
+    logger.info("Queued TMS sync job %s for user %s (TMS%s, %s)", job.id, user.id, tms_number, settlement_type)
+    return job
+
+
+def claim_next_job(name: Optional[str] = None) -> Optional[TMSSyncJob]:
+    """
+    Atomically move the oldest queued job to running. The conditional update
+    makes concurrent workers safe without SELECT ... FOR UPDATE (SQLite)
+    """
+    name = name or worker_name()
+    while True:
+        job = TMSSyncJob.objects.filter(status=TMSSyncJob.STATUS_QUEUED).order_by('created_at').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = TMSSyncJob.objects.filter(pk=job.pk, status=TMSSyncJob.STATUS_QUEUED).update(
+            status=TMSSyncJob.STATUS_RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+            worker=name,
+            progress='Starting browser',
+        )
+        if claimed:
+            return TMSSyncJob.objects.select_related('user').get(pk=job.pk)
+        # Another worker took it first, try the next one
+
+
+def _owned(job: TMSSyncJob):
+    """The job row while it is still running under this claim (worker and start time)"""
+    return TMSSyncJob.objects.filter(
+        pk=job.pk,
+        worker=job.worker,
+        started_at=job.started_at,
+        status__in=(TMSSyncJob.STATUS_RUNNING, TMSSyncJob.STATUS_AWAITING_LOGIN),
+    )
+
+
+def update_job_progress(job_id: int, message: str):
+    TMSSyncJob.objects.filter(pk=job_id).update(progress=message[:200], heartbeat_at=timezone.now())
+
+
+def touch_job(job: TMSSyncJob) -> bool:
+    """Refresh the heartbeat of a claimed job; False once it was requeued and claimed again or finished"""
+    return bool(_owned(job).update(heartbeat_at=timezone.now()))
+
+
+def finish_job(job: TMSSyncJob, result: dict) -> bool:
+    """Record the outcome, unless the job was requeued meanwhile and now belongs to another run"""
+    job.status = TMSSyncJob.STATUS_SUCCEEDED if result.get('success') else TMSSyncJob.STATUS_FAILED
+    job.records_found = result.get('records_found', 0)
+    job.records_saved = result.get('records_saved', 0)
+    job.error = result.get('error', '') or ''
+    job.progress = 'Completed' if result.get('success') else 'Failed'
+    job.finished_at = timezone.now()
+    job.captcha_image = ''
+    updated = _owned(job).update(
+        status=job.status,
+        records_found=job.records_found,
+        records_saved=job.records_saved,
+        error=job.error,
+        progress=job.progress,
+        finished_at=job.finished_at,
+        captcha_image='',
+    )
+    if not updated:
+        logger.warning("TMS sync job %s was taken over by another worker; dropping the result of %s", job.id, job.worker)
+        return False
+    _discard_login_answer(job.id)
+    return True
+
+
+def requeue_stale_jobs(older_than: timedelta) -> int:
+    """Give jobs back to the queue if their worker stopped sending heartbeats (died mid-sync)"""
+    cutoff = timezone.now() - older_than
+    stale = TMSSyncJob.objects.filter(
+        status__in=(TMSSyncJob.STATUS_RUNNING, TMSSyncJob.STATUS_AWAITING_LOGIN),
+        heartbeat_at__lt=cutoff,
+    )
+    requeued = 0
+    for job_id in stale.values_list('pk', flat=True):
+        # Re-checked per row, so a heartbeat that lands meanwhile keeps the job with its worker
+        if stale.filter(pk=job_id).update(
+            status=TMSSyncJob.STATUS_QUEUED,
+            worker='',
+            progress='Requeued after worker timeout',
+            captcha_image='',
+        ):
+            _discard_login_answer(job_id)
+            requeued += 1
+    return requeued
+
+
+def _login_cache():
+    return caches['tms_login']
+
+
+def _login_answer_key(job_id: int) -> str:
+    return f'answer:{job_id}'
+
+
+def _discard_login_answer(job_id: int):
+    _login_cache().delete(_login_answer_key(job_id))
+
+
+def publish_captcha(job_id: int, tms_number: int, image: bytes, error: str = ''):
+    """Show a captcha on the fetch page and wait for the user's answer"""
+    if error:
+        progress = f'TMS{tms_number}: {error}. Please try the new captcha'
+    else:
+        progress = f'Log in to TMS{tms_number}: enter your credentials and the captcha below'
+    # An answer typed for the previous captcha can't be used any more
+    _discard_login_answer(job_id)
+    TMSSyncJob.objects.filter(pk=job_id).update(
+        status=TMSSyncJob.STATUS_AWAITING_LOGIN,
+        captcha_image=base64.b64encode(image).decode('ascii'),
+        progress=progress[:200],
+        heartbeat_at=timezone.now(),
+    )
+
+
+def submit_login_answer(job: TMSSyncJob, username: str, password: str, captcha: str) -> bool:
+    """
+    Hand the user's answer to the worker through the tms_login cache, so the
+    credentials are never written to the database. Only accepted while the job
+    waits for one; unread answers expire after TMS_LOGIN_ANSWER_TTL seconds
+    """
+    if not TMSSyncJob.objects.filter(pk=job.pk, status=TMSSyncJob.STATUS_AWAITING_LOGIN).exists():
+        return False
+    answer = {'username': username, 'password': password, 'captcha': captcha}
+    _login_cache().set(_login_answer_key(job.pk), answer, getattr(settings, 'TMS_LOGIN_ANSWER_TTL', 60))
+    return True
+
+
+def take_login_answer(job_id: int) -> Optional[Dict]:
+    """Read and delete the answer in one step so credentials never outlive the login attempt"""
+    key = _login_answer_key(job_id)
+    answer = _login_cache().get(key)
+    if not answer:
+        return None
+    _login_cache().delete(key)
+    TMSSyncJob.objects.filter(pk=job_id, status=TMSSyncJob.STATUS_AWAITING_LOGIN).update(
+        status=TMSSyncJob.STATUS_RUNNING,
+        captcha_image='',
+        progress='Logging in to TMS',
+        heartbeat_at=timezone.now(),
+    )
+    return answer
+
+
+def withdraw_captcha(job_id: int):
+    _discard_login_answer(job_id)
+    TMSSyncJob.objects.filter(pk=job_id).update(
+        status=TMSSyncJob.STATUS_RUNNING, captcha_image='', heartbeat_at=timezone.now()
+    )
+
+
+class JobLoginHandler:
+    """
+    login_handler for a headless TMSDataFetcher: publishes the captcha on the
+    job row and polls the tms_login cache for the answer submitted from the
+    fetch page. Servers of a
+    multi-account job take turns so only one captcha is shown at a time.
+    """
+
+    def __init__(self, job_id: int, timeout: float = LOGIN_ANSWER_TIMEOUT, poll_interval: float = 2):
+        self.job_id = job_id
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._turn = asyncio.Lock()
+
+    async def __call__(self, tms_number: int, capture, error: str = '') -> Optional[Dict]:
+        async with self._turn:
+            # Screenshot only once it is this server's turn, so the captcha is fresh
+            image = await capture()
+            await sync_to_async(publish_captcha)(self.job_id, tms_number, image, error)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            while loop.time() < deadline:
+                answer = await sync_to_async(take_login_answer)(self.job_id)
+                if answer:
+                    return answer
+                await asyncio.sleep(self.poll_interval)
+            await sync_to_async(withdraw_captcha)(self.job_id)
+            return None
+
+
+async def _keep_alive(job: TMSSyncJob, sync: asyncio.Future, interval: float = HEARTBEAT_INTERVAL):
+    """Send heartbeats while the sync runs; cancel it if the job was requeued under it"""
+    while True:
+        await asyncio.sleep(interval)
+        if not await sync_to_async(touch_job)(job):
+            logger.warning("TMS sync job %s is no longer owned by %s; stopping it", job.id, job.worker)
+            sync.cancel()
+            return
+
+
+async def arun_job(job: TMSSyncJob) -> dict:
+    """Run a claimed job on the current event loop and record the outcome"""
+    from .tms_service import afetch_tms_data, afetch_tms_data_multi
+
+    logger.info("Running TMS sync job %s for user %s", job.id, job.user_id)
+    progress_callback = lambda message: update_job_progress(job.id, message)
+    login_handler = JobLoginHandler(job.id) if getattr(settings, 'TMS_HEADLESS', False) else None
+    if job.all_accounts:
+        fetch = afetch_tms_data_multi(
+            user=job.user,
+            progress_callback=progress_callback,
+            full_sync=job.full_sync,
+            login_handler=login_handler,
+        )
+    else:
+        fetch = afetch_tms_data(
+            user=job.user,
+            tms_number=job.tms_server_number,
+            settlement_type=job.settlement_type,
+            progress_callback=progress_callback,
+            full_sync=job.full_sync,
+            login_handler=login_handler,
+        )
+    sync = asyncio.ensure_future(fetch)
+    keep_alive = asyncio.ensure_future(_keep_alive(job, sync))
+    try:
+        result = await sync
+    except asyncio.CancelledError:
+        if not keep_alive.done():
+            # The worker itself is shutting down
+            raise
+        result = {'success': False, 'error': 'Requeued while running', 'records_found': 0, 'records_saved': 0}
+    except Exception as e:
+        logger.error("TMS sync job %s crashed: %s", job.id, e)
+        result = {'success': False, 'error': str(e), 'records_found': 0, 'records_saved': 0}
+    finally:
+        keep_alive.cancel()
+    await sync_to_async(finish_job)(job, result)
+    return result
+
+
+def run_job(job: TMSSyncJob) -> dict:
+    """Blocking version of arun_job, executed on the shared TMS loop thread"""
+    from .tms_service import run_in_tms_loop
+
+    return run_in_tms_loop(arun_job(job))
@@ -0,0 +1,519 @@
+"""
+Offline parser for TMS settlement pages
+
+Works on the raw HTML of a settlement page (page.content() after the detail
+rows were expanded) or on the JSON the TMS grid is bound to, so parsing can be
+tested and benchmarked without a browser. See the benchmark_tms_parser
+management command and the fixtures in authentication/tms_fixtures/.
+"""
+import json
+import logging
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from html import unescape
+from itertools import islice
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+DATE_RE = re.compile(r'(\d{4}-\d{2}-\d{2})')
+BUSINESS_DATE_RE = re.compile(r'business date[:\s]*(\d{4}-\d{2}-\d{2})', re.IGNORECASE)
+SEPARATORS_RE = re.compile(r'[,\s]')
+DECIMAL_RE = re.compile(r'^\d+(\.\d+)?$')
+NON_DECIMAL_RE = re.compile(r'[^\d.]')
+NON_DIGIT_RE = re.compile(r'[^\d]')
+NUMBER_RE = re.compile(r'[\d,]+\.?\d*')
+SCRIP_RE = re.compile(r'\b[A-Z]{3,8}\b')
+
+# Tokeniser for the page: comments, script/style blocks (skipped whole) and tags
+TAG_RE = re.compile(
+    r'<!--.*?-->'
+    r'|<(script|style)\b[^>]*>.*?</\1\s*>'
+    r'|<(?P<end>/?)(?P<name>[a-zA-Z][a-zA-Z0-9-]*)(?P<attrs>(?:"[^"]*"|\'[^\']*\'|[^\'">])*)>',
+    re.DOTALL | re.IGNORECASE,
+)
+CLASS_ATTR_RE = re.compile(r'\bclass\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+COLINDEX_ATTR_RE = re.compile(r'\baria-colindex\s*=\s*["\']?(\d+)', re.IGNORECASE)
+TABLE_TAGS = frozenset(('table', 'thead', 'tbody', 'tr', 'td', 'th'))
+
+# Column positions of the transaction detail grid:
+# S.N, TRANSACTION NO, STOCK SYMBOL, RATE (NPR), QUANTITY, AMOUNT (NPR), ...
+COL_TRANSACTION_NO = 1
+COL_SYMBOL = 2
+COL_RATE = 3
+COL_QUANTITY = 4
+COL_AMOUNT = 5
+MIN_COLUMNS = 6
+
+# Business date column of the master (per settlement) rows
+MASTER_DATE_COLINDEX = '3'
+
+# Master rows checked for the page business date, as the old live parser did
+BUSINESS_DATE_SCAN_ROWS = 15
+
+SECTION_PAYMENT_DUE = 'PaymentDue'
+SECTION_SUCCESS = 'Success'
+
+# JSON keys accepted for each detail column, first match wins
+JSON_DETAIL_KEYS = {
+    COL_TRANSACTION_NO: ('transactionNo', 'transaction_no', 'contractNo'),
+    COL_SYMBOL: ('stockSymbol', 'symbol', 'scrip'),
+    COL_RATE: ('rate', 'price'),
+    COL_QUANTITY: ('quantity', 'qty', 'units'),
+    COL_AMOUNT: ('amount', 'totalAmount'),
+}
+JSON_DETAILS_KEYS = ('details', 'transactions', 'items')
+JSON_DATE_KEYS = ('businessDate', 'business_date', 'settlementDate')
+
+
+def parse_date(text: str) -> Optional[date]:
+    match = DATE_RE.search(text)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Row parsers (one list of cell texts in, one dict or None out)
+# ---------------------------------------------------------------------------
+
+def parse_settlement_row(cell_texts: List[str], transaction_date: Optional[date] = None) -> Optional[Dict]:
+    """
+    Parse a Payment Due transaction detail row
+    Expected columns: S.N, TRANSACTION NO, STOCK SYMBOL, RATE (NPR), QUANTITY, AMOUNT (NPR), etc.
+    """
+    if len(cell_texts) < MIN_COLUMNS:
+        return None
+
+    symbol_text = cell_texts[COL_SYMBOL].strip()
+    if len(symbol_text) < 2 or not symbol_text.replace('.', '').isalpha():
+        return None
+
+    rate_clean = SEPARATORS_RE.sub('', cell_texts[COL_RATE])
+    if not DECIMAL_RE.match(rate_clean):
+        return None
+    quantity_clean = SEPARATORS_RE.sub('', cell_texts[COL_QUANTITY])
+    if not quantity_clean.isdigit():
+        return None
+
+    rate = Decimal(rate_clean)
+    units = int(quantity_clean)
+    if units <= 0 or rate <= 0:
+        return None
+
+    return {
+        'scrip': symbol_text.upper(),
+        'units': units,
+        'buying_price': rate,
+        'transaction_no': cell_texts[COL_TRANSACTION_NO].strip() or None,
+        'transaction_date': transaction_date or datetime.now().date(),
+    }
+
+
+def parse_settlement_row_fallback(cell_texts: List[str], transaction_date: Optional[date] = None) -> Optional[Dict]:
+    """
+    Pattern based parsing for rows that don't follow the detail grid layout
+    """
+    scrip_name = None
+    buying_price = None
+    units = None
+    total_amount = None
+
+    for cell_text in cell_texts:
+        cell_text = cell_text.strip()
+
+        if not scrip_name:
+            for match in SCRIP_RE.findall(cell_text):
+                if match.isalpha():
+                    scrip_name = match
+                    break
+
+        if not NUMBER_RE.search(cell_text):
+            continue
+        try:
+            number = float(SEPARATORS_RE.sub('', cell_text))
+        except ValueError:
+            continue
+
+        # Heuristic based on typical ranges: rate 10-10000,
+        # quantity 1-10000, amount > 1000
+        if 10 <= number <= 10000 and not buying_price:
+            buying_price = Decimal(str(number))
+        elif 1 <= number <= 10000 and not units:
+            units = int(number)
+        elif number > 1000 and not total_amount:
+            total_amount = Decimal(str(number))
+
+    if not (scrip_name and buying_price and units and units > 0):
+        return None
+    return {
+        'scrip': scrip_name,
+        'units': units,
+        'buying_price': buying_price,
+        'total_amount': total_amount or buying_price * units,
+        'transaction_date': transaction_date or datetime.now().date(),
+    }
+
+
+def parse_transaction_row(cell_texts: List[str]) -> Optional[Dict]:
+    """
+    Parse a transaction detail row of the Success (settled) section
+    """
+    if len(cell_texts) < MIN_COLUMNS:
+        return None
+
+    scrip = cell_texts[COL_SYMBOL].strip().upper()
+    if not (2 <= len(scrip) <= 8 and scrip.isalpha()):
+        return None
+
+    try:
+        rate_text = NON_DECIMAL_RE.sub('', cell_texts[COL_RATE])
+        rate = Decimal(rate_text) if rate_text else None
+        units_text = NON_DIGIT_RE.sub('', cell_texts[COL_QUANTITY])
+        units = int(units_text) if units_text else None
+        amount_text = NON_DECIMAL_RE.sub('', cell_texts[COL_AMOUNT])
+        amount = Decimal(amount_text) if amount_text else None
+    except InvalidOperation:
+        return None
+
+    if not (rate and units):
+        return None
+
+    return {
+        'scrip': scrip,
+        'units': units,
+        'buying_price': rate,
+        'total_amount': amount or rate * units,
+        'transaction_no': cell_texts[COL_TRANSACTION_NO].strip() or None,
+        'status': 'SETTLED',
+    }
+
+
+# ---------------------------------------------------------------------------
+# HTML
+# ---------------------------------------------------------------------------
+
+class _Table:
+    __slots__ = ('classes', 'master_index', 'headers', 'rows', 'row', 'cell', 'cell_is_header', 'cell_colindex', 'in_head')
+
+    def __init__(self, classes, master_index):
+        self.classes = classes
+        # Index of the master row whose detail row contains this table
+        self.master_index = master_index
+        self.headers = []
+        self.rows = []
+        self.row = None
+        self.cell = None
+        self.cell_is_header = False
+        self.cell_colindex = None
+        self.in_head = False
+
+
+class _Row:
+    __slots__ = ('classes', 'cells', 'date_cell', 'master_index')
+
+    def __init__(self, classes):
+        self.classes = classes
+        self.cells = []
+        self.date_cell = None
+        self.master_index = None
+
+
+class _TableCollector:
+    """
+    Single pass over the page collecting every table row as a list of stripped
+    cell texts. Only table markup is tokenised (TAG_RE); scripts, styles and
+    comments are skipped whole. Text is attributed to the innermost open cell
+    only, so master rows are not polluted by the nested detail grids they
+    expand into.
+    """
+
+    def __init__(self):
+        self.tables: List[_Table] = []
+        self.master_rows: List[_Row] = []
+        self._stack: List[_Table] = []
+
+    def feed(self, html: str):
+        position = 0
+        for match in TAG_RE.finditer(html):
+            if self._stack and self._stack[-1].cell is not None and match.start() > position:
+                self._stack[-1].cell.append(html[position:match.start()])
+            position = match.end()
+            name = match.group('name')
+            if not name:
+                continue
+            name = name.lower()
+            if name not in TABLE_TAGS:
+                continue
+            if match.group('end'):
+                self.handle_endtag(name)
+            else:
+                self.handle_starttag(name, match.group('attrs'))
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            master_index = None
+            if self._stack:
+                outer_row = self._stack[-1].row
+                if outer_row is not None and 'k-detail-row' in outer_row.classes:
+                    master_index = outer_row.master_index
+                elif self._stack[-1].master_index is not None:
+                    master_index = self._stack[-1].master_index
+            table = _Table(_classes(attrs), master_index)
+            self.tables.append(table)
+            self._stack.append(table)
+            return
+        if not self._stack:
+            return
+        table = self._stack[-1]
+        if tag == 'tr':
+            row = _Row(_classes(attrs))
+            if 'k-master-row' in row.classes:
+                row.master_index = len(self.master_rows)
+                self.master_rows.append(row)
+            elif 'k-detail-row' in row.classes and self.master_rows:
+                row.master_index = len(self.master_rows) - 1
+            table.row = row
+        elif tag in ('td', 'th'):
+            table.cell = []
+            table.cell_is_header = tag == 'th' or table.in_head
+            colindex = COLINDEX_ATTR_RE.search(attrs) if attrs else None
+            table.cell_colindex = colindex.group(1) if colindex else None
+        elif tag == 'thead':
+            table.in_head = True
+        elif tag == 'tbody':
+            table.in_head = False
+
+    def handle_endtag(self, tag):
+        if not self._stack:
+            return
+        table = self._stack[-1]
+        if tag == 'table':
+            self._stack.pop()
+        elif tag in ('td', 'th'):
+            if table.cell is None:
+                return
+            text = ''.join(table.cell)
+            if '&' in text:
+                text = unescape(text)
+            text = text.strip()
+            table.cell = None
+            if table.cell_is_header:
+                table.headers.append(text)
+            elif table.row is not None:
+                table.row.cells.append(text)
+                if table.cell_colindex == MASTER_DATE_COLINDEX:
+                    table.row.date_cell = text
+        elif tag == 'tr':
+            if table.row is not None and table.row.cells:
+                table.rows.append(table.row)
+            table.row = None
+        elif tag == 'thead':
+            table.in_head = False
+
+
+def _classes(attrs: str) -> frozenset:
+    match = CLASS_ATTR_RE.search(attrs) if attrs else None
+    if not match:
+        return frozenset()
+    return frozenset(next(value for value in match.groups() if value is not None).split())
+
+
+def _collect(html: str) -> _TableCollector:
+    collector = _TableCollector()
+    collector.feed(html)
+    return collector
+
+
+def _master_dates(collector: _TableCollector) -> Dict[int, date]:
+    """Business date of each master row, keyed by its position on the page"""
+    dates = {}
+    for index, row in enumerate(collector.master_rows):
+        business_date = parse_date(row.date_cell) if row.date_cell else None
+        if business_date is None:
+            for text in row.cells:
+                business_date = parse_date(text)
+                if business_date:
+                    break
+        if business_date:
+            dates[index] = business_date
+    return dates
+
+
+def _page_business_date(html: str, collector: _TableCollector, master_dates: Dict[int, date]) -> Optional[date]:
+    """First business date on the page: master rows, then any table row, then the raw text"""
+    if master_dates:
+        return master_dates[min(master_dates)]
+    rows = (row for table in collector.tables for row in table.rows)
+    for row in islice(rows, BUSINESS_DATE_SCAN_ROWS):
+        if len(row.cells) >= 3:
+            for text in row.cells:
+                business_date = parse_date(text)
+                if business_date:
+                    return business_date
+    match = BUSINESS_DATE_RE.search(html) or DATE_RE.search(html)
+    return parse_date(match.group(1)) if match else None
+
+
+def _is_detail_grid(table: _Table) -> bool:
+    if table.master_index is None:
+        return False
+    if not table.headers:
+        # Kendo renders headers in a separate table; rows are validated by the row parser
+        return True
+    headers = [header.upper() for header in table.headers]
+    return any('STOCK SYMBOL' in h for h in headers) and any('RATE' in h for h in headers)
+
+
+def _detail_rows(collector: _TableCollector, master_dates: Dict[int, date], since: Optional[date] = None):
+    """
+    (master_index, cells) for every data row of the expanded detail grids,
+    skipping settlements whose business date is before since
+    """
+    for table in collector.tables:
+        if not _is_detail_grid(table):
+            continue
+        if since and table.master_index in master_dates and master_dates[table.master_index] < since:
+            continue
+        for row in table.rows:
+            if 'k-grouping-row' in row.classes or len(row.cells) < MIN_COLUMNS:
+                continue
+            yield table.master_index, row.cells
+
+
+def parse_business_dates(html: str) -> Dict[int, date]:
+    """Business date of each master row of a settlement grid"""
+    return _master_dates(_collect(html))
+
+
+def parse_settlement_html(html: str, fallback_date: Optional[date] = None, since: Optional[date] = None) -> List[Dict]:
+    """
+    Parse an expanded Payment Due page. Rows take the business date of their
+    master row, then the first business date on the page, then fallback_date.
+    Only a date read off the page is also set as the row's business_date, so
+    sync watermarks never advance to the fallback.
+    If no detail grid is found every table row with enough columns is tried.
+    since drops settlements with an older business date (incremental syncs).
+    """
+    collector = _collect(html)
+    master_dates = _master_dates(collector)
+    page_date = _page_business_date(html, collector, master_dates)
+
+    settlement_data = []
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for master_index, cells in _detail_rows(collector, master_dates, since):
+        business_date = master_dates.get(master_index, page_date)
+        row = parse_settlement_row(cells, business_date or fallback_date)
+        if debug:
+            logger.debug("Settlement row %s -> %s", cells, row)
+        if row:
+            if business_date:
+                row['business_date'] = business_date
+            settlement_data.append(row)
+
+    # With a watermark, an empty master/detail grid or an old flat page just means nothing new
+    nothing_new = since is not None and bool(collector.master_rows or (page_date and page_date < since))
+    if not settlement_data and not nothing_new:
+        for table in collector.tables:
+            for row in table.rows:
+                cells = row.cells
+                if len(cells) < MIN_COLUMNS:
+                    continue
+                if not any(text.isalpha() and len(text) >= 3 for text in cells[1:4]):
+                    continue
+                parsed = parse_settlement_row(cells, page_date or fallback_date)
+                if parsed:
+                    if page_date:
+                        parsed['business_date'] = page_date
+                    settlement_data.append(parsed)
+
+    logger.debug("Parsed %d settlement rows from %d tables", len(settlement_data), len(collector.tables))
+    return settlement_data
+
+
+def parse_success_html(html: str, since: Optional[date] = None) -> List[Dict]:
+    """
+    Parse an expanded Success page; rows carry the business date of their
+    master row. since drops settlements with an older business date.
+    """
+    collector = _collect(html)
+    master_dates = _master_dates(collector)
+
+    purchases = []
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for master_index, cells in _detail_rows(collector, master_dates, since):
+        row = parse_transaction_row(cells)
+        if debug:
+            logger.debug("Transaction row %s -> %s", cells, row)
+        if row:
+            business_date = master_dates.get(master_index)
+            if business_date:
+                row['business_date'] = business_date
+            purchases.append(row)
+
+    logger.debug("Parsed %d successful purchases from %d tables", len(purchases), len(collector.tables))
+    return purchases
+
+
+# ---------------------------------------------------------------------------
+# JSON
+# ---------------------------------------------------------------------------
+
+def _first(record: Dict, keys) -> Optional[object]:
+    for key in keys:
+        if key in record and record[key] is not None:
+            return record[key]
+    return None
+
+
+def _json_cells(detail: Dict) -> List[str]:
+    """Lay a JSON detail record out like a grid row so the row parsers apply"""
+    cells = [''] * MIN_COLUMNS
+    for column, keys in JSON_DETAIL_KEYS.items():
+        value = _first(detail, keys)
+        cells[column] = '' if value is None else str(value)
+    return cells
+
+
+def parse_settlement_json(payload: Union[str, bytes, list, dict], section: str = SECTION_PAYMENT_DUE) -> List[Dict]:
+    """
+    Parse the grid data of a settlement section: a list of settlements (or
+    {"data": [...]}) with a business date and a list of transaction details
+    """
+    if isinstance(payload, (str, bytes)):
+        payload = json.loads(payload)
+    if isinstance(payload, dict):
+        payload = payload.get('data', [])
+
+    rows = []
+    for settlement in payload:
+        business_date = parse_date(str(_first(settlement, JSON_DATE_KEYS) or ''))
+        for detail in _first(settlement, JSON_DETAILS_KEYS) or ():
+            cells = _json_cells(detail)
+            if section == SECTION_SUCCESS:
+                row = parse_transaction_row(cells)
+                if row and business_date:
+                    row['business_date'] = business_date
+            else:
+                row = parse_settlement_row(cells, business_date)
+                if row and business_date:
+                    row['business_date'] = business_date
+            if row:
+                rows.append(row)
+    return rows
+
+
+def parse_page(content: Union[str, bytes], section: str = SECTION_PAYMENT_DUE) -> List[Dict]:
+    """Parse a saved settlement page, HTML or JSON, for the given section"""
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    if content.lstrip()[:1] in ('{', '['):
+        return parse_settlement_json(content, section)
+    if section == SECTION_SUCCESS:
+        return parse_success_html(content)
+    return parse_settlement_html(content)
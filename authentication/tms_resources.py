@@ -0,0 +1,144 @@
+"""
+Network resource policy for TMS scraping sessions
+"""
+import logging
+from collections import defaultdict
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Playwright resource types blocked in each phase of a sync.
+# The captcha is an <img>, so images must load while the user logs in.
+# TMS stylesheets stay allowed by default on data pages: the Kendo expand
+# icons have no size without CSS and Playwright refuses to click them.
+DEFAULT_RESOURCE_POLICY = {
+    'login': {
+        'block_types': ['font', 'media'],
+        'block_third_party': True,
+    },
+    'data': {
+        'block_types': ['image', 'font', 'media'],
+        'block_third_party': True,
+    },
+}
+
+# Hosts that are always first party for a TMS session
+FIRST_PARTY_SUFFIX = '.nepsetms.com.np'
+
+# Rough transfer sizes (bytes) and durations (ms) used to estimate savings
+# for resource types we never saw load during the sync
+FALLBACK_ESTIMATES = {
+    'image': (30000, 120),
+    'font': (40000, 150),
+    'media': (200000, 400),
+    'stylesheet': (20000, 100),
+    'script': (50000, 150),
+}
+DEFAULT_ESTIMATE = (10000, 80)
+
+
+def get_resource_policy() -> Dict:
+    """Resource policy from settings.TMS_RESOURCE_POLICY, merged over the defaults"""
+    policy = {phase: dict(rules) for phase, rules in DEFAULT_RESOURCE_POLICY.items()}
+    for phase, rules in getattr(settings, 'TMS_RESOURCE_POLICY', {}).items():
+        policy.setdefault(phase, {}).update(rules)
+    return policy
+
+
+class TMSResourceBlocker:
+    """
+    Aborts unneeded requests (images, fonts, media, third-party/analytics) on a
+    browser context and keeps counters to report the bytes and time saved
+    """
+
+    def __init__(self, base_url: str, policy: Optional[Dict] = None):
+        self.host = urlparse(base_url).hostname or ''
+        self.policy = policy or get_resource_policy()
+        self.phase = 'login'
+        self.blocked = defaultdict(int)
+        self.loaded = defaultdict(int)
+        self.loaded_bytes = defaultdict(int)
+        self.loaded_ms = defaultdict(float)
+
+    async def attach(self, context):
+        """Install the route handler and response accounting on a browser context"""
+        await context.route('**/*', self._handle_route)
+        context.on('requestfinished', self._on_request_finished)
+
+    def set_phase(self, phase: str):
+        if phase not in self.policy:
+            logger.warning("Unknown resource policy phase '%s', keeping '%s'", phase, self.phase)
+            return
+        logger.info("Resource policy switched to '%s' phase", phase)
+        self.phase = phase
+
+    def is_first_party(self, url: str) -> bool:
+        hostname = urlparse(url).hostname or ''
+        return hostname == self.host or hostname.endswith(FIRST_PARTY_SUFFIX)
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        if url.startswith('data:'):
+            return False
+        rules = self.policy.get(self.phase, {})
+        if resource_type in rules.get('block_types', ()):
+            return True
+        if rules.get('block_third_party') and resource_type != 'document':
+            return not self.is_first_party(url)
+        return False
+
+    async def _handle_route(self, route):
+        request = route.request
+        try:
+            if self.should_block(request.url, request.resource_type):
+                self.blocked[request.resource_type] += 1
+                await route.abort('blockedbyclient')
+            else:
+                await route.continue_()
+        except Exception as e:
+            # The page may have navigated away while the request was pending
+            logger.debug("Route handling failed for %s: %s", request.url, e)
+
+    async def _on_request_finished(self, request):
+        resource_type = request.resource_type
+        try:
+            sizes = await request.sizes()
+            body_bytes = sizes.get('responseBodySize', 0) + sizes.get('responseHeadersSize', 0)
+        except Exception:
+            body_bytes = 0
+        timing = request.timing or {}
+        duration = timing.get('responseEnd', -1)
+        self.loaded[resource_type] += 1
+        self.loaded_bytes[resource_type] += max(body_bytes, 0)
+        if duration and duration > 0:
+            self.loaded_ms[resource_type] += duration
+
+    def _estimate(self, resource_type: str):
+        """Average bytes/ms per request of this type, observed or fallback"""
+        count = self.loaded.get(resource_type, 0)
+        if count and self.loaded_bytes[resource_type]:
+            return (
+                self.loaded_bytes[resource_type] / count,
+                self.loaded_ms[resource_type] / count,
+            )
+        return FALLBACK_ESTIMATES.get(resource_type, DEFAULT_ESTIMATE)
+
+    def summary(self) -> Dict:
+        """Blocked request counts and estimated savings for this sync"""
+        bytes_saved = 0
+        ms_saved = 0.0
+        for resource_type, count in self.blocked.items():
+            avg_bytes, avg_ms = self._estimate(resource_type)
+            bytes_saved += avg_bytes * count
+            ms_saved += avg_ms * count
+        return {
+            'blocked_requests': sum(self.blocked.values()),
+            'blocked_by_type': dict(self.blocked),
+            'loaded_requests': sum(self.loaded.values()),
+            'loaded_bytes': sum(self.loaded_bytes.values()),
+            'estimated_bytes_saved': int(bytes_saved),
+            'estimated_time_saved_ms': int(ms_saved),
+        }
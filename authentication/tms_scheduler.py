@@ -0,0 +1,189 @@
+"""
+Scheduled TMS syncs for every user with a stored session
+
+`manage.py run_auto_trading` scans for broker accounts that are due (TMS
+configured, a stored session and no sync within the interval) and queues one
+work item per account. Each TMS server has its own bounded queue and workers,
+so a slow or overloaded host only holds up its own accounts:
+
+- at most `concurrency` syncs run at once, all in one headless browser
+- at most `per_server` of them talk to the same TMS host, and logins to one
+  host start at least `spacing` seconds apart
+- a full queue is not waited on; the account is simply picked up by a later
+  scan once the backlog has drained
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+from typing import List, Tuple
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .tms_service import PLAYWRIGHT_AVAILABLE, afetch_with_stored_session
+
+if PLAYWRIGHT_AVAILABLE:
+    from playwright.async_api import async_playwright
+
+logger = logging.getLogger(__name__)
+
+
+def due_accounts(sync_every: timedelta, limit: int = 500) -> List[Tuple[int, int]]:
+    """
+    (user_id, tms_server_number) of active broker accounts with a stored session
+    that have not synced within sync_every, least recently synced first
+    """
+    from .models import TMSBrokerAccount
+
+    cutoff = timezone.now() - sync_every
+    return list(
+        TMSBrokerAccount.objects.filter(is_active=True, user__is_active=True, user__profile_ver__tms_configured=True)
+        .exclude(session_state='')
+        .filter(Q(last_synced_at__isnull=True) | Q(last_synced_at__lt=cutoff))
+        .order_by(F('last_synced_at').asc(nulls_first=True), 'id')
+        .values_list('user_id', 'tms_server_number')[:limit]
+    )
+
+
+class AutoSyncScheduler:
+    """Bounded, per-server rate limited runner for unattended TMS syncs"""
+
+    def __init__(self, concurrency: int = 4, per_server: int = 2, spacing: float = 5.0, queue_size: int = 20,
+                 sync_every: timedelta = timedelta(hours=1), full_sync: bool = False, report=None):
+        self.concurrency = max(1, concurrency)
+        self.per_server = max(1, per_server)
+        self.spacing = max(0.0, spacing)
+        self.queue_size = max(1, queue_size)
+        self.sync_every = sync_every
+        self.full_sync = full_sync
+        # Optional callable(message) for progress lines (the management command's stdout)
+        self.report = report or (lambda message: None)
+        self.stats = Counter()
+        self.queues = {}
+        self.workers = []
+        self.pending = set()
+        # Monotonic time each account was last tried; failures wait out sync_every too
+        self.attempted = {}
+        self.next_start = {}
+        self.start_locks = {}
+        self.slots = None
+        self.playwright = None
+        self.browser = None
+        self.browser_lock = None
+
+    def queue_for(self, tms_number: int) -> asyncio.Queue:
+        """The server's queue, starting its workers the first time the server is seen"""
+        queue = self.queues.get(tms_number)
+        if queue is None:
+            queue = self.queues[tms_number] = asyncio.Queue(self.queue_size)
+            self.next_start[tms_number] = 0.0
+            self.start_locks[tms_number] = asyncio.Lock()
+            for _ in range(self.per_server):
+                self.workers.append(asyncio.create_task(self.work(tms_number, queue)))
+        return queue
+
+    def enqueue(self, accounts, once: bool = False) -> Tuple[int, int]:
+        """Queue due accounts that are not already queued; returns (queued, deferred by a full queue)"""
+        queued = deferred = 0
+        retry_before = time.monotonic() - self.sync_every.total_seconds()
+        for key in accounts:
+            if key in self.pending:
+                continue
+            if key in self.attempted and (once or self.attempted[key] > retry_before):
+                continue
+            queue = self.queue_for(key[1])
+            if queue.full():
+                deferred += 1
+                continue
+            queue.put_nowait(key)
+            self.pending.add(key)
+            queued += 1
+        self.stats['deferred'] += deferred
+        return queued, deferred
+
+    async def wait_turn(self, tms_number: int):
+        """Space out session starts on one TMS host"""
+        async with self.start_locks[tms_number]:
+            loop = asyncio.get_running_loop()
+            delay = self.next_start[tms_number] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start[tms_number] = loop.time() + self.spacing
+
+    async def get_browser(self):
+        """One headless browser shared by all syncs, relaunched if it has gone away"""
+        async with self.browser_lock:
+            if self.browser is None or not self.browser.is_connected():
+                self.browser = await self.playwright.chromium.launch(
+                    headless=True,
+                    args=[
+                        '--no-sandbox',
+                        '--disable-dev-shm-usage',
+                        '--disable-blink-features=AutomationControlled',
+                    ]
+                )
+            return self.browser
+
+    async def sync_account(self, user_id: int, tms_number: int):
+        user = await sync_to_async(User.objects.get)(pk=user_id)
+        browser = await self.get_browser()
+        result = await afetch_with_stored_session(browser, user, tms_number, full_sync=self.full_sync)
+        if result['success']:
+            self.stats['synced'] += 1
+            self.stats['saved'] += result['records_saved']
+            self.report(
+                f"{user.username} TMS{tms_number}: found {result['records_found']}, "
+                f"saved {result['records_saved']} in {result['duration']:.0f}s"
+            )
+        else:
+            self.stats['expired' if result.get('session_expired') else 'failed'] += 1
+            self.report(f"{user.username} TMS{tms_number} failed: {result['error']}")
+        return result
+
+    async def work(self, tms_number: int, queue: asyncio.Queue):
+        while True:
+            user_id, _ = key = await queue.get()
+            try:
+                async with self.slots:
+                    await self.wait_turn(tms_number)
+                    await self.sync_account(user_id, tms_number)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error("Scheduled TMS%s sync for user %s failed: %s", tms_number, user_id, e)
+            finally:
+                self.attempted[key] = time.monotonic()
+                self.pending.discard(key)
+                queue.task_done()
+
+    async def run(self, once: bool = False, poll_interval: float = 60):
+        """
+        Scan for due accounts every poll_interval seconds and keep the workers
+        busy; with once, sync every currently due account and return
+        """
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.browser_lock = asyncio.Lock()
+        async with async_playwright() as p:
+            self.playwright = p
+            try:
+                while True:
+                    accounts = await sync_to_async(due_accounts)(self.sync_every)
+                    queued, deferred = self.enqueue(accounts, once=once)
+                    if queued or deferred:
+                        logger.info("Auto sync: %s due, %s queued, %s deferred", len(accounts), queued, deferred)
+                    if once:
+                        await asyncio.gather(*(queue.join() for queue in self.queues.values()))
+                        if not deferred:
+                            break
+                        continue
+                    await asyncio.sleep(poll_interval)
+            finally:
+                for worker in self.workers:
+                    worker.cancel()
+                await asyncio.gather(*self.workers, return_exceptions=True)
+                if self.browser is not None:
+                    await self.browser.close()
+        return self.stats
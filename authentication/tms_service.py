@@ -1,8 +1,11 @@
 
 import asyncio
-import re
 import logging
-from datetime import datetime
+import threading
+import hashlib
+import json
+from collections import Counter
+from datetime import date, datetime
 from decimal import Decimal
 from typing import Dict, List, Optional
 
@@ -17,10 +20,22 @@ except ImportError:
     logger.warning("Playwright not available. Install it with: pip install playwright && playwright install")
     PLAYWRIGHT_AVAILABLE = False
     
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from asgiref.sync import sync_to_async
 from .models import Share_Buy
+from . import tms_parser
+from . import metrics
+from .portfolio_cache import portfolio_changed
+from .tms_instrumentation import SyncInstrumentation, record_sync_run
+from .tms_resources import TMSResourceBlocker
+
+
+class TMSSessionExpired(Exception):
+    """A stored TMS session was sent back to the login page"""
 
 
 class TMSDataFetcher:
@@ -30,14 +45,73 @@ class TMSDataFetcher:
     Supports automated fetching with stored credentials
     """
 
-    def __init__(self, tms_number: int = 52, settlement_type: str = "PaymentDue"):
+    # TMS login form, used by the headless captcha hand-off
+    CAPTCHA_SELECTORS = ('img#captchaimage', 'img.captcha-image', 'img[src*="captcha" i]', 'img[alt*="captcha" i]')
+    USERNAME_SELECTOR = 'input[name="username"], input#username, input[placeholder*="Client Code" i]'
+    PASSWORD_SELECTOR = 'input[type="password"]'
+    CAPTCHA_INPUT_SELECTOR = 'input[name="captcha"], input#captchaEnter, input[id*="captcha" i], input[placeholder*="captcha" i]'
+    SUBMIT_SELECTOR = 'button[type="submit"], input[type="submit"], .login-btn'
+    LOGIN_ERROR_SELECTOR = '.toast-message, .toast-error, .alert-danger, .error-message'
+    MAX_CAPTCHA_ATTEMPTS = 3
+
+    def __init__(self, tms_number: int = 52, settlement_type: str = "PaymentDue", progress_callback=None, since: Optional[Dict[str, date]] = None, login_handler=None, storage_state: Optional[Dict] = None):
         self.tms_number = tms_number
         self.settlement_type = settlement_type  
         self.base_url = f"https://tms{tms_number}.nepsetms.com.np"
         self.login_url = f"{self.base_url}/tms/login"
         self.settlement_url = f"{self.base_url}/tms/me/gen-bank/settlement-buy-info#{self.settlement_type}"
         self.valid_stocks = None
+        # Optional sync callable(message) used by background jobs to report progress
+        self.progress_callback = progress_callback
+        # Incremental sync watermarks {settlement_type: business date}: settlements
+        # older than their section's date are skipped; sections without one are read in full
+        self.since = since or {}
+        # Optional async callable(tms_number, capture, error) -> {'username', 'password', 'captcha'}
+        # or None; when set the browser runs headless and the captcha is handed to it
+        self.login_handler = login_handler
+        # Stored cookies of an earlier login (scheduled syncs); without a login_handler
+        # an expired session fails the sync instead of waiting for a login
+        self.storage_state = storage_state
+        # Cookies after this sync's login, kept when settings.TMS_STORE_SESSIONS is on
+        self.session_state = None
+        # Phase timers and the summary record of this sync
+        self.instrumentation = SyncInstrumentation(tms_number, settlement_type)
+
+    @property
+    def headless(self) -> bool:
+        return self.login_handler is not None or self.storage_state is not None
+
+    def since_for(self, settlement_type: str) -> Optional[date]:
+        return self.since.get(settlement_type)
+
+    async def finish(self, result: Dict) -> Dict:
+        """
+        Log the summary record of this sync, keep it as a TMSSyncRun and attach
+        its phase timings to the result
+        """
+        summary = self.instrumentation.summary(
+            result['success'],
+            records_found=result.get('records_found', 0),
+            records_saved=result.get('records_saved', 0),
+            error=result.get('error', ''),
+        )
+        await sync_to_async(record_sync_run)(summary)
+        metrics.tms_sync_duration.observe(summary['duration'], tms=self.tms_number, success=result['success'])
+        metrics.tms_rows_imported.inc(summary['records_saved'], tms=self.tms_number)
+        result['timings'] = summary['timings']
+        result['duration'] = summary['duration']
+        return result
         
+    async def report_progress(self, message: str):
+        """
+        Forward a progress message to the callback (e.g. the TMSSyncJob row)
+        """
+        if not self.progress_callback:
+            return
+        try:
+            await sync_to_async(self.progress_callback)(message)
+        except Exception as e:
+            logger.warning("Could not report progress: %s", e)
 
     async def fetch_with_stored_credentials(self, user: User = None) -> Dict:
         """
@@ -62,7 +136,7 @@ class TMSDataFetcher:
                     'records_saved': 0
                 }
             
-            logger.info(f"Using stored TMS credentials for automated fetch...")
+            logger.info("Using stored TMS credentials for automated fetch...")
             
             # Load valid stocks for validation
             await self.get_valid_stocks()
@@ -75,7 +149,7 @@ class TMSDataFetcher:
             )
             
         except Exception as e:
-            logger.error(f"Error in automated fetch: {e}")
+            logger.error("Error in automated fetch: %s", e)
             return {
                 'success': False,
                 'error': f'Automated fetch failed: {str(e)}',
@@ -88,7 +162,7 @@ class TMSDataFetcher:
         Wait for user to manually login through the browser
         """
         try:
-            logger.info(f"Opening TMS login page: {self.login_url}")
+            logger.info("Opening TMS login page: %s", self.login_url)
             await page.goto(self.login_url, timeout=30000)
             await page.wait_for_load_state("networkidle", timeout=30000)
             
@@ -118,11 +192,11 @@ class TMSDataFetcher:
             for attempt in range(60): 
                 try:
                     current_url = page.url
-                    logger.info(f"Checking login status... Current URL: {current_url}")
+                    logger.debug("Checking login status, current URL: %s", current_url)
                     
                     if "/login" not in current_url.lower() and self.base_url in current_url:
                         login_success = True
-                        logger.info(f"Login success detected: redirected away from login page to {current_url}")
+                        logger.info("Login success detected: redirected away from login page to %s", current_url)
                         break
                     
                     for indicator in success_indicators:
@@ -130,7 +204,7 @@ class TMSDataFetcher:
                             element = await page.query_selector(indicator)
                             if element:
                                 login_success = True
-                                logger.info(f"Login success detected with element: {indicator}")
+                                logger.info("Login success detected with element: %s", indicator)
                                 break
                         except:
                             continue
@@ -152,7 +226,7 @@ class TMSDataFetcher:
                     await asyncio.sleep(5)  
                     
                 except Exception as e:
-                    logger.warning(f"Error checking login status: {e}")
+                    logger.warning("Error checking login status: %s", e)
                     await asyncio.sleep(5)
             
             if login_success:
@@ -162,371 +236,248 @@ class TMSDataFetcher:
                 raise Exception("Login timeout - user did not complete login within 5 minutes")
                 
         except Exception as e:
-            logger.error(f"Manual login failed: {str(e)}")
+            logger.error("Manual login failed: %s", e)
             raise Exception(f"Manual login failed: {str(e)}")
 
-    async def fetch_settlement_data(self, page):
+    async def login(self, page):
+        """
+        Headless captcha hand-off when a login_handler is set, otherwise manual login in the visible window
+        """
+        with self.instrumentation.phase('login'):
+            if self.storage_state is not None:
+                if await self.resume_session(page):
+                    return True
+                if not self.login_handler:
+                    raise TMSSessionExpired(f"Stored TMS{self.tms_number} session has expired, log in again from the fetch page")
+            if self.login_handler:
+                return await self.headless_login(page)
+            await self.report_progress(f'TMS{self.tms_number}: waiting for login in the browser window')
+            return await self.wait_for_manual_login(page)
+
+    async def resume_session(self, page) -> bool:
+        """
+        Open the settlement page with the stored cookies; TMS redirects to the
+        login page once the session has expired
+        """
+        await page.goto(self.settlement_url, timeout=30000)
+        await page.wait_for_load_state("networkidle", timeout=30000)
+        if '/login' in page.url.lower():
+            logger.info("Stored TMS%s session was not accepted", self.tms_number)
+            return False
+        logger.info("Resumed stored TMS%s session", self.tms_number)
+        return True
+
+    async def keep_session(self, context):
+        """Remember the logged-in cookies so scheduled syncs can skip the captcha"""
+        if not getattr(settings, 'TMS_STORE_SESSIONS', False):
+            return
+        try:
+            self.session_state = await context.storage_state()
+        except Exception as e:
+            logger.warning("Could not read TMS%s session state: %s", self.tms_number, e)
+
+    async def find_captcha(self, page):
+        for selector in self.CAPTCHA_SELECTORS:
+            element = await page.query_selector(selector)
+            if element:
+                return element
+        return None
+
+    async def headless_login(self, page):
+        """
+        Log in without a visible browser: screenshot only the captcha element,
+        hand it to self.login_handler (the fetch page) and type the answer back in
+        """
+        logger.info("Opening TMS login page headless: %s", self.login_url)
+        await page.goto(self.login_url, timeout=30000)
+        await page.wait_for_load_state("networkidle", timeout=30000)
+
+        error = ''
+        for attempt in range(1, self.MAX_CAPTCHA_ATTEMPTS + 1):
+            captcha = await self.find_captcha(page)
+            if captcha is None:
+                raise Exception("Manual login failed: captcha image not found on the TMS login page")
+
+            answer = await self.login_handler(self.tms_number, lambda: captcha.screenshot(type='png'), error)
+            if not answer:
+                raise Exception("Login timeout - the captcha was not answered in time")
+            await page.fill(self.USERNAME_SELECTOR, answer['username'])
+            await page.fill(self.PASSWORD_SELECTOR, answer['password'])
+            await page.fill(self.CAPTCHA_INPUT_SELECTOR, answer['captcha'])
+            answer = None
+            await page.click(self.SUBMIT_SELECTOR)
+
+            try:
+                await page.wait_for_url(lambda url: '/login' not in url.lower(), timeout=15000)
+                logger.info("Headless login to TMS%s succeeded on attempt %s", self.tms_number, attempt)
+                return True
+            except PlaywrightTimeoutError:
+                message = await page.query_selector(self.LOGIN_ERROR_SELECTOR)
+                error = (await message.text_content() if message else '') or 'Login failed'
+                error = error.strip()[:120]
+                logger.warning("Headless login to TMS%s failed (attempt %s): %s", self.tms_number, attempt, error)
+                await page.reload()
+                await page.wait_for_load_state("networkidle", timeout=30000)
+
+        raise Exception(f"Manual login failed: {error}")
+
+    def settlement_url_for(self, settlement_type: str) -> str:
+        return f"{self.base_url}/tms/me/gen-bank/settlement-buy-info#{settlement_type}"
+
+    async def fetch_settlement_data(self, page, settlement_type: str = None):
         """
         Fetch settlement data from the payment due section with enhanced parsing for TMS structure
         """
+        settlement_url = self.settlement_url_for(settlement_type) if settlement_type else self.settlement_url
+        section = settlement_type or self.settlement_type
+        since = self.since_for(section)
         try:
             # First verify the page is still accessible
             try:
                 current_url = page.url
-                logger.info(f"Starting settlement data fetch. Current URL: {current_url}")
+                logger.info("Starting settlement data fetch. Current URL: %s", current_url)
             except Exception as e:
                 raise Exception(f"Page is not accessible: {e}")
             
-            logger.info(f"Navigating to settlement page: {self.settlement_url}")
-            
-            # Navigate with better error handling
-            try:
-                await page.goto(self.settlement_url, timeout=30000)
-                await page.wait_for_load_state("networkidle", timeout=30000)
-            except Exception as e:
-                logger.error(f"Failed to navigate to settlement page: {e}")
-                # Try alternative approach - maybe we're already on the right domain
-                current_url = page.url
-                if self.base_url in current_url:
-                    logger.info("Already on TMS domain, trying to navigate via JS")
-                    await page.evaluate(f'window.location.href = "{self.settlement_url}"')
-                    await page.wait_for_load_state("networkidle", timeout=30000)
-                else:
-                    raise Exception(f"Cannot navigate to settlement page: {e}")
-            
-            # Wait for content to load
-            await asyncio.sleep(5)
-            settlement_data = []
-            business_date = None
+            logger.info("Navigating to settlement page: %s", settlement_url)
             
-            # First, try to extract business date from the main table
-            try:
-                # Look for business date in the main table rows (format: 2025-03-30)
-                main_table_rows = await page.query_selector_all('table tr')
-                for row in main_table_rows[:15]:  # Check first several rows for business date
-                    cells = await row.query_selector_all('td')
-                    if len(cells) >= 3:
-                        for cell in cells:
-                            text = await cell.text_content()
-                            if text and text.strip():
-                                # Look for date in YYYY-MM-DD format
-                                date_match = re.search(r'(\d{4}-\d{2}-\d{2})', text.strip())
-                                if date_match:
-                                    try:
-                                        business_date = datetime.strptime(date_match.group(1), '%Y-%m-%d').date()
-                                        logger.info(f"Found business date: {business_date}")
-                                        break
-                                    except:
-                                        pass
-                    if business_date:
-                        break
-                        
-                # If not found, also check for business date text
-                if not business_date:
-                    page_content = await page.content()
-                    date_patterns = [
-                        r'BUSINESS DATE[:\s]*(\d{4}-\d{2}-\d{2})',
-                        r'Business Date[:\s]*(\d{4}-\d{2}-\d{2})',
-                        r'(\d{4}-\d{2}-\d{2})'
-                    ]
-                    for pattern in date_patterns:
-                        match = re.search(pattern, page_content)
-                        if match:
-                            try:
-                                business_date = datetime.strptime(match.group(1), '%Y-%m-%d').date()
-                                logger.info(f"Found business date from content: {business_date}")
-                                break
-                            except:
-                                pass
-                        if business_date:
-                            break
-                            
-            except Exception as e:
-                logger.warning(f"Could not extract business date: {e}")
-                # Use current date as fallback
-                business_date = datetime.now().date()
-                logger.info(f"Using current date as fallback: {business_date}")
-            
-            # Try to expand all detail rows first
-            await self.expand_detail_rows(page)
-            
-            # Look for detail rows (expanded transaction details)
-            detail_rows = await page.query_selector_all('tr.k-detail-row')
-            logger.info(f"Found {len(detail_rows)} detail rows")
-            
-            for detail_row in detail_rows:
+            with self.instrumentation.phase('navigate'):
+                # Navigate with better error handling
                 try:
-                    # Look for the nested transaction detail table within this detail row
-                    nested_tables = await detail_row.query_selector_all('table')
-                    
-                    for table in nested_tables:
-                        # Check if this table has the transaction detail columns we expect
-                        header_row = await table.query_selector('thead tr')
-                        if header_row:
-                            headers = await header_row.query_selector_all('th')
-                            header_texts = []
-                            for header in headers:
-                                text = await header.text_content()
-                                header_texts.append(text.strip() if text else "")
-                            
-                            # Check if this looks like the transaction detail table
-                            if any('STOCK SYMBOL' in h for h in header_texts) and any('RATE' in h for h in header_texts):
-                                logger.info(f"Found transaction detail table with headers: {header_texts}")
-                                
-                                # Process data rows
-                                data_rows = await table.query_selector_all('tbody tr')
-                                for row in data_rows:
-                                    cells = await row.query_selector_all('td')
-                                    if len(cells) >= 6:  # Ensure we have enough columns
-                                        cell_texts = []
-                                        for cell in cells:
-                                            text = await cell.text_content()
-                                            cell_texts.append(text.strip() if text else "")
-                                        
-                                        logger.info(f"Transaction row: {cell_texts}")
-                                        scrip_data = self.parse_settlement_row(cell_texts)
-                                        if scrip_data:
-                                            # Use business date if we found it
-                                            if business_date:
-                                                scrip_data['transaction_date'] = business_date
-                                            settlement_data.append(scrip_data)
-                                            logger.info(f"Added parsed data: {scrip_data}")
-                
+                    await page.goto(settlement_url, timeout=30000)
+                    await page.wait_for_load_state("networkidle", timeout=30000)
                 except Exception as e:
-                    logger.error(f"Error processing detail row: {e}")
-                    continue
-            
-            # Fallback: if no detail rows found, try all tables
-            if not settlement_data:
-                logger.info("No data from detail rows, trying all tables")
-                all_tables = await page.query_selector_all('table')
-                logger.info(f"Found {len(all_tables)} tables total")
+                    logger.error("Failed to navigate to settlement page: %s", e)
+                    # Try alternative approach - maybe we're already on the right domain
+                    current_url = page.url
+                    if self.base_url in current_url:
+                        logger.info("Already on TMS domain, trying to navigate via JS")
+                        await page.evaluate(f'window.location.href = "{settlement_url}"')
+                        await page.wait_for_load_state("networkidle", timeout=30000)
+                    else:
+                        raise Exception(f"Cannot navigate to settlement page: {e}")
                 
-                for i, table in enumerate(all_tables):
-                    try:
-                        logger.info(f"Processing table {i+1}")
-                        rows = await table.query_selector_all('tbody tr')
-                        
-                        for j, row in enumerate(rows):
-                            cells = await row.query_selector_all('td')
-                            if len(cells) >= 6:  # Need at least 6 columns for TMS structure
-                                cell_texts = []
-                                for cell in cells:
-                                    text = await cell.text_content()
-                                    cell_texts.append(text.strip() if text else "")
-                                
-                                # Skip rows that are clearly not transaction data
-                                if not any(text.isalpha() and len(text) >= 3 for text in cell_texts[1:4]):
-                                    continue
-                                
-                                logger.info(f"Table {i+1}, Row {j+1}: {cell_texts}")
-                                scrip_data = self.parse_settlement_row(cell_texts)
-                                if scrip_data:
-                                    if business_date:
-                                        scrip_data['transaction_date'] = business_date
-                                    settlement_data.append(scrip_data)
-                                    logger.info(f"Added parsed data: {scrip_data}")
-                    
-                    except Exception as e:
-                        logger.error(f"Error processing table {i+1}: {e}")
-                        continue
-            
-            logger.info(f"Total settlement data found: {len(settlement_data)}")
+                # Wait for content to load
+                await asyncio.sleep(5)
+
+            # Expand the detail rows, then parse one snapshot of the page offline
+            with self.instrumentation.phase('expand'):
+                await self.expand_detail_rows(page, since)
+            with self.instrumentation.phase('extract'):
+                content = await page.content()
+                settlement_data = tms_parser.parse_settlement_html(
+                    content, fallback_date=datetime.now().date(), since=since
+                )
+            for row in settlement_data:
+                row['settlement_type'] = section
+
+            self.instrumentation.count('rows_parsed', len(settlement_data))
+            self.instrumentation.event('extract', section=section, rows=len(settlement_data), page_bytes=len(content))
             return settlement_data
             
         except Exception as e:
-            logger.error(f"Failed to fetch settlement data: {str(e)}")
+            logger.error("Failed to fetch settlement data: %s", e)
             raise Exception(f"Failed to fetch settlement data: {str(e)}")
     
-    async def expand_detail_rows(self, page):
+    async def expand_detail_rows(self, page, since: Optional[date] = None):
         """
         Expand all detail rows to show transaction details
         """
+        if since:
+            return await self.expand_rows_since(page, since)
         try:
             # Look for expansion buttons (plus icons)
             expansion_buttons = await page.query_selector_all('.k-icon.k-plus, .k-icon.k-minus, .k-hierarchy-cell a')
-            logger.info(f"Found {len(expansion_buttons)} potential expansion buttons")
+            self.instrumentation.event('expand', buttons=len(expansion_buttons))
+            debug = self.instrumentation.debug
             
             for i, button in enumerate(expansion_buttons):
                 try:
                     # Check if it's a plus icon (collapsed row)
                     class_name = await button.get_attribute('class')
                     if 'k-plus' in class_name or 'k-icon' in class_name:
-                        logger.info(f"Clicking expansion button {i+1}")
+                        if debug:
+                            logger.debug("Clicking expansion button %d", i + 1)
                         await button.click()
+                        self.instrumentation.count('rows_expanded')
                         await asyncio.sleep(1)  # Wait for expansion
                 except Exception as e:
-                    logger.warning(f"Could not click expansion button {i+1}: {e}")
+                    logger.warning("Could not click expansion button %d: %s", i + 1, e)
                     continue
             
             # Wait for all expansions to complete
             await asyncio.sleep(3)
             
         except Exception as e:
-            logger.warning(f"Error expanding detail rows: {e}")
+            logger.warning("Error expanding detail rows: %s", e)
             # Continue anyway - not critical
     
-    def parse_settlement_row(self, cell_texts: List[str]) -> Optional[Dict]:
+    async def master_row_dates(self, page) -> List[Optional[date]]:
+        """
+        Business date of every master row, read in a single round trip
         """
-        Parse a row of settlement data to extract scrip info based on TMS transaction detail structure
-        Expected columns: S.N, TRANSACTION NO, STOCK SYMBOL, RATE (NPR), QUANTITY, AMOUNT (NPR), etc.
+        texts = await page.eval_on_selector_all(
+            '.k-master-row',
+            '''rows => rows.map(row => {
+                const cell = row.querySelector('td[aria-colindex="3"]');
+                return (cell || row).textContent;
+            })''',
+        )
+        return [tms_parser.parse_date(text or '') for text in texts]
+
+    async def expand_rows_since(self, page, since: date) -> int:
+        """
+        Incremental sync: expand only the settlements on or after since.
+        Older ones were imported by an earlier sync; on a newest-first grid the
+        scan stops at the first of them.
         """
         try:
-            logger.info(f"Parsing row with {len(cell_texts)} cells: {cell_texts}")
-            
-            # Based on the TMS transaction detail structure, we expect specific column positions
-            if len(cell_texts) < 6:
-                logger.info("Not enough columns for TMS transaction detail structure")
-                return None
-            
-            scrip_name = None
-            rate = None
-            units = None
-            
-            # Column mapping based on TMS transaction detail structure:
-            # 0: S.N
-            # 1: TRANSACTION NO  
-            # 2: STOCK SYMBOL - this is the scrip name
-            # 3: RATE (NPR) - this is our buying price
-            # 4: QUANTITY - this is units
-            # 5: AMOUNT (NPR) - this is total amount
-            
-            try:
-                # Extract STOCK SYMBOL (column 2)
-                if len(cell_texts) > 2:
-                    symbol_text = cell_texts[2].strip()
-                    # Check if this looks like a valid stock symbol (3-8 uppercase letters)
-                    if symbol_text and len(symbol_text) >= 2 and symbol_text.replace('.', '').isalpha():
-                        scrip_name = symbol_text.upper()
-                        logger.info(f"Found stock symbol: {scrip_name}")
-                
-                # Extract RATE (column 3) - buying price
-                if len(cell_texts) > 3:
-                    rate_text = cell_texts[3].strip()
-                    # Remove commas and spaces, keep decimal points
-                    rate_clean = re.sub(r'[,\s]', '', rate_text)
-                    if rate_clean and re.match(r'^\d+(\.\d+)?$', rate_clean):
-                        rate = Decimal(rate_clean)
-                        logger.info(f"Found rate: {rate}")
-                
-                # Extract QUANTITY (column 4) - units
-                if len(cell_texts) > 4:
-                    quantity_text = cell_texts[4].strip()
-                    # Remove commas and spaces
-                    quantity_clean = re.sub(r'[,\s]', '', quantity_text)
-                    if quantity_clean and quantity_clean.isdigit():
-                        units = int(quantity_clean)
-                        logger.info(f"Found quantity: {units}")
-                
-                logger.info(f"Extracted: scrip={scrip_name}, rate={rate}, units={units}")
-                
-                # Validate that we have the essential data
-                if scrip_name and rate and units and units > 0 and rate > 0:
-                    return {
-                        'scrip': scrip_name,
-                        'units': units,
-                        'buying_price': rate,
-                        'transaction_date': datetime.now().date()  # Will be updated with business date
-                    }
-                else:
-                    logger.info(f"Missing required data or invalid values: scrip={scrip_name}, rate={rate}, units={units}")
-                
-            except Exception as e:
-                logger.error(f"Error extracting specific columns: {e}")
-                # Try fallback parsing
-                return self.parse_settlement_row_fallback(cell_texts)
-            
-            return None
-            
+            dates = await self.master_row_dates(page)
+            known = [d for d in dates if d]
+            newest_first = len(known) > 1 and known[0] >= known[-1]
+            rows = await page.query_selector_all('.k-master-row')
+            expanded = 0
+            for row, business_date in zip(rows, dates):
+                if business_date and business_date < since:
+                    if newest_first:
+                        break
+                    continue
+                button = await row.query_selector('.k-hierarchy-cell .k-plus')
+                if not button:
+                    continue
+                try:
+                    await button.click()
+                    expanded += 1
+                    await asyncio.sleep(1)  # Wait for expansion
+                except Exception as e:
+                    logger.warning("Could not expand settlement of %s: %s", business_date, e)
+            if expanded:
+                await asyncio.sleep(2)
+            self.instrumentation.count('rows_expanded', expanded)
+            self.instrumentation.event('expand', expanded=expanded, settlements=len(rows), since=since)
+            return expanded
         except Exception as e:
-            logger.error(f"Error parsing row: {e}")
-            return None
-    
+            logger.warning("Error expanding detail rows: %s", e)
+            return 0
+
+    def parse_settlement_row(self, cell_texts: List[str]) -> Optional[Dict]:
+        """
+        Parse a row of settlement data, see tms_parser.parse_settlement_row
+        """
+        return tms_parser.parse_settlement_row(cell_texts)
+
     def parse_settlement_row_fallback(self, cell_texts: List[str]) -> Optional[Dict]:
         """
         Fallback parsing method using pattern matching
         """
-        try:
-            scrip_name = None
-            buying_price = None
-            units = None
-            total_amount = None
-            
-            # Enhanced patterns for fallback parsing
-            scrip_patterns = [
-                r'\b[A-Z]{3,8}\b',  # 3-8 uppercase letters
-                r'\b[A-Z]+[0-9]*\b'  # Uppercase letters possibly followed by numbers
-            ]
-            
-            for i, cell_text in enumerate(cell_texts):
-                cell_text = cell_text.strip()
-                logger.info(f"Cell {i}: '{cell_text}'")
-                
-                # Look for scrip name
-                if not scrip_name:
-                    for pattern in scrip_patterns:
-                        matches = re.findall(pattern, cell_text)
-                        for match in matches:
-                            if 3 <= len(match) <= 8 and match.isalpha():
-                                scrip_name = match
-                                logger.info(f"Found scrip: {scrip_name}")
-                                break
-                
-                # Look for numeric values
-                if re.search(r'[\d,]+\.?\d*', cell_text):
-                    # Clean the number
-                    clean_number = re.sub(r'[,\s]', '', cell_text)
-                    try:
-                        number = float(clean_number)
-                        
-                        # Heuristic based on typical ranges:
-                        # Rate: usually 10-10000
-                        # Quantity: usually 1-10000  
-                        # Amount: usually > 1000
-                        
-                        if 10 <= number <= 10000 and not buying_price:
-                            buying_price = Decimal(str(number))
-                            logger.info(f"Found potential buying price: {buying_price}")
-                        elif 1 <= number <= 10000 and not units:
-                            units = int(number)
-                            logger.info(f"Found potential units: {units}")
-                        elif number > 1000 and not total_amount:
-                            total_amount = Decimal(str(number))
-                            logger.info(f"Found potential total amount: {total_amount}")
-                    except:
-                        pass
-            
-            # Validate and return
-            if scrip_name and buying_price and units and units > 0:
-                if not total_amount:
-                    total_amount = buying_price * Decimal(str(units))
-                
-                logger.info(f"Successfully parsed: {scrip_name}, {units} units @ {buying_price}")
-                return {
-                    'scrip': scrip_name,
-                    'units': units,
-                    'buying_price': buying_price,
-                    'total_amount': total_amount,
-                    'transaction_date': datetime.now().date()
-                }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error in fallback parsing: {e}")
-            return None
-    
+        return tms_parser.parse_settlement_row_fallback(cell_texts)
+
     def parse_page_content(self, content: str) -> List[Dict]:
         """
-        Parse entire page content as fallback method
+        Parse the HTML of an expanded Payment Due page
         """
-        settlement_data = []
-        
-        # This is a simplified version - you might need to enhance this
-        # based on the actual HTML structure of the TMS pages
-        
-        return settlement_data
-    
+        return tms_parser.parse_settlement_html(content)
+
     async def fetch_and_save_data(self, user: User) -> Dict:
         """
         Main method to fetch data and save to database using manual login
@@ -541,29 +492,37 @@ class TMSDataFetcher:
         
         browser = None
         page = None
+        self.instrumentation.user_id = user.id
         
         try:
             async with async_playwright() as p:
                 logger.info("Launching browser for TMS data fetch...")
-                browser = await p.chromium.launch(
-                    headless=False,  # Keep browser visible for manual login
-                    args=[
-                        '--no-sandbox', 
-                        '--disable-dev-shm-usage',
-                        '--disable-blink-features=AutomationControlled',
-                        '--disable-web-security'
-                    ]
-                )
-                
-                # Create browser context and page
-                context = await browser.new_context()
-                page = await context.new_page()
+                with self.instrumentation.phase('launch'):
+                    browser = await p.chromium.launch(
+                        headless=self.headless,  # Visible for manual login unless the captcha is handed off
+                        args=[
+                            '--no-sandbox', 
+                            '--disable-dev-shm-usage',
+                            '--disable-blink-features=AutomationControlled',
+                            '--disable-web-security'
+                        ]
+                    )
+                    
+                    # Create browser context and page
+                    context = await browser.new_context(storage_state=self.storage_state)
+                    resource_blocker = TMSResourceBlocker(self.base_url)
+                    await resource_blocker.attach(context)
+                    page = await context.new_page()
                 
                 # Wait for manual login
                 logger.info("Starting manual login process...")
-                login_success = await self.wait_for_manual_login(page)
+                login_success = await self.login(page)
                 if not login_success:
                     raise Exception("Manual login failed or timed out")
+                await self.keep_session(context)
+                
+                # Captcha is done, data pages don't need images/fonts/media
+                resource_blocker.set_phase('data')
                 
                 # Add a delay and verify page is still valid
                 logger.info("Login successful! Preparing to fetch settlement data...")
@@ -572,69 +531,57 @@ class TMSDataFetcher:
                 # Verify page is still accessible
                 try:
                     current_url = page.url
-                    logger.info(f"Page verification: Current URL is {current_url}")
+                    logger.info("Page verification: Current URL is %s", current_url)
                     
                     # Test page responsiveness
                     title = await page.title()
-                    logger.info(f"Page title: {title}")
+                    logger.info("Page title: %s", title)
                     
                 except Exception as e:
-                    logger.error(f"Page became inaccessible after login: {e}")
+                    logger.error("Page became inaccessible after login: %s", e)
                     raise Exception(f"Browser page became inaccessible after login: {e}")
                 
                 # Fetch settlement data
                 logger.info("Fetching settlement data...")
+                await self.report_progress('Logged in, reading settlement data')
                 settlement_data = await self.fetch_settlement_data(page)
+                await self.report_progress(f'Saving {len(settlement_data)} records')
                 
-                # Save to database
-                saved_records = []
-                for data in settlement_data:
-                    try:
-                        # Check if this record already exists
-                        existing = await sync_to_async(Share_Buy.objects.filter(
-                            user=user,
-                            scrip=data['scrip'],
-                            units=data['units'],
-                            buying_price=data['buying_price'],
-                            transaction_date=data['transaction_date']
-                        ).first)()
-                        
-                        if not existing:
-                            share_buy = await sync_to_async(Share_Buy.objects.create)(
-                                user=user,
-                                scrip=data['scrip'],
-                                units=data['units'],
-                                buying_price=data['buying_price'],
-                                transaction_date=data['transaction_date']
-                            )
-                            saved_records.append(share_buy)
-                            logger.info(f"Saved: {share_buy}")
-                        else:
-                            logger.info(f"Duplicate record skipped: {data}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error saving record {data}: {e}")
+                # Save to database - one query for existing keys, one bulk insert
+                with self.instrumentation.phase('save'):
+                    saved_records = await sync_to_async(save_imported_purchases)(user, settlement_data, self.tms_number)
+                    await sync_to_async(mark_accounts_synced)(user, [self.tms_number], settlement_data)
+                    if self.session_state:
+                        await sync_to_async(save_session_states)(user, {self.tms_number: self.session_state})
                 
-                logger.info(f"Data fetch completed. Found {len(settlement_data)} records, saved {len(saved_records)} new records.")
+                resource_stats = resource_blocker.summary()
+                logger.info(
+                    "Blocked %s requests, saved ~%s bytes / ~%s ms",
+                    resource_stats['blocked_requests'],
+                    resource_stats['estimated_bytes_saved'],
+                    resource_stats['estimated_time_saved_ms'],
+                )
                 
-                # Keep browser open briefly to show results
-                await asyncio.sleep(5)
+                # Keep a visible browser open briefly to show results
+                if not self.headless:
+                    await asyncio.sleep(5)
                 
-                return {
+                return await self.finish({
                     'success': True,
                     'records_found': len(settlement_data),
                     'records_saved': len(saved_records),
-                    'data': saved_records
-                }
+                    'data': saved_records,
+                    'resource_stats': resource_stats
+                })
                 
         except Exception as e:
-            logger.error(f"Error in fetch_and_save_data: {e}")
-            return {
+            logger.error("Error in fetch_and_save_data: %s", e)
+            return await self.finish({
                 'success': False,
                 'error': str(e),
                 'records_found': 0,
                 'records_saved': 0
-            }
+            })
         
         finally:
             # Clean up browser resources
@@ -645,15 +592,323 @@ class TMSDataFetcher:
                     await browser.close()
                 logger.info("Browser closed successfully")
             except Exception as e:
-                logger.warning(f"Error closing browser: {e}")
+                logger.warning("Error closing browser: %s", e)
 
+    async def scrape_server(self, browser, settlement_types=("PaymentDue", "Success")) -> Dict:
+        """
+        Log in and scrape the given settlement sections of this server in its own
+        browser context (separate cookies/session), without saving anything.
+        Used by afetch_tms_data_multi to run several brokers concurrently.
+        """
+        self.instrumentation.settlement_type = '+'.join(settlement_types)
+        context = await browser.new_context(storage_state=self.storage_state)
+        resource_blocker = TMSResourceBlocker(self.base_url)
+        await resource_blocker.attach(context)
+        try:
+            page = await context.new_page()
+            await self.login(page)
+            await self.keep_session(context)
+            resource_blocker.set_phase('data')
 
-# Synchronous wrapper for Django views
-def fetch_tms_data(user: User, username: str = None, password: str = None, tms_number: int = None, settlement_type: str = "Due") -> Dict:
+            rows = []
+            for settlement_type in settlement_types:
+                await self.report_progress(f'TMS{self.tms_number}: reading {settlement_type} settlements')
+                if settlement_type == 'Success':
+                    section_rows = await self.fetch_successful_purchases(page)
+                    for row in section_rows:
+                        row.setdefault('transaction_date', row.get('business_date'))
+                else:
+                    section_rows = await self.fetch_settlement_data(page, settlement_type)
+                rows.extend(section_rows)
+
+            for row in rows:
+                row['tms_number'] = self.tms_number
+            return {
+                'success': True,
+                'tms_number': self.tms_number,
+                'rows': rows,
+                'resource_stats': resource_blocker.summary(),
+            }
+        except Exception as e:
+            logger.error("TMS%s scrape failed: %s", self.tms_number, e)
+            return {
+                'success': False,
+                'tms_number': self.tms_number,
+                'rows': [],
+                'error': str(e),
+                'session_expired': isinstance(e, TMSSessionExpired),
+            }
+        finally:
+            try:
+                await context.close()
+            except Exception as e:
+                logger.warning("Error closing TMS%s context: %s", self.tms_number, e)
+
+    async def fetch_successful_purchases(self, page):
+        """
+        Fetch successful stock purchases from the settlement success section
+        """
+        try:
+            # Navigate to the success page if not already there
+            success_url = f"{self.base_url}/tms/me/gen-bank/settlement-buy-info#Success"
+            current_url = page.url
+
+            with self.instrumentation.phase('navigate'):
+                if "#Success" not in current_url:
+                    logger.info("Navigating to success page: %s", success_url)
+                    await page.goto(success_url, timeout=30000)
+                    await page.wait_for_load_state("networkidle", timeout=30000)
+                    await asyncio.sleep(3)  # Additional wait for content to load
+
+                # Wait for the main grid to load
+                await page.wait_for_selector(".k-grid-table", timeout=30000)
+
+            # Expand all detail rows, then parse one snapshot of the page offline
+            since = self.since_for('Success')
+            with self.instrumentation.phase('expand'):
+                await self.expand_all_detail_rows(page, since)
+            with self.instrumentation.phase('extract'):
+                content = await page.content()
+                successful_purchases = tms_parser.parse_success_html(content, since=since)
+            for row in successful_purchases:
+                row['settlement_type'] = 'Success'
+
+            self.instrumentation.count('rows_parsed', len(successful_purchases))
+            self.instrumentation.event('extract', section='Success', rows=len(successful_purchases), page_bytes=len(content))
+            return successful_purchases
+
+        except Exception as e:
+            logger.error("Failed to fetch successful purchases: %s", e)
+            raise Exception(f"Failed to fetch successful purchases: {str(e)}")
+
+    async def extract_business_dates(self, page):
+        """
+        Extract business dates from the main table rows
+        """
+        try:
+            return tms_parser.parse_business_dates(await page.content())
+        except Exception as e:
+            logger.warning("Error extracting business dates: %s", e)
+            return {}
+
+    async def expand_all_detail_rows(self, page, since: Optional[date] = None):
+        """
+        Expand all detail rows in the success table
+        """
+        if since:
+            return await self.expand_rows_since(page, since)
+        try:
+            # Find all expand buttons (plus icons)
+            expand_buttons = await page.query_selector_all('.k-hierarchy-cell .k-plus')
+            self.instrumentation.event('expand', buttons=len(expand_buttons))
+
+            for button in expand_buttons:
+                try:
+                    # Check if the row is not already expanded
+                    class_name = await button.get_attribute('class')
+                    if 'k-plus' in class_name:
+                        await button.click()
+                        self.instrumentation.count('rows_expanded')
+                        await asyncio.sleep(1)  # Brief pause between clicks
+                except Exception as e:
+                    logger.warning("Could not click expand button: %s", e)
+                    continue
+
+            await asyncio.sleep(2)  # Wait for all expansions to complete
+        except Exception as e:
+            logger.warning("Error expanding detail rows: %s", e)
+
+    def parse_transaction_row(self, cell_texts: List[str]) -> Optional[Dict]:
+        """
+        Parse a row of transaction data from the success table
+        """
+        return tms_parser.parse_transaction_row(cell_texts)
+
+    async def fetch_and_save_successful_purchases(self, user: User) -> Dict:
+        """
+        Main method to fetch successful purchases and save to database
+        """
+        if not PLAYWRIGHT_AVAILABLE:
+            return {
+                'success': False,
+                'error': 'Playwright is not installed.',
+                'records_found': 0,
+                'records_saved': 0
+            }
+
+        browser = None
+        page = None
+        self.instrumentation.settlement_type = 'Success'
+        self.instrumentation.user_id = user.id
+
+        try:
+            async with async_playwright() as p:
+                logger.info("Launching browser for successful purchases fetch...")
+                with self.instrumentation.phase('launch'):
+                    browser = await p.chromium.launch(
+                        headless=self.headless,  # Visible for manual login unless the captcha is handed off
+                        args=['--no-sandbox', '--disable-dev-shm-usage']
+                    )
+
+                    context = await browser.new_context()
+                    resource_blocker = TMSResourceBlocker(self.base_url)
+                    await resource_blocker.attach(context)
+                    page = await context.new_page()
+
+                # Wait for manual login
+                logger.info("Starting manual login process...")
+                login_success = await self.login(page)
+                if not login_success:
+                    raise Exception("Manual login failed")
+
+                resource_blocker.set_phase('data')
+                logger.info("Login successful! Fetching successful purchases...")
+                await asyncio.sleep(3)
+
+                # Fetch successful purchases data
+                purchases = await self.fetch_successful_purchases(page)
+
+                # Save to database
+                for purchase in purchases:
+                    purchase.setdefault('transaction_date', purchase.get('business_date'))
+                with self.instrumentation.phase('save'):
+                    saved_records = await sync_to_async(save_imported_purchases)(user, purchases, self.tms_number)
+                    await sync_to_async(mark_accounts_synced)(user, [self.tms_number], purchases)
+
+                return await self.finish({
+                    'success': True,
+                    'records_found': len(purchases),
+                    'records_saved': len(saved_records),
+                    'data': saved_records,
+                    'resource_stats': resource_blocker.summary()
+                })
+
+        except Exception as e:
+            logger.error("Error in successful purchases fetch: %s", e)
+            return await self.finish({
+                'success': False,
+                'error': str(e),
+                'records_found': 0,
+                'records_saved': 0
+            })
+
+        finally:
+            try:
+                if page:
+                    await page.close()
+                if browser:
+                    await browser.close()
+            except:
+                pass
+
+
+def tms_import_key(tms_number: int, data: Dict) -> str:
     """
-    Synchronous wrapper for the async TMS data fetcher
-    Uses manual login approach - username and password are not needed
-    settlement_type: 'Success' or 'Due'
+    Idempotency key for an imported purchase. TMS transaction numbers are unique
+    per server; rows without one fall back to a hash of the natural key.
+    A 'tms_number' in the row (multi-server syncs) wins over the argument.
+    """
+    tms_number = data.get('tms_number') or tms_number
+    if data.get('transaction_no'):
+        return f"tms{tms_number}:{data['transaction_no']}"[:64]
+    natural = f"{data['scrip']}|{data['units']}|{Decimal(data['buying_price']):.2f}|{data['transaction_date']}"
+    return f"tms{tms_number}:nk:{hashlib.sha1(natural.encode()).hexdigest()}"
+
+
+@transaction.atomic
+def save_imported_purchases(user: User, rows: List[Dict], tms_number: int = None) -> List[Share_Buy]:
+    """
+    Insert parsed TMS purchases that the user doesn't have yet and return the
+    rows that went in. Existing keys are loaded in one query and new rows go in
+    one bulk insert; the (user, tms_import_key) constraint keeps concurrent
+    reruns idempotent. Manually entered rows (no import key) are matched on
+    (scrip, units, price, date).
+    """
+    # Imports of one user wait for each other (a row lock on PostgreSQL; SQLite
+    # in IMMEDIATE mode already holds the write lock), so the keys read below stay current
+    list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+    existing_keys = set()
+    manual_rows = Counter()
+    for scrip, units, price, transaction_date, key in Share_Buy.objects.filter(user=user).values_list(
+        'scrip', 'units', 'buying_price', 'transaction_date', 'tms_import_key'
+    ):
+        if key:
+            existing_keys.add(key)
+        else:
+            manual_rows[(scrip, units, price, transaction_date)] += 1
+
+    new_records = []
+    duplicates = manual_matches = 0
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for data in rows:
+        if not data.get('transaction_date'):
+            data['transaction_date'] = datetime.now().date()
+        key = tms_import_key(tms_number, data)
+        natural_key = (data['scrip'], data['units'], Decimal(data['buying_price']), data['transaction_date'])
+        if key in existing_keys:
+            duplicates += 1
+            if debug:
+                logger.debug("Duplicate record skipped: %s", data)
+            continue
+        if manual_rows[natural_key] > 0:
+            manual_rows[natural_key] -= 1
+            manual_matches += 1
+            if debug:
+                logger.debug("Record already entered manually, skipped: %s", data)
+            continue
+        existing_keys.add(key)
+        new_records.append(Share_Buy(
+            user=user,
+            scrip=data['scrip'],
+            units=data['units'],
+            remaining_units=data['units'],
+            buying_price=data['buying_price'],
+            transaction_date=data['transaction_date'],
+            tms_import_key=key,
+        ))
+
+    inserted = []
+    if new_records:
+        # Where the lock above is a no-op (SQLite with SQLITE_TUNED off) another sync
+        # can insert some of these keys meanwhile; the insert skips them, and so does
+        # the result, so records_saved counts only the rows of this call
+        keys = [record.tms_import_key for record in new_records]
+        present = set(
+            Share_Buy.objects.filter(user=user, tms_import_key__in=keys).values_list('tms_import_key', flat=True)
+        )
+        Share_Buy.objects.bulk_create(new_records, ignore_conflicts=True)
+        inserted = list(
+            Share_Buy.objects.filter(user=user, tms_import_key__in=set(keys) - present).order_by('id')
+        )
+        if inserted:
+            portfolio_changed(user.id)
+    logger.info(
+        "Imported %d of %d TMS records for user %s (%d duplicates, %d entered manually, %d inserted concurrently)",
+        len(inserted), len(rows), user.id, duplicates, manual_matches, len(new_records) - len(inserted),
+    )
+    return inserted
+
+
+def resolve_tms_number(user: User, tms_number: int = None) -> int:
+    """
+    TMS server to use: explicit value, then the user's profile, then 52
+    """
+    if tms_number:
+        return int(tms_number)
+    try:
+        tms_number = user.profile_ver.tms_server_number
+    except Exception:
+        pass
+    return tms_number or 52
+
+
+# Native async entry points for async views, ASGI and the worker
+async def afetch_tms_data(user: User, tms_number: int = None, settlement_type: str = "PaymentDue", progress_callback=None, full_sync: bool = False, login_handler=None) -> Dict:
+    """
+    Async TMS data fetch - await this from async code instead of using the sync wrapper
+    settlement_type: 'PaymentDue' or 'Success'
+    full_sync: re-read every settlement instead of only those since the last sync
+    login_handler: run headless and hand the captcha to it (see TMSDataFetcher.headless_login)
     """
     if not PLAYWRIGHT_AVAILABLE:
         return {
@@ -663,349 +918,325 @@ def fetch_tms_data(user: User, username: str = None, password: str = None, tms_n
             'records_saved': 0
         }
 
-    # Use profile settings for TMS server if not provided
-    try:
-        profile = user.profile_ver
-        if not tms_number:
-            tms_number = profile.tms_server_number
-    except:
-        pass
+    tms_number = await sync_to_async(resolve_tms_number)(user, tms_number)
+    since = None if full_sync else (await sync_to_async(sync_watermarks)(user, [tms_number], [settlement_type]))[tms_number]
+    fetcher = TMSDataFetcher(
+        tms_number, settlement_type, progress_callback=progress_callback, since=since, login_handler=login_handler
+    )
+    return await fetcher.fetch_and_save_data(user)
 
-    # Fallback default
-    if not tms_number:
-        tms_number = 52
 
-    fetcher = TMSDataFetcher(tms_number, settlement_type)
+async def afetch_successful_purchases(user: User, tms_number: int = None, full_sync: bool = False) -> Dict:
+    """
+    Async fetch of settled (successful) purchases
+    """
+    if not PLAYWRIGHT_AVAILABLE:
+        return {
+            'success': False,
+            'error': 'Playwright not available',
+            'records_found': 0,
+            'records_saved': 0
+        }
+
+    tms_number = await sync_to_async(resolve_tms_number)(user, tms_number)
+    since = None if full_sync else (await sync_to_async(sync_watermarks)(user, [tms_number], ['Success']))[tms_number]
+    fetcher = TMSDataFetcher(tms_number, since=since)
+    return await fetcher.fetch_and_save_successful_purchases(user)
 
-    # Run the async function
+
+def user_tms_servers(user: User) -> List[int]:
+    """Active broker servers of the user, falling back to the profile's server"""
     try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        return user.profile_ver.get_tms_servers()
+    except Exception:
+        return [resolve_tms_number(user)]
+
 
-    return loop.run_until_complete(fetcher.fetch_and_save_data(user))
-async def fetch_successful_purchases(self, page):
+def sync_watermarks(user: User, tms_numbers: List[int], settlement_types=("PaymentDue", "Success")) -> Dict[int, Dict[str, date]]:
     """
-    Fetch successful stock purchases from the settlement success section
+    {tms_number: {settlement_type: business date}} each incremental sync starts
+    from: the newest business date an earlier sync read off that section of that
+    server. A section without one is missing and gets a full sync
     """
-    try:
-        # Navigate to the success page if not already there
-        success_url = f"{self.base_url}/tms/me/gen-bank/settlement-buy-info#Success"
-        current_url = page.url
-        
-        if "#Success" not in current_url:
-            logger.info(f"Navigating to success page: {success_url}")
-            await page.goto(success_url, timeout=30000)
-            await page.wait_for_load_state("networkidle", timeout=30000)
-            await asyncio.sleep(3)  # Additional wait for content to load
-        
-        # Wait for the main grid to load
-        await page.wait_for_selector(".k-grid-table", timeout=30000)
-        
-        # First extract business dates from the main table
-        business_dates = await self.extract_business_dates(page)
-        logger.info(f"Found business dates: {business_dates}")
-        
-        # Expand all detail rows to show transaction details
-        await self.expand_all_detail_rows(page)
-        
-        # Extract transaction details
-        successful_purchases = []
-        detail_rows = await page.query_selector_all('tr.k-detail-row')
-        logger.info(f"Found {len(detail_rows)} detail rows for successful purchases")
-        
-        for i, detail_row in enumerate(detail_rows):
-            try:
-                # Get the parent row to find the business date
-                parent_row_index = await detail_row.evaluate('el => el.getAttribute("data-kendo-grid-item-index")')
-                business_date = business_dates.get(int(parent_row_index)) if parent_row_index else None
-                
-                # Find the transaction details table within this detail row
-                transaction_table = await detail_row.query_selector('table.k-grid-table')
-                if not transaction_table:
-                    continue
-                
-                # Process each transaction row
-                transaction_rows = await transaction_table.query_selector_all('tbody tr:not(.k-grouping-row)')
-                for row in transaction_rows:
-                    cells = await row.query_selector_all('td')
-                    if len(cells) >= 6:  # Ensure we have enough columns
-                        cell_texts = [await cell.text_content() for cell in cells]
-                        cell_texts = [text.strip() if text else "" for text in cell_texts]
-                        
-                        # Parse the transaction data
-                        transaction_data = self.parse_transaction_row(cell_texts)
-                        if transaction_data:
-                            if business_date:
-                                transaction_data['business_date'] = business_date
-                            successful_purchases.append(transaction_data)
-                            logger.info(f"Added successful purchase: {transaction_data}")
-            
-            except Exception as e:
-                logger.error(f"Error processing detail row {i}: {e}")
-                continue
-        
-        logger.info(f"Total successful purchases found: {len(successful_purchases)}")
-        return successful_purchases
-    
-    except Exception as e:
-        logger.error(f"Failed to fetch successful purchases: {str(e)}")
-        raise Exception(f"Failed to fetch successful purchases: {str(e)}")
+    from .models import TMSBrokerAccount
+
+    fields = {settlement_type: TMSBrokerAccount.watermark_field(settlement_type) for settlement_type in settlement_types}
+    watermarks = {tms_number: {} for tms_number in tms_numbers}
+    for account in TMSBrokerAccount.objects.filter(user=user, tms_server_number__in=tms_numbers).values(
+        'tms_server_number', *set(fields.values())
+    ):
+        for settlement_type, field in fields.items():
+            if account[field]:
+                watermarks[account['tms_server_number']][settlement_type] = account[field]
+    return watermarks
 
-async def extract_business_dates(self, page):
+
+def mark_accounts_synced(user: User, tms_numbers: List[int], rows: List[Dict] = ()):
     """
-    Extract business dates from the main table rows
+    Record a successful sync: last_synced_at of each broker account, last_tms_sync
+    if the profile's server was synced, and per settlement section the newest
+    business date read off the page (a row's business_date, never the fallback
+    transaction date), creating the account of a profile-only user to hold it
     """
-    business_dates = {}
-    try:
-        main_rows = await page.query_selector_all('.k-master-row')
-        for i, row in enumerate(main_rows):
-            try:
-                cells = await row.query_selector_all('td[aria-colindex="3"]')  # Business date column
-                if cells:
-                    date_text = await cells[0].text_content()
-                    if date_text:
-                        date_match = re.search(r'(\d{4}-\d{2}-\d{2})', date_text.strip())
-                        if date_match:
-                            try:
-                                business_date = datetime.strptime(date_match.group(1), '%Y-%m-%d').date()
-                                business_dates[i] = business_date
-                                logger.info(f"Row {i} business date: {business_date}")
-                            except:
-                                pass
-            except:
-                continue
-    except Exception as e:
-        logger.warning(f"Error extracting business dates: {e}")
-    
-    return business_dates
+    from .models import Profile_ver, TMSBrokerAccount
+
+    now = timezone.now()
+    default_server = tms_numbers[0] if len(tms_numbers) == 1 else None
+    newest = {}
+    for row in rows:
+        business_date = row.get('business_date')
+        server = row.get('tms_number') or default_server
+        settlement_type = row.get('settlement_type')
+        if not (business_date and server and settlement_type):
+            continue
+        key = (server, TMSBrokerAccount.watermark_field(settlement_type))
+        if business_date > newest.get(key, date.min):
+            newest[key] = business_date
+
+    accounts = TMSBrokerAccount.objects.filter(user=user, tms_server_number__in=tms_numbers)
+    for server in {server for server, _ in newest}:
+        TMSBrokerAccount.objects.get_or_create(user=user, tms_server_number=server)
+    accounts.update(last_synced_at=now)
+    for (server, field), business_date in newest.items():
+        accounts.filter(tms_server_number=server).filter(
+            Q(**{f'{field}__isnull': True}) | Q(**{f'{field}__lt': business_date})
+        ).update(**{field: business_date})
+    Profile_ver.objects.filter(user=user, tms_server_number__in=tms_numbers).update(last_tms_sync=now)
+
 
-async def expand_all_detail_rows(self, page):
+def save_session_states(user: User, states: Dict[int, Dict]):
     """
-    Expand all detail rows in the success table
+    Store the logged-in cookies of each server on the user's broker account,
+    creating the account for a profile-only user
     """
+    from .models import TMSBrokerAccount
+
+    now = timezone.now()
+    for tms_number, state in states.items():
+        TMSBrokerAccount.objects.update_or_create(
+            user=user,
+            tms_server_number=tms_number,
+            defaults={'session_state': json.dumps(state), 'session_saved_at': now},
+        )
+
+
+def stored_session(user: User, tms_number: int) -> Optional[Dict]:
+    """Storage state saved by the last login to this server, if any"""
+    from .models import TMSBrokerAccount
+
+    state = (
+        TMSBrokerAccount.objects.filter(user=user, tms_server_number=tms_number)
+        .values_list('session_state', flat=True)
+        .first()
+    )
     try:
-        # Find all expand buttons (plus icons)
-        expand_buttons = await page.query_selector_all('.k-hierarchy-cell .k-plus')
-        logger.info(f"Found {len(expand_buttons)} expand buttons")
-        
-        for button in expand_buttons:
-            try:
-                # Check if the row is not already expanded
-                class_name = await button.get_attribute('class')
-                if 'k-plus' in class_name:
-                    await button.click()
-                    await asyncio.sleep(1)  # Brief pause between clicks
-            except Exception as e:
-                logger.warning(f"Could not click expand button: {e}")
-                continue
-        
-        await asyncio.sleep(2)  # Wait for all expansions to complete
-    except Exception as e:
-        logger.warning(f"Error expanding detail rows: {e}")
+        return json.loads(state) if state else None
+    except ValueError:
+        logger.warning("Discarding unreadable TMS%s session of user %s", tms_number, user.id)
+        return None
+
+
+def forget_session(user: User, tms_number: int):
+    """Drop an expired session so the scheduler stops retrying it until the next login"""
+    from .models import TMSBrokerAccount
 
-def parse_transaction_row(self, cell_texts: List[str]) -> Optional[Dict]:
+    TMSBrokerAccount.objects.filter(user=user, tms_server_number=tms_number).update(session_state='', session_saved_at=None)
+
+
+async def afetch_with_stored_session(browser, user: User, tms_number: int, settlement_types=("PaymentDue", "Success"), full_sync: bool = False) -> Dict:
     """
-    Parse a row of transaction data from the success table
-    Expected columns: S.N, Transaction No, Stock Symbol, Rate, Quantity, Amount, etc.
+    Unattended sync of one broker account in a context of the caller's browser,
+    logged in with the account's stored cookies (used by run_auto_trading)
     """
-    try:
-        if len(cell_texts) < 6:
-            return None
-        
-        # Column mapping for successful purchases table:
-        # 0: S.N
-        # 1: Transaction No
-        # 2: Stock Symbol (scrip)
-        # 3: Rate (buying price)
-        # 4: Quantity (units)
-        # 5: Amount (total)
-        
-        scrip = None
-        rate = None
-        units = None
-        amount = None
-        
-        # Extract scrip (column 2)
-        if len(cell_texts) > 2:
-            scrip_text = cell_texts[2].strip().upper()
-            if 2 <= len(scrip_text) <= 8 and scrip_text.isalpha():
-                scrip = scrip_text
-        
-        # Extract rate (column 3)
-        if len(cell_texts) > 3:
-            rate_text = re.sub(r'[^\d.]', '', cell_texts[3])
-            try:
-                rate = Decimal(rate_text) if rate_text else None
-            except:
-                pass
-        
-        # Extract units (column 4)
-        if len(cell_texts) > 4:
-            units_text = re.sub(r'[^\d]', '', cell_texts[4])
-            try:
-                units = int(units_text) if units_text else None
-            except:
-                pass
-        
-        # Extract amount (column 5)
-        if len(cell_texts) > 5:
-            amount_text = re.sub(r'[^\d.]', '', cell_texts[5])
-            try:
-                amount = Decimal(amount_text) if amount_text else None
-            except:
-                pass
-        
-        # Validate required fields
-        if not all([scrip, rate, units]):
-            return None
-        
-        # Calculate amount if not provided
-        if not amount:
-            try:
-                amount = Decimal(str(rate)) * Decimal(str(units))
-            except:
-                amount = None
-        
-        return {
-            'scrip': scrip,
-            'units': units,
-            'buying_price': rate,
-            'total_amount': amount,
-            'status': 'SETTLED'
-        }
-    
-    except Exception as e:
-        logger.error(f"Error parsing transaction row: {e}")
-        return None
+    state = await sync_to_async(stored_session)(user, tms_number)
+    if state is None:
+        return {'success': False, 'error': f'No stored TMS{tms_number} session', 'records_found': 0, 'records_saved': 0}
+
+    since = None if full_sync else (await sync_to_async(sync_watermarks)(user, [tms_number], settlement_types))[tms_number]
+    fetcher = TMSDataFetcher(tms_number, since=since, storage_state=state)
+    fetcher.instrumentation.user_id = user.id
+    result = await fetcher.scrape_server(browser, settlement_types)
+    if not result['success']:
+        if result.get('session_expired'):
+            await sync_to_async(forget_session)(user, tms_number)
+        return await fetcher.finish({
+            'success': False,
+            'error': result['error'],
+            'session_expired': result.get('session_expired', False),
+            'records_found': 0,
+            'records_saved': 0,
+        })
+
+    with fetcher.instrumentation.phase('save'):
+        saved_records = await sync_to_async(save_imported_purchases)(user, result['rows'], tms_number)
+        await sync_to_async(mark_accounts_synced)(user, [tms_number], result['rows'])
+        if fetcher.session_state:
+            await sync_to_async(save_session_states)(user, {tms_number: fetcher.session_state})
+    return await fetcher.finish({
+        'success': True,
+        'records_found': len(result['rows']),
+        'records_saved': len(saved_records),
+        'since': since,
+        'data': saved_records,
+        'resource_stats': result.get('resource_stats'),
+    })
 
-async def fetch_and_save_successful_purchases(self, user: User) -> Dict:
+
+async def afetch_tms_data_multi(user: User, tms_numbers: List[int] = None, settlement_types=("PaymentDue", "Success"), progress_callback=None, full_sync: bool = False, login_handler=None) -> Dict:
     """
-    Main method to fetch successful purchases and save to database
+    Sync several broker accounts at once: one browser, one isolated context per
+    server, all logins/scrapes gathered concurrently, then a single deduplicated import.
+    Each server only reads settlements since its watermark unless full_sync is set.
     """
     if not PLAYWRIGHT_AVAILABLE:
         return {
             'success': False,
-            'error': 'Playwright is not installed.',
+            'error': 'Playwright is not installed. Please run: pip install playwright && playwright install',
             'records_found': 0,
             'records_saved': 0
         }
-    
-    browser = None
-    page = None
-    
+
+    if not tms_numbers:
+        tms_numbers = await sync_to_async(user_tms_servers)(user)
+    tms_numbers = list(dict.fromkeys(int(n) for n in tms_numbers))
+    watermarks = {} if full_sync else await sync_to_async(sync_watermarks)(user, tms_numbers, settlement_types)
+    logger.info("Starting multi-server TMS sync for user %s: %s, since %s", user.id, tms_numbers, watermarks)
+
+    # Launch and save are shared by all servers; each server's summary includes them
+    shared = SyncInstrumentation(None, '+'.join(settlement_types), user.id)
     try:
         async with async_playwright() as p:
-            logger.info("Launching browser for successful purchases fetch...")
-            browser = await p.chromium.launch(
-                headless=False,  # Visible for manual login
-                args=['--no-sandbox', '--disable-dev-shm-usage']
-            )
-            
-            context = await browser.new_context()
-            page = await context.new_page()
-            
-            # Wait for manual login
-            logger.info("Starting manual login process...")
-            login_success = await self.wait_for_manual_login(page)
-            if not login_success:
-                raise Exception("Manual login failed")
-            
-            logger.info("Login successful! Fetching successful purchases...")
-            await asyncio.sleep(3)
-            
-            # Fetch successful purchases data
-            purchases = await self.fetch_successful_purchases(page)
-            
-            # Save to database
-            saved_records = []
-            for purchase in purchases:
-                try:
-                    # Check for existing record
-                    existing = await sync_to_async(Share_Buy.objects.filter(
-                        user=user,
-                        scrip=purchase['scrip'],
-                        units=purchase['units'],
-                        buying_price=purchase['buying_price'],
-                        transaction_date=purchase.get('business_date')
-                    ).first)()
-                    
-                    if not existing:
-                        share_buy = await sync_to_async(Share_Buy.objects.create)(
-                            user=user,
-                            scrip=purchase['scrip'],
-                            units=purchase['units'],
-                            buying_price=purchase['buying_price'],
-                            total_amount=purchase.get('total_amount'),
-                            transaction_date=purchase.get('business_date'),
-                            status='SETTLED'  # Or whatever status field you use
-                        )
-                        saved_records.append(share_buy)
-                        logger.info(f"Saved successful purchase: {share_buy}")
-                    else:
-                        logger.info(f"Duplicate purchase skipped: {purchase}")
-                
-                except Exception as e:
-                    logger.error(f"Error saving purchase {purchase}: {e}")
-            
-            logger.info(f"Found {len(purchases)} successful purchases, saved {len(saved_records)} new records")
-            
-            return {
-                'success': True,
-                'records_found': len(purchases),
-                'records_saved': len(saved_records),
-                'data': saved_records
-            }
-    
-    except Exception as e:
-        logger.error(f"Error in successful purchases fetch: {e}")
-        return {
-            'success': False,
-            'error': str(e),
-            'records_found': 0,
-            'records_saved': 0
-        }
-    
-    finally:
-        try:
-            if page:
-                await page.close()
-            if browser:
+            with shared.phase('launch'):
+                browser = await p.chromium.launch(
+                    headless=login_handler is not None,  # Visible for manual login unless the captcha is handed off
+                    args=[
+                        '--no-sandbox',
+                        '--disable-dev-shm-usage',
+                        '--disable-blink-features=AutomationControlled',
+                    ]
+                )
+            try:
+                fetchers = [
+                    TMSDataFetcher(n, progress_callback=progress_callback, since=watermarks.get(n), login_handler=login_handler)
+                    for n in tms_numbers
+                ]
+                server_results = await asyncio.gather(
+                    *(fetcher.scrape_server(browser, settlement_types) for fetcher in fetchers)
+                )
+            finally:
                 await browser.close()
-        except:
-            pass
+    except Exception as e:
+        logger.error("Error in multi-server TMS sync: %s", e)
+        shared.summary(False, error=str(e))
+        return {'success': False, 'error': str(e), 'records_found': 0, 'records_saved': 0}
+
+    all_rows = [row for result in server_results for row in result['rows']]
+    synced = [result['tms_number'] for result in server_results if result['success']]
+    saved_records = []
+    with shared.phase('save'):
+        if all_rows:
+            saved_records = await sync_to_async(save_imported_purchases)(user, all_rows)
+        if synced:
+            await sync_to_async(mark_accounts_synced)(user, synced, all_rows)
+        sessions = {fetcher.tms_number: fetcher.session_state for fetcher in fetchers if fetcher.session_state}
+        if sessions:
+            await sync_to_async(save_session_states)(user, sessions)
+
+    saved_per_server = Counter(record.tms_import_key.split(':', 1)[0] for record in saved_records)
+    servers = {}
+    for fetcher, r in zip(fetchers, server_results):
+        fetcher.instrumentation.user_id = user.id
+        fetcher.instrumentation.timings.update(shared.timings)
+        servers[r['tms_number']] = await fetcher.finish({
+            'success': r['success'],
+            'records_found': len(r['rows']),
+            'records_saved': saved_per_server[f"tms{r['tms_number']}"],
+            'since': watermarks.get(r['tms_number']),
+            'error': r.get('error', ''),
+            'resource_stats': r.get('resource_stats'),
+        })
+
+    errors = [f"TMS{r['tms_number']}: {r['error']}" for r in server_results if not r['success']]
+    summary = shared.summary(bool(synced), len(all_rows), len(saved_records), '; '.join(errors))
+    return {
+        'success': bool(synced),
+        'error': '; '.join(errors),
+        'records_found': len(all_rows),
+        'records_saved': len(saved_records),
+        'data': saved_records,
+        'duration': summary['duration'],
+        'servers': servers,
+    }
+
+
+class _TMSLoopThread:
+    """
+    One long-lived event loop on a daemon thread for the sync wrappers.
+    Calling run_until_complete on the caller's loop fails under ASGI (the loop
+    is already running) and blocks it; submitting to this loop instead lets
+    sync callers wait on a future while several syncs share the one loop.
+    """
+    _loop = None
+    _thread = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_loop(cls) -> asyncio.AbstractEventLoop:
+        with cls._lock:
+            if cls._loop is None or not cls._thread.is_alive():
+                cls._loop = asyncio.new_event_loop()
+                cls._thread = threading.Thread(
+                    target=cls._loop.run_forever,
+                    name='tms-event-loop',
+                    daemon=True,
+                )
+                cls._thread.start()
+            return cls._loop
+
+
+def run_in_tms_loop(coro, timeout: float = None):
+    """
+    Run a coroutine on the shared TMS loop thread and wait for its result
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _TMSLoopThread.get_loop())
+    return future.result(timeout)
+
+
+# Synchronous wrapper for Django views
+def fetch_tms_data(user: User, username: str = None, password: str = None, tms_number: int = None, settlement_type: str = "Due", progress_callback=None, full_sync: bool = False, login_handler=None) -> Dict:
+    """
+    Synchronous wrapper for the async TMS data fetcher
+    Uses manual login approach - username and password are not needed
+    settlement_type: 'Success' or 'Due'
+    progress_callback: optional callable(message) for background jobs
+    """
+    return run_in_tms_loop(afetch_tms_data(
+        user,
+        tms_number=tms_number,
+        settlement_type=settlement_type,
+        progress_callback=progress_callback,
+        full_sync=full_sync,
+        login_handler=login_handler,
+    ))
+
+
+def fetch_tms_data_multi(user: User, tms_numbers: List[int] = None, settlement_types=("PaymentDue", "Success"), progress_callback=None, full_sync: bool = False, login_handler=None) -> Dict:
+    """
+    Synchronous wrapper for afetch_tms_data_multi
+    """
+    return run_in_tms_loop(afetch_tms_data_multi(
+        user,
+        tms_numbers=tms_numbers,
+        settlement_types=settlement_types,
+        progress_callback=progress_callback,
+        full_sync=full_sync,
+        login_handler=login_handler,
+    ))
+
 
 # Synchronous wrapper for Django
-def fetch_successful_purchases_sync(user: User, tms_number: int = None) -> Dict:
+def fetch_successful_purchases_sync(user: User, tms_number: int = None, full_sync: bool = False) -> Dict:
     """
     Synchronous wrapper for fetching successful purchases
     """
-    if not PLAYWRIGHT_AVAILABLE:
-        return {
-            'success': False,
-            'error': 'Playwright not available',
-            'records_found': 0,
-            'records_saved': 0
-        }
-    
-    # Determine TMS server number
-    try:
-        profile = user.profile_ver
-        if not tms_number:
-            tms_number = profile.tms_server_number
-    except:
-        pass
-    
-    if not tms_number:
-        tms_number = 52  # Default
-    
-    fetcher = TMSDataFetcher(tms_number)
-    
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    return loop.run_until_complete(fetcher.fetch_and_save_successful_purchases(user))
\ No newline at end of file
+    return run_in_tms_loop(afetch_successful_purchases(user, tms_number=tms_number, full_sync=full_sync))
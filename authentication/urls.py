@@ -1,11 +1,13 @@
 from django.urls import path
-from authentication import views
+from authentication import api, views
 
 urlpatterns = [
     path('', views.index, name='home'),
     path('dashboard/', views.index, name='dashboard'),
     path('portfolio/', views.sharehub_portfolio_view, name='sharehub_portfolio'),
+    path('portfolio/transactions/<str:kind>/', views.portfolio_transactions_view, name='portfolio_transactions'),
     path('holding/<str:scrip>/', views.sharehub_holding_detail_view, name='sharehub_holding_detail'),
+    path('holding/<str:scrip>/transactions/', views.holding_transactions_view, name='holding_transactions'),
     path('sold/<str:scrip>/', views.sharehub_sold_holding_detail_view, name='sharehub_sold_detail'),
     path('fee-breakdown/', views.fee_breakdown_view, name='fee_breakdown'),
     path('fee-breakdown/<str:scrip>/', views.fee_breakdown_view, name='fee_breakdown_scrip'),
@@ -17,6 +19,21 @@ urlpatterns = [
     path('password-reset-confirm/<uidb64>/<token>/', views.password_reset_confirm_view, name='password_reset_confirm'),
     path('buy-shares/', views.share_buy_view, name='share_buy'),
     path('sell-shares/', views.share_sell_view, name='share_sell'),
+    path('sell-shares/preview-data/', views.share_sell_preview_data_view, name='share_sell_preview_data'),
+    path('transactions/buy/<int:transaction_id>/edit/', views.edit_buy_transaction, name='edit_buy_transaction'),
+    path('transactions/buy/<int:transaction_id>/delete/', views.delete_buy_transaction, name='delete_buy_transaction'),
+    path('transactions/sell/<int:transaction_id>/edit/', views.edit_sell_transaction, name='edit_sell_transaction'),
+    path('transactions/sell/<int:transaction_id>/delete/', views.delete_sell_transaction, name='delete_sell_transaction'),
     path('fetch-tms-data/', views.fetch_tms_data_view, name='fetch_tms_data'),
+    path('tms-sync/<int:job_id>/status/', views.tms_sync_status_view, name='tms_sync_status'),
+    path('tms-sync/<int:job_id>/login/', views.tms_sync_login_view, name='tms_sync_login'),
+    path('trading-control/', views.trading_control_panel_view, name='trading_control_panel'),
+    path('profiling/', views.request_profiles_view, name='request_profiles'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('market/stream/', views.market_stream_view, name='market_stream'),
+    path('api/v1/holdings/', api.holdings_view, name='api_holdings'),
+    path('api/v1/buys/', api.buys_view, name='api_buys'),
+    path('api/v1/sells/', api.sells_view, name='api_sells'),
+    path('api/v1/fees/', api.fee_summary_view, name='api_fees'),
  
 ]
@@ -2,24 +2,31 @@
 from django.contrib.auth import authenticate, login as auth_login, login, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.shortcuts import render, redirect, HttpResponse, get_object_or_404
+from django.urls import reverse
 from .forms import UserRegistrationForm, UserLoginForm
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-from authentication.models import Profile_ver, Share_Buy, Share_Sell
+from django.contrib.admin.views.decorators import staff_member_required
+from authentication.models import Profile_ver, SellOrder, Share_Buy, Share_Sell
 from authentication.utils import email_send_token
+from authentication import fees
+from authentication.pagination import InvalidCursor, encode_cursor, keyset_page
+from authentication.portfolio_cache import conditional_portfolio, fragment_keys
 import uuid
 from decimal import Decimal
 from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.views.decorators.debug import sensitive_post_parameters
 from django.views.decorators.http import require_POST
 from django.contrib.auth.tokens import default_token_generator
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import urlencode, urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 from django.core.mail import send_mail
 from django.conf import settings
 import logging
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
 
@@ -43,11 +50,11 @@ def login_view(request):
             user = form.get_user()
 
 
+@conditional_portfolio()
 def index(request):
     if request.user.is_authenticated:
         from decimal import Decimal
         from django.db.models import Sum
-        from collections import OrderedDict
 
         user_purchases = Share_Buy.objects.filter(user=request.user)
         user_sales = Share_Sell.objects.filter(user=request.user)
@@ -147,7 +154,7 @@ def index(request):
 
         # The rest of the dashboard context
         total_purchases = Share_Buy.objects.filter(user=request.user).count()
-        total_sales = Share_Sell.objects.filter(user=request.user).values('transaction_group').distinct().count()
+        total_sales = SellOrder.objects.filter(user=request.user).count()
         total_holdings_count = Share_Buy.objects.filter(user=request.user, remaining_units__gt=0).values('scrip').distinct().count()
         total_invested = sum(h['total_investment'] for h in all_holdings)
         total_units = sum(h['total_units'] for h in all_holdings)
@@ -176,13 +183,7 @@ def index(request):
         top_holdings = top_holdings_raw
 
         recent_buys = Share_Buy.objects.filter(user=request.user).order_by('-transaction_date', '-id')[:10]
-        recent_sells_raw = Share_Sell.objects.filter(user=request.user).order_by('-transaction_date', '-id')
-        grouped_sells = OrderedDict()
-        for sell in recent_sells_raw:
-            group_key = sell.transaction_group if sell.transaction_group else f"{sell.transaction_date}_{sell.selling_price}"
-            if group_key not in grouped_sells:
-                grouped_sells[group_key] = sell
-        recent_sells = list(grouped_sells.values())[:10]
+        recent_sells = SellOrder.objects.filter(user=request.user).order_by('-transaction_date', '-id')[:10]
         recent_activities = []
         for buy in recent_buys:
             recent_activities.append({
@@ -198,7 +199,7 @@ def index(request):
         for sell in recent_sells:
             recent_activities.append({
                 'type': 'sell',
-                'scrip': sell.share.scrip,
+                'scrip': sell.scrip,
                 'units': sell.units_sold,
                 'price': float(sell.selling_price),
                 'date': sell.transaction_date,
@@ -385,14 +386,29 @@ def share_buy_view(request):
             return render(request, 'share_buy_result.html', context)
         except (ValueError, TypeError) as e:
             messages.error(request, f'Invalid input data: {e}')
-            return render(request, 'share_buy_form.html', {'nepse_stocks': nepse_stocks})
+            return render(request, 'share_buy_form.html', {'nepse_stocks': nepse_stocks, 'fee_schedule': fees.fee_schedule()})
         except Exception as e:
             messages.error(request, f'Error: {e}')
-            return render(request, 'share_buy_form.html', {'nepse_stocks': nepse_stocks})
+            return render(request, 'share_buy_form.html', {'nepse_stocks': nepse_stocks, 'fee_schedule': fees.fee_schedule()})
     else:
-        return render(request, 'share_buy_form.html', {'nepse_stocks': nepse_stocks})
+        return render(request, 'share_buy_form.html', {'nepse_stocks': nepse_stocks, 'fee_schedule': fees.fee_schedule()})
         
 
+@login_required
+def share_sell_preview_data_view(request):
+    """Lots, WACC and the fee schedule of every sellable scrip in one payload for the sell form's live preview"""
+    scrips = {
+        holding['scrip']: {
+            'wacc': round(holding['wacc'], 4),
+            'units': holding['total_units'],
+            # [id, purchase date, remaining units] in FIFO order
+            'lots': [[share.id, share.transaction_date.isoformat(), share.remaining_units] for share in holding['transactions']],
+        }
+        for holding in Share_Sell.get_holdings(request.user)
+    }
+    return JsonResponse({'fees': fees.fee_schedule(), 'scrips': scrips})
+
+
 @login_required
 def share_sell_view(request):
     if request.method == "POST":
@@ -433,119 +449,37 @@ def share_sell_view(request):
             
             # Calculate WACC using ALL purchases for this scrip (not just remaining units)
             # This ensures consistent WACC regardless of how many units have been sold
-            all_scrip_purchases = Share_Buy.objects.filter(
-                user=request.user, 
-                scrip=scrip_name
-            ).order_by('transaction_date')
-            
-            total_cost = Decimal('0')
-            total_units = 0
-            
-            for share in all_scrip_purchases:
-                costs_data = share.calculate_costs()
-                total_cost += costs_data['total_amount']  # Total cost of this purchase
-                total_units += share.units  # Original units purchased (not remaining)
-            
-            wacc = total_cost / total_units if total_units > 0 else Decimal('0')
-            
-            # Calculate buy cost using WACC for consistent portfolio tracking
-            total_buy_cost = wacc * units_sold
-            
-            # Generate unique transaction group ID for this sell action
-            import uuid
-            transaction_group_id = str(uuid.uuid4())
-            
-            # Distribute sale across shares using FIFO
-            remaining_to_sell = units_sold
-            share_sales = []
-            
-            for share in shares:
-                if remaining_to_sell <= 0:
-                    break
-                    
-                # Determine how many units to sell from this share
-                units_from_this_share = min(remaining_to_sell, share.remaining_units)
-                
-                # Create Share_Sell record with transaction group ID
-                share_sale = Share_Sell.objects.create(
-                    user=request.user, 
-                    share=share,
-                    units_sold=units_from_this_share,
-                    selling_price=selling_price,
-                    transaction_date=transaction_date,
-                    transaction_group=transaction_group_id
-                )
-                
-                share_sales.append(share_sale)
-                remaining_to_sell -= units_from_this_share
-            
-            # Calculate overall profit/loss using the first sale for formulas but aggregate costs
-            first_sale = share_sales[0]
-            gross_sale = selling_price * units_sold
-            
-            # Calculate fees using total gross sale
-            sebon_fee = gross_sale * Decimal('0.00015')
-            dp_charge = Decimal('25.00')
-            
-            # Broker commission calculation
-            if gross_sale <= 50000:
-                broker_rate = Decimal('0.36')
-            elif gross_sale <= 500000:
-                broker_rate = Decimal('0.33')
-            elif gross_sale <= 2000000:
-                broker_rate = Decimal('0.31')
-            elif gross_sale <= 10000000:
-                broker_rate = Decimal('0.27')
-            else:
-                broker_rate = Decimal('0.24')
-            
-            broker_commission = gross_sale * (broker_rate / 100)
-            total_fees = sebon_fee + dp_charge + broker_commission
-            net_sale = gross_sale - total_fees
-            
-            # Calculate profit/loss
-            profit_before_tax = net_sale - total_buy_cost
+            wacc = Share_Buy.scrip_wacc(request.user, scrip_name)
             
-            # Calculate holding period for tax (use earliest purchase date)
-            earliest_date = min(sale.share.transaction_date for sale in share_sales)
-            if transaction_date and earliest_date:
-                holding_period_days = (transaction_date - earliest_date).days
-            else:
-                holding_period_days = 0
-            
-            # Tax calculation
-            if holding_period_days > 365:  # Long-term
-                tax_rate = Decimal('0.05')  # 5%
-            else:  # Short-term
-                tax_rate = Decimal('0.075')  # 7.5%
+            # One order for the sell action, with its fees and tax worked out once,
+            # distributed across the selected purchases using FIFO
+            order = SellOrder.record(request.user, shares, units_sold, selling_price, transaction_date, wacc=wacc)
             
-            tax_amount = max(profit_before_tax * tax_rate, Decimal('0')) if profit_before_tax > 0 else Decimal('0')
-            final_profit = profit_before_tax - tax_amount
-            net_receivable = net_sale - tax_amount
+            pnl = order.profit_loss()
             
             # Calculate profit percentage
             profit_percentage = 0
-            if gross_sale > 0:
-                profit_percentage = (profit_before_tax / gross_sale) * 100
+            if order.gross_amount > 0:
+                profit_percentage = (pnl['profit_before_tax'] / order.gross_amount) * 100
             
             context = {
                 'scrip': scrip_name,
                 'units_sold': units_sold,
                 'selling_price': float(selling_price),
                 'wacc': float(wacc),  # Add WACC for reference
-                'gross_sale': float(gross_sale),
-                'sebon_fee': float(sebon_fee),
-                'dp_charge': float(dp_charge),
-                'broker_commission': float(broker_commission),
-                'net_sale': float(net_sale),
-                'net_receivable': float(net_receivable),
-                'total_buy_cost': float(total_buy_cost),
-                'profit_before_tax': float(profit_before_tax),
-                'tax_amount': float(tax_amount),
-                'final_profit': float(final_profit),
-                'tax_rate': float(tax_rate) * 100,
+                'gross_sale': float(pnl['gross_sale']),
+                'sebon_fee': float(pnl['sebon_fee']),
+                'dp_charge': float(pnl['dp_charge']),
+                'broker_commission': float(pnl['broker_commission']),
+                'net_sale': float(pnl['net_sale']),
+                'net_receivable': float(pnl['receivable_amount']),
+                'total_buy_cost': float(pnl['total_buy_cost']),
+                'profit_before_tax': float(pnl['profit_before_tax']),
+                'tax_amount': float(pnl['tax_amount']),
+                'final_profit': float(pnl['final_profit']),
+                'tax_rate': pnl['tax_rate_percentage'],
                 'profit_percentage': profit_percentage,
-                'holding_period_days': holding_period_days,
+                'holding_period_days': pnl['holding_period_days'],
                 'success': True
             }
             
@@ -562,63 +496,7 @@ def share_sell_view(request):
             return render(request, 'share_sell_form.html')
     
     else:
-        # Group shares by scrip to show consolidated holdings
-        available_shares_raw = Share_Buy.objects.filter(user=request.user, remaining_units__gt=0).order_by('scrip', 'transaction_date')
-        
-        # Group by scrip and calculate totals
-        scrip_holdings = {}
-        for share in available_shares_raw:
-            scrip = share.scrip
-            if scrip not in scrip_holdings:
-                scrip_holdings[scrip] = {
-                    'scrip': scrip,
-                    'total_units': 0,
-                    'total_cost': Decimal('0'),
-                    'share_ids': [],
-                    'earliest_date': share.transaction_date,
-                    'transactions': []
-                }
-            
-            costs_data = share.calculate_costs()
-            total_cost = costs_data['total_amount']
-            units = share.remaining_units
-            cost_for_remaining = total_cost * (Decimal(units) / Decimal(share.units))
-            
-            scrip_holdings[scrip]['total_units'] += units
-            scrip_holdings[scrip]['total_cost'] += cost_for_remaining
-            scrip_holdings[scrip]['share_ids'].append(share.id)
-            scrip_holdings[scrip]['transactions'].append(share)
-            
-            # Keep track of earliest purchase date
-            if share.transaction_date < scrip_holdings[scrip]['earliest_date']:
-                scrip_holdings[scrip]['earliest_date'] = share.transaction_date
-        
-        # Convert to list and calculate WACC for each scrip
-        available_shares = []
-        for scrip, data in scrip_holdings.items():
-            # Calculate WACC using ALL purchases for this scrip (not just remaining units)
-            all_scrip_purchases = Share_Buy.objects.filter(user=request.user, scrip=scrip)
-            total_all_cost = Decimal('0')
-            total_all_units = 0
-            
-            for purchase in all_scrip_purchases:
-                costs_data = purchase.calculate_costs()
-                total_all_cost += costs_data['total_amount']
-                total_all_units += purchase.units
-            
-            wacc = float(total_all_cost / total_all_units) if total_all_units > 0 else 0
-            
-            available_shares.append({
-                'scrip': scrip,
-                'total_units': data['total_units'],
-                'wacc': wacc,
-                'earliest_date': data['earliest_date'],
-                'share_ids': ','.join(map(str, data['share_ids'])),  # Comma-separated IDs for selection
-                'transactions': data['transactions']
-            })
-        
-        # Sort by scrip name
-        available_shares.sort(key=lambda x: x['scrip'])
+        available_shares = Share_Sell.get_holdings(request.user)
         
         context = {
             'available_shares': available_shares
@@ -915,11 +793,16 @@ def sold_holding_detail_view(request, scrip):
         messages.error(request, f'Error loading sold holding details: {str(e)}')
         return redirect('sharehub_portfolio')
 
+# Transactions per page in the portfolio and holding detail lists
+TRANSACTION_PAGE_SIZE = 25
+
+
 @login_required
+@conditional_portfolio()
 def sharehub_portfolio_view(request):
     """ShareHub Nepal style portfolio dashboard with modern design"""
     user_purchases = Share_Buy.objects.filter(user=request.user)
-    user_sales = Share_Sell.objects.filter(user=request.user)
+    user_sales = Share_Sell.objects.filter(user=request.user).select_related('share')
     from .nepse_api_utils import fetch_nepse_stocks_and_ltp
     nepse_stocks = fetch_nepse_stocks_and_ltp()
     nepse_ltp_map = {stock['symbol']: stock for stock in nepse_stocks}
@@ -960,7 +843,8 @@ def sharehub_portfolio_view(request):
                 'realized_pnl': Decimal('0'),
                 'transactions': []
             }
-        profit_loss = sale.calculate_profit_loss()
+        # The scrip's WACC over all its purchases, computed above
+        profit_loss = sale.calculate_profit_loss(wacc=current_holdings_data[scrip]['wacc'])
         sold_holdings_data[scrip]['total_sold_units'] += sale.units_sold
         sold_holdings_data[scrip]['total_cost'] += profit_loss['total_buy_cost']
         sold_holdings_data[scrip]['total_sale_value'] += profit_loss['gross_sale']
@@ -990,6 +874,8 @@ def sharehub_portfolio_view(request):
             'wacc': data['wacc'],
             'total_investment': data['total_investment'],
             'current_value': current_value,
+            # LTP x units only; current_value falls back to an estimate when there is no price
+            'market_value': Decimal(str(ltp)) * data['remaining_units'] if ltp else None,
             'current_price': current_price,
             'price_change': price_change,
             'percentage_change': percentage_change,
@@ -1040,17 +926,9 @@ def sharehub_portfolio_view(request):
     total_realized_pnl = sum(data['realized_pnl'] for data in sold_holdings_data.values())
     net_portfolio_value = total_current_value + total_realized_pnl
 
-    # Prepare separate transaction lists for easier template rendering
-    all_buy_transactions = []
-    all_sell_transactions = []
-    
-    for holding in all_holdings:
-        all_buy_transactions.extend(holding['transactions'])
-        all_sell_transactions.extend(holding['sold_transactions'])
-    
-    # Sort transactions by date (newest first)
-    all_buy_transactions.sort(key=lambda x: x.transaction_date, reverse=True)
-    all_sell_transactions.sort(key=lambda x: x.transaction_date, reverse=True)
+    # Only the newest page of each transaction list; the rest is fetched on scroll
+    buy_transactions, buy_next_cursor = _transaction_page(request.user, 'buy')
+    sell_transactions, sell_next_cursor = _transaction_page(request.user, 'sell')
 
     context = {
         'current_holdings': current_holdings,
@@ -1062,12 +940,114 @@ def sharehub_portfolio_view(request):
         'total_unrealized_pnl': total_unrealized_pnl,
         'total_realized_pnl': total_realized_pnl,
         'net_portfolio_value': net_portfolio_value,
-        'all_buy_transactions': all_buy_transactions,
-        'all_sell_transactions': all_sell_transactions,
+        'buy_transactions': buy_transactions,
+        'buy_next_cursor': buy_next_cursor,
+        'sell_transactions': sell_transactions,
+        'sell_next_cursor': sell_next_cursor,
+        **fragment_keys(request.user, nepse_stocks),
     }
     return render(request, 'sharehub_portfolio.html', context)
 
+
+def _transaction_page(user, kind, cursor=None):
+    """One page of the user's buy or sell transactions, newest first"""
+    if kind == 'buy':
+        transactions = Share_Buy.objects.filter(user=user)
+    else:
+        transactions = Share_Sell.objects.filter(user=user).select_related('share')
+    transactions, next_cursor = keyset_page(transactions, cursor=cursor, limit=TRANSACTION_PAGE_SIZE, descending=True)
+    if kind == 'sell' and transactions:
+        # One WACC query for the page instead of one per row from the template
+        waccs = Share_Buy.scrip_waccs(user, [sale.share.scrip for sale in transactions])
+        for sale in transactions:
+            sale.profit_loss = sale.calculate_profit_loss(wacc=waccs[sale.share.scrip])
+    return transactions, next_cursor
+
+
 @login_required
+@conditional_portfolio(market=False)
+def portfolio_transactions_view(request, kind):
+    """Next page of the portfolio's buy or sell transaction list, as an HTML fragment"""
+    if kind not in ('buy', 'sell'):
+        raise Http404
+    try:
+        transactions, next_cursor = _transaction_page(request.user, kind, request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponse(status=400)
+    return render(request, f'portfolio_{kind}_transactions.html', {
+        f'{kind}_transactions': transactions,
+        f'{kind}_next_cursor': next_cursor,
+        'is_next_page': True,
+    })
+
+def _holding_transaction_row(kind, transaction):
+    """Template row of one buy or sell order in a holding's transaction history"""
+    if kind == 'buy':
+        return {
+            'type': 'buy',
+            'transaction': transaction,
+            'costs': transaction.calculate_costs(),
+            'gross_amount': transaction.units * transaction.buying_price,
+            'broker_rate': transaction.get_broker_rate(),
+        }
+    # One row per sell order, with the amounts stored when it was recorded
+    lots = list(transaction.lots.all())
+    return {
+        'type': 'sell',
+        'transaction': transaction,
+        'profit_loss': transaction.profit_loss(),
+        'broker_rate': float(transaction.broker_rate),
+        'is_grouped': len(lots) > 1,  # Flag to indicate if this was split across purchases
+        'original_count': len(lots),  # Number of FIFO lots
+        'lots': lots,  # The template links edit/delete to the first lot
+    }
+
+
+def _holding_transaction_page(user, scrip, buy_cursor=None, sell_cursor=None):
+    """
+    One page of a holding's transaction history, newest first: a keyset page of
+    its buys and one of its sell orders, merged and cut to TRANSACTION_PAGE_SIZE.
+    Returns the rows and the (buy, sell) cursors of the next page, None on the last
+    """
+    buys, more_buys = keyset_page(
+        Share_Buy.objects.filter(user=user, scrip=scrip),
+        cursor=buy_cursor, limit=TRANSACTION_PAGE_SIZE, descending=True,
+    )
+    orders, more_orders = keyset_page(
+        SellOrder.objects.filter(user=user, scrip=scrip).prefetch_related('lots'),
+        cursor=sell_cursor, limit=TRANSACTION_PAGE_SIZE, descending=True,
+    )
+    # On the same day a sale is listed above the buys, as it can only follow them
+    merged = sorted(
+        [(buy.transaction_date, 0, buy.id, 'buy', buy) for buy in buys]
+        + [(order.transaction_date, 1, order.id, 'sell', order) for order in orders],
+        key=lambda item: item[:3],
+        reverse=True,
+    )
+    page = merged[:TRANSACTION_PAGE_SIZE]
+
+    next_cursors = None
+    if len(merged) > TRANSACTION_PAGE_SIZE or more_buys or more_orders:
+        # Each side resumes after its last row on this page, or where it was
+        last = {kind: transaction for _, _, _, kind, transaction in page}
+        next_cursors = tuple(
+            encode_cursor(last[kind].transaction_date, last[kind].id) if kind in last else cursor
+            for kind, cursor in (('buy', buy_cursor), ('sell', sell_cursor))
+        )
+    rows = [_holding_transaction_row(kind, transaction) for _, _, _, kind, transaction in page]
+    return rows, next_cursors
+
+
+def _holding_next_query(page_start, rows, next_cursors):
+    """Query string of the next history page, None after the last one"""
+    if next_cursors is None:
+        return None
+    buy_cursor, sell_cursor = next_cursors
+    return urlencode({'start': page_start + len(rows), 'buy': buy_cursor or '', 'sell': sell_cursor or ''})
+
+
+@login_required
+@conditional_portfolio()
 def sharehub_holding_detail_view(request, scrip):
     """ShareHub style detailed holding view"""
     try:
@@ -1078,16 +1058,17 @@ def sharehub_holding_detail_view(request, scrip):
             messages.error(request, f'No holdings found for {scrip}')
             return redirect('sharehub_portfolio')
         
-        # Get all sell transactions for this scrip (ordered by newest first)
-        sell_transactions = Share_Sell.objects.filter(
-            user=request.user, 
-            share__scrip=scrip
-        ).order_by('-transaction_date', '-id')  # Latest transactions first
+        # Sell order totals from the amounts stored on each order; the rows are only
+        # built for the page of history shown
+        sell_orders = SellOrder.objects.filter(user=request.user, scrip=scrip).only(
+            'units_sold', 'gross_amount', 'sebon_fee', 'dp_charge', 'broker_commission',
+            'buy_cost', 'capital_gains_tax', 'net_amount',
+        )
         
         # Calculate summary data
         total_units = sum(t.units for t in buy_transactions)
         available_units = sum(t.remaining_units for t in buy_transactions)
-        sold_units = sum(t.units_sold for t in sell_transactions)
+        sold_units = sum(order.units_sold for order in sell_orders)
         
         # Calculate WACC: Total cost of all purchases / Total units purchased
         total_cost_all_purchases = Decimal('0')
@@ -1101,179 +1082,13 @@ def sharehub_holding_detail_view(request, scrip):
         total_investment = total_cost_all_purchases
         
         # Calculate realized P&L
-        realized_pnl = sum(
-            t.calculate_profit_loss()['final_profit'] 
-            for t in sell_transactions
-        )
-        
-        # Prepare transaction data
-        buy_transactions_data = []
-        for transaction in buy_transactions:
-            costs = transaction.calculate_costs()
-            buy_transactions_data.append({
-                'transaction': transaction,
-                'costs': costs,
-                'gross_amount': transaction.units * transaction.buying_price,
-                'broker_rate': transaction.get_broker_rate()
-            })
-        
-        sell_transactions_data = []
-        
-        # Group sell transactions by transaction_group to show original user actions
-        from collections import defaultdict
-        grouped_sells = defaultdict(list)
-        
-        for transaction in sell_transactions:
-            # If transaction_group exists, use it; otherwise group by date and price (for old data)
-            group_key = transaction.transaction_group if transaction.transaction_group else f"{transaction.transaction_date}_{transaction.selling_price}"
-            grouped_sells[group_key].append(transaction)
-        
-        # Process each group as a single transaction
-        for group_key, transactions in grouped_sells.items():
-            # Calculate totals for this group (original user transaction)
-            total_units_sold = sum(t.units_sold for t in transactions)
-            avg_selling_price = transactions[0].selling_price  # Same for all in group
-            transaction_date = transactions[0].transaction_date  # Same for all in group
-            
-            # Calculate total buy cost using the overall WACC (not individual transaction WACCs)
-            total_buy_cost = wacc * total_units_sold
-            
-            # Calculate fees for the ORIGINAL transaction (not summing split fees)
-            # This is how the user originally made the transaction
-            total_gross_sale = avg_selling_price * total_units_sold
-            
-            # Calculate fees based on the original total gross sale
-            total_sebon_fee = total_gross_sale * Decimal('0.00015')
-            total_dp_charge = Decimal('25.00')  # DP charge is fixed per transaction, not per split
-            
-            # Broker commission calculation based on total gross sale
-            if total_gross_sale <= 50000:
-                broker_rate = Decimal('0.36')
-            elif total_gross_sale <= 500000:
-                broker_rate = Decimal('0.33')
-            elif total_gross_sale <= 2000000:
-                broker_rate = Decimal('0.31')
-            elif total_gross_sale <= 10000000:
-                broker_rate = Decimal('0.27')
-            else:
-                broker_rate = Decimal('0.24')
-                
-            total_broker_commission = total_gross_sale * (broker_rate / 100)
-            total_net_sale = total_gross_sale - total_sebon_fee - total_dp_charge - total_broker_commission
-            
-            # Recalculate profit/loss with correct WACC-based buy cost
-            total_profit_before_tax = total_net_sale - total_buy_cost
-            
-            # Calculate tax based on the representative transaction's holding period
-            representative_transaction = transactions[0]
-            holding_period_days = (transaction_date - representative_transaction.share.transaction_date).days
-            
-            # Tax calculation
-            if total_profit_before_tax > 0:
-                if holding_period_days >= 365:  # 1 year or more
-                    tax_rate = Decimal('0.05')  # 5% tax
-                else:  # Less than 1 year
-                    tax_rate = Decimal('0.075')  # 7.5% tax
-                total_tax_amount = total_profit_before_tax * tax_rate
-            else:
-                total_tax_amount = Decimal('0')
-                tax_rate = Decimal('0.075')  # Default for display
-            
-            total_final_profit = total_profit_before_tax - total_tax_amount
-            
-            # Calculate actual receivable amount (net sale minus capital gain tax)
-            total_receivable_amount = total_net_sale - total_tax_amount
-            
-            # Create a representative transaction object with combined data
-            combined_profit_loss = {
-                'gross_sale': total_gross_sale,
-                'net_sale': total_net_sale,
-                'receivable_amount': total_receivable_amount,  # Add proper receivable amount
-                'total_buy_cost': total_buy_cost,
-                'profit_before_tax': total_profit_before_tax,
-                'tax_amount': total_tax_amount,
-                'final_profit': total_final_profit,
-                'sebon_fee': total_sebon_fee,  # Calculated for original transaction amount
-                'dp_charge': total_dp_charge,  # Fixed fee per transaction (not per split)  
-                'broker_commission': total_broker_commission,  # Calculated for original transaction amount
-                'holding_period_days': holding_period_days,
-                'tax_rate': tax_rate,
-                'tax_rate_percentage': float(tax_rate * 100),
-                'wacc': wacc,  # Use the overall WACC, not individual transaction WACC
-            }
-            
-            # Create a mock transaction object with combined data
-            class CombinedTransaction:
-                def __init__(self, transactions, total_units, calculated_broker_rate):
-                    self.original_transactions = transactions
-                    self.id = transactions[0].id  # Use first transaction's ID as representative
-                    self.units_sold = total_units
-                    self.selling_price = transactions[0].selling_price
-                    self.transaction_date = transactions[0].transaction_date
-                    self.share = transactions[0].share
-                    self.transaction_group = transactions[0].transaction_group
-                    self.user = transactions[0].user
-                    self._broker_rate = calculated_broker_rate
-                
-                def get_broker_rate(self):
-                    return float(self._broker_rate)
-                
-                @property
-                def is_grouped(self):
-                    """Return True if this represents multiple transactions"""
-                    return len(self.original_transactions) > 1
-                
-                @property  
-                def scrip(self):
-                    """Get the scrip name from the related Share_Buy"""
-                    return self.share.scrip
-            
-            combined_transaction = CombinedTransaction(transactions, total_units_sold, broker_rate)
-            
-            sell_transactions_data.append({
-                'transaction': combined_transaction,
-                'profit_loss': combined_profit_loss,
-                'broker_rate': float(broker_rate),  # Use the calculated broker rate for the combined transaction
-                'is_grouped': len(transactions) > 1,  # Flag to indicate if this was grouped
-                'original_count': len(transactions),  # Number of original FIFO splits
-                'individual_transactions': [  # Add individual transactions for template compatibility
-                    {
-                        'transaction': t,
-                        'profit_loss': t.calculate_profit_loss(),
-                        'broker_rate': t.get_broker_rate()
-                    } for t in transactions
-                ] if len(transactions) > 1 else None
-            })
-        
-        # Group sell transactions - show each individual sell action as it was made
-        # This will show the actual sell transactions as the user made them
-        # Note: Each user sell action might create multiple Share_Sell records due to FIFO,
-        # but we'll identify original transactions by grouping by transaction_group or date/price
-        
-        # Combine all transactions for the template
-        all_transactions = []
-        
-        # Add buy transactions with type indicator
-        for buy_data in buy_transactions_data:
-            buy_data['type'] = 'buy'
-            all_transactions.append(buy_data)
-        
-        # Add sell transactions without grouping (show as individual user actions)
-        for sell_data in sell_transactions_data:
-            sell_data['type'] = 'sell'
-            all_transactions.append(sell_data)
-        
-        # Sort all transactions by date (latest first)
-        all_transactions.sort(
-            key=lambda x: x['transaction'].transaction_date, 
-            reverse=True
-        )
+        realized_pnl = sum(order.final_profit for order in sell_orders)
         
         # Calculate sold value (total receivable amount after tax)
-        total_sold_receivable = sum(
-            t['profit_loss']['receivable_amount'] 
-            for t in sell_transactions_data
-        )
+        total_sold_receivable = sum(order.net_amount for order in sell_orders)
+        
+        # First page of the history; the rest loads on scroll
+        all_transactions, next_cursors = _holding_transaction_page(request.user, scrip)
         
         # Fetch LTP and change for this scrip
         from .nepse_api_utils import fetch_nepse_stocks_and_ltp
@@ -1328,9 +1143,10 @@ def sharehub_holding_detail_view(request, scrip):
             'total_investment': total_investment,
             'total_sold_receivable': total_sold_receivable,
             'realized_pnl': realized_pnl,
-            'buy_transactions': buy_transactions_data,
-            'sell_transactions': sell_transactions_data,
-            'all_transactions': all_transactions,  # Combined transactions for template
+            'all_transactions': all_transactions,
+            'transactions_next_query': _holding_next_query(0, all_transactions, next_cursors),
+            'page_start': 0,
+            **fragment_keys(request.user),
             'ltp': ltp,
             'change': change,
             'changePercent': changePercent,
@@ -1345,6 +1161,8 @@ def sharehub_holding_detail_view(request, scrip):
             'unrealized_gain': unrealized_gain,
             'current_value': current_value,
             'profit_percent': profit_percent,
+            'fee_schedule': fees.fee_schedule(),
+            'first_lot_date': next((t.transaction_date for t in buy_transactions if t.remaining_units > 0), None),
         }
 
         return render(request, 'sharehub_holding_detail.html', context)
@@ -1354,6 +1172,28 @@ def sharehub_holding_detail_view(request, scrip):
         return redirect('sharehub_portfolio')
 
 @login_required
+@conditional_portfolio(market=False)
+def holding_transactions_view(request, scrip):
+    """
+    Next page of a holding's transaction history, as an HTML fragment: ?buy= and
+    ?sell= are the keyset cursors of the two lists, ?start= the rows shown so far
+    """
+    try:
+        start = max(int(request.GET.get('start', 0)), 0)
+        all_transactions, next_cursors = _holding_transaction_page(
+            request.user, scrip, request.GET.get('buy'), request.GET.get('sell')
+        )
+    except (ValueError, InvalidCursor):
+        return HttpResponse(status=400)
+    return render(request, 'holding_transactions_page.html', {
+        'scrip': scrip,
+        'all_transactions': all_transactions,
+        'transactions_next_query': _holding_next_query(start, all_transactions, next_cursors),
+        'page_start': start,
+    })
+
+@login_required
+@conditional_portfolio(market=False)
 def sharehub_sold_holding_detail_view(request, scrip):
     """ShareHub style sold holding detail view"""
     try:
@@ -1510,90 +1350,296 @@ def password_reset_confirm_view(request, uidb64, token):
         return render(request, 'password_reset_confirm.html', {'valid_link': False})
 
 
+def _parse_tms_number(tms_number_raw, default_tms_number):
+    """Parse the server number field ('01'-'99', leading zero allowed)"""
+    tms_number = default_tms_number
+    try:
+        tms_number_str = str(tms_number_raw).strip()
+        tms_number_nozero = tms_number_str.lstrip('0')
+        if tms_number_nozero == '':
+            tms_number_nozero = '0'
+        logger.debug(f"TMS number input: raw='{tms_number_raw}', stripped='{tms_number_str}', nozero='{tms_number_nozero}'")
+        if tms_number_nozero.isdigit():
+            tms_number_int = int(tms_number_nozero)
+            if 1 <= tms_number_int <= 99:
+                tms_number = tms_number_int
+            else:
+                logger.warning(f"TMS number out of range: {tms_number_int}, using default {default_tms_number}")
+        else:
+            logger.warning(f"TMS number not digit after strip: '{tms_number_nozero}', using default {default_tms_number}")
+    except Exception as e:
+        logger.warning(f"TMS number parse error: {e}, raw value: {tms_number_raw}")
+        tms_number = default_tms_number
+    return tms_number
+
+
+def _save_broker_accounts(user, tms_numbers):
+    """Make exactly these servers the user's active broker accounts"""
+    from .models import TMSBrokerAccount
+
+    with transaction.atomic():
+        for tms_number in tms_numbers:
+            TMSBrokerAccount.objects.update_or_create(
+                user=user, tms_server_number=tms_number, defaults={'is_active': True}
+            )
+        TMSBrokerAccount.objects.filter(user=user).exclude(tms_server_number__in=tms_numbers).update(is_active=False)
+
+
+def _tms_page_job(user, job_id):
+    """Job to show on the fetch page: the requested one or the user's active one"""
+    from .models import TMSSyncJob
+
+    jobs = TMSSyncJob.objects.filter(user=user)
+    job = None
+    if job_id and job_id.isdigit():
+        job = jobs.filter(pk=int(job_id)).first()
+    if job is None:
+        job = jobs.filter(status__in=TMSSyncJob.ACTIVE_STATUSES).first()
+    return job
+
+
 @login_required
-def fetch_tms_data_view(request):
+async def fetch_tms_data_view(request):
     """
-    View to fetch data from TMS Nepse website using manual login - No credentials stored
+    Start a TMS sync - No credentials stored
+    TMS_SYNC_MODE='queue' (default) hands the sync to run_tms_worker and returns at once;
+    'inline' awaits the fetcher in this request, which only frees the worker under ASGI
     """
+    import re
+    from .tms_jobs import enqueue_tms_sync
+    from .tms_service import afetch_tms_data, afetch_tms_data_multi, resolve_tms_number, user_tms_servers
+
+    user = await request.auser()
     # Get user's TMS settings - only server number, no credentials
-    try:
-        profile = request.user.profile_ver
-        default_tms_number = profile.tms_server or 52
-    except:
-        default_tms_number = 52
+    default_tms_number = await sync_to_async(resolve_tms_number)(user)
+    broker_servers = await sync_to_async(user_tms_servers)(user)
     
     if request.method == 'POST':
-        import logging
-        logger = logging.getLogger("django")
         tms_number_raw = request.POST.get('tms_number', default_tms_number)
         settlement_type = request.POST.get('settlement_type', 'PaymentDue')
-        tms_number = str(default_tms_number)
+        tms_number = _parse_tms_number(tms_number_raw, default_tms_number)
+        sync_all_accounts = request.POST.get('sync_all_accounts') == 'on'
+        full_sync = request.POST.get('full_sync') == 'on'
+        logger.info(
+            f"TMS fetch: raw={tms_number_raw}, parsed={tms_number}, settlement_type={settlement_type}, "
+            f"all_accounts={sync_all_accounts}, full_sync={full_sync}"
+        )
+
         try:
-            tms_number_str = str(tms_number_raw).strip()
-            tms_number_nozero = tms_number_str.lstrip('0')
-            if tms_number_nozero == '':
-                tms_number_nozero = '0'
-            logger.debug(f"TMS number input: raw='{tms_number_raw}', stripped='{tms_number_str}', nozero='{tms_number_nozero}'")
-            if tms_number_nozero.isdigit():
-                tms_number_int = int(tms_number_nozero)
-                if 1 <= tms_number_int <= 99:
-                    tms_number = str(tms_number_int)
+            if sync_all_accounts:
+                # e.g. "51, 58" - invalid entries are dropped
+                requested = [
+                    _parse_tms_number(raw, None)
+                    for raw in re.split(r'[,\s]+', request.POST.get('broker_servers', ''))
+                    if raw
+                ]
+                requested = [n for n in dict.fromkeys(requested) if n]
+                if requested:
+                    await sync_to_async(_save_broker_accounts)(user, requested)
+                    broker_servers = requested
+
+            if getattr(settings, 'TMS_SYNC_MODE', 'queue') == 'inline':
+                if sync_all_accounts:
+                    result = await afetch_tms_data_multi(user, tms_numbers=broker_servers, full_sync=full_sync)
                 else:
-                    logger.warning(f"TMS number out of range: {tms_number_int}, using default {default_tms_number}")
+                    result = await afetch_tms_data(
+                        user, tms_number=tms_number, settlement_type=settlement_type, full_sync=full_sync
+                    )
+                if result['success']:
+                    messages.success(
+                        request, 
+                        f'Successfully fetched {result["records_found"]} records, '
+                        f'saved {result["records_saved"]} new share purchase records.'
+                    )
+                    for record in result['data']:
+                        messages.info(
+                            request,
+                            f'Added: {record.scrip} - {record.units} units @ Rs.{record.buying_price}'
+                        )
+                    return redirect('dashboard')
+                messages.error(request, f'Failed to fetch data: {result["error"]}')
             else:
-                logger.warning(f"TMS number not digit after strip: '{tms_number_nozero}', using default {default_tms_number}")
+                job = await sync_to_async(enqueue_tms_sync)(user, tms_number, settlement_type, sync_all_accounts, full_sync)
+                if getattr(settings, 'TMS_HEADLESS', False):
+                    messages.info(
+                        request,
+                        'Your TMS sync has been queued. The TMS captcha will appear on this page; '
+                        'enter your login details and the captcha there.'
+                    )
+                else:
+                    messages.info(
+                        request, 
+                        'Your TMS sync has been queued. A browser window will open for you to login to TMS manually; '
+                        'this page shows the progress.'
+                    )
+                return redirect(f"{reverse('fetch_tms_data')}?job={job.id}")
         except Exception as e:
-            logger.warning(f"TMS number parse error: {e}, raw value: {tms_number_raw}")
-            tms_number = str(default_tms_number)
-        logger.info(f"TMS fetch: raw={tms_number_raw}, parsed={tms_number}, settlement_type={settlement_type}")
+            messages.error(request, f'Error: {str(e)}')
 
-        try:
-            # Import here to avoid issues if playwright is not installed
-            from .tms_service import fetch_tms_data
+    job = await sync_to_async(_tms_page_job)(user, request.GET.get('job'))
+    return await sync_to_async(render)(request, 'fetch_tms_data.html', {
+        'default_tms_number': default_tms_number,
+        'broker_servers': ', '.join(str(n) for n in broker_servers),
+        'job': job,
+    })
 
-            messages.info(
-                request, 
-                'A browser window will open for you to login to TMS manually. '
-                'You have 30 seconds to fill the form, then the system will start monitoring for login completion.'
-            )
 
-            result = fetch_tms_data(
-                user=request.user,
-                tms_number=tms_number,
-                settlement_type=settlement_type
-            )
+@login_required
+def tms_sync_status_view(request, job_id):
+    """JSON progress of a queued/running TMS sync job"""
+    from .models import TMSSyncJob
 
-            if result['success']:
-                messages.success(
-                    request, 
-                    f'Successfully fetched {result["records_found"]} records, '
-                    f'saved {result["records_saved"]} new share purchase records.'
-                )
+    job = get_object_or_404(TMSSyncJob, pk=job_id, user=request.user)
+    return JsonResponse(job.as_status_dict())
 
-                # Show details of saved records
-                for record in result['data']:
-                    messages.info(
-                        request,
-                        f'Added: {record.scrip} - {record.units} units @ Rs.{record.buying_price}'
-                    )
 
-                return redirect('dashboard')
-            else:
-                messages.error(request, f'Failed to fetch data: {result["error"]}')
+@sensitive_post_parameters('password')
+@login_required
+@require_POST
+def tms_sync_login_view(request, job_id):
+    """Credentials and captcha answer for a headless sync waiting on the login page"""
+    from .models import TMSSyncJob
+    from .tms_jobs import submit_login_answer
+
+    job = get_object_or_404(TMSSyncJob, pk=job_id, user=request.user)
+    username = request.POST.get('username', '').strip()
+    password = request.POST.get('password', '')
+    captcha = request.POST.get('captcha', '').strip()
+    if not (username and password and captcha):
+        return JsonResponse({'success': False, 'error': 'Username, password and captcha are required'}, status=400)
+    if not submit_login_answer(job, username, password, captcha):
+        return JsonResponse({'success': False, 'error': 'This sync is not waiting for a captcha'}, status=409)
+    return JsonResponse({'success': True})
+
+
+@staff_member_required
+def trading_control_panel_view(request):
+    """Staff overview of scheduled TMS syncs: stored sessions, due accounts and recent runs"""
+    from datetime import timedelta
+    from django.db.models import Avg, Count, Q
+    from django.utils import timezone
+    from .models import TMSBrokerAccount, TMSSyncRun
 
-        except ImportError:
-            messages.error(
-                request, 
-                'Playwright is not installed. Please run: pip install playwright && playwright install'
-            )
-        except Exception as e:
-            messages.error(request, f'Error: {str(e)}')
-    
-    return render(request, 'fetch_tms_data.html', {
-        'default_tms_number': default_tms_number
+    try:
+        every_minutes = max(1, int(request.GET.get('every', 60)))
+    except ValueError:
+        every_minutes = 60
+    cutoff = timezone.now() - timedelta(minutes=every_minutes)
+    accounts = (
+        TMSBrokerAccount.objects.filter(user__profile_ver__tms_configured=True)
+        .select_related('user')
+        .defer('session_state')
+        .annotate(has_session=~Q(session_state=''))
+        .order_by('tms_server_number', 'user__username')
+    )
+    due = [
+        account for account in accounts
+        if account.is_active and account.has_session and (not account.last_synced_at or account.last_synced_at < cutoff)
+    ]
+    servers = (
+        TMSSyncRun.objects.filter(started_at__gte=timezone.now() - timedelta(days=1))
+        .values('tms_server_number')
+        .annotate(runs=Count('id'), succeeded=Count('id', filter=Q(success=True)), avg_duration=Avg('duration_seconds'))
+        .order_by('tms_server_number')
+    )
+    return render(request, 'trading_control_panel.html', {
+        'accounts': accounts,
+        'due': due,
+        'every_minutes': every_minutes,
+        'servers': servers,
+        'recent_runs': TMSSyncRun.objects.select_related('user')[:25],
+        'store_sessions': getattr(settings, 'TMS_STORE_SESSIONS', False),
     })
 
 
+@staff_member_required
+def request_profiles_view(request):
+    """Staff view of the request profiling buffer: per-view percentiles and recent requests"""
+    from collections import defaultdict
+    from .request_profiling import get_profile, recent_profiles
+    from .utils import percentile
+
+    if request.GET.get('id'):
+        try:
+            profile = get_profile(int(request.GET['id']))
+        except ValueError:
+            profile = None
+        if profile is None:
+            raise Http404('Profile no longer in the buffer')
+        return render(request, 'request_profiles.html', {'profile': profile, 'enabled': True})
+
+    profiles = recent_profiles()
+    by_view = defaultdict(list)
+    for profile in profiles:
+        by_view[profile.view or profile.path].append(profile)
+    views = []
+    for name, entries in by_view.items():
+        wall = sorted(entry.wall_ms for entry in entries)
+        views.append({
+            'name': name,
+            'requests': len(entries),
+            'p50': percentile(wall, 50),
+            'p90': percentile(wall, 90),
+            'max': wall[-1],
+            'queries': sum(entry.sql_count for entry in entries) / len(entries),
+            'sql_ms': sum(entry.sql_ms for entry in entries) / len(entries),
+            'duplicates': max(entry.duplicate_count for entry in entries),
+            'nepse_ms': sum(entry.sections.get('nepse_fetch', 0) for entry in entries) / len(entries),
+            'template_ms': sum(entry.sections.get('template', 0) for entry in entries) / len(entries),
+        })
+    views.sort(key=lambda view: view['p90'], reverse=True)
+    return render(request, 'request_profiles.html', {
+        'views': views,
+        'profiles': profiles[:100],
+        'enabled': getattr(settings, 'REQUEST_PROFILING', False),
+    })
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint: a bearer METRICS_TOKEN, or a staff session when no token is set"""
+    from django.utils.crypto import constant_time_compare
+    from . import metrics
+
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+async def market_stream_view(request):
+    """
+    Server-Sent Events with the price changes of ?symbols=A,B (all symbols
+    without it), for the live prices of open pages. ASGI only: under WSGI it
+    answers 204 so EventSource gives up (see authentication.market_stream)
+    """
+    from django.core.handlers.asgi import ASGIRequest
+    from django.db import connections
+    from django.http import StreamingHttpResponse
+    from .market_stream import broadcaster
+
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    if len(broadcaster.subscribers) >= getattr(settings, 'MARKET_STREAM_MAX_CLIENTS', 1000):
+        response = HttpResponse('Too many live price connections', status=503, content_type='text/plain')
+        response['Retry-After'] = '60'
+        return response
+
+    symbols = {symbol.strip().upper() for symbol in request.GET.get('symbols', '').split(',') if symbol.strip()}
+    # The stream runs no queries: give back the connection the session lookup opened
+    # instead of holding it for as long as the page stays open
+    await sync_to_async(connections.close_all)()
+    response = StreamingHttpResponse(broadcaster.stream(symbols or None), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def settings_view(request):
     """User settings page for updating TMS configuration - No credentials stored"""
@@ -1686,6 +1732,8 @@ def edit_buy_transaction(request, transaction_id):
             transaction.remaining_units = units - total_sold_from_this
             
             transaction.save()
+            # Orders that sold from this purchase were billed with its old cost and date
+            SellOrder.refresh_for_purchase(transaction)
             
             messages.success(request, f'Transaction updated successfully for {transaction.scrip}. Remaining units recalculated.')
             return redirect('sharehub_holding_detail', scrip=transaction.scrip)
@@ -1699,7 +1747,8 @@ def edit_buy_transaction(request, transaction_id):
     context = {
         'transaction': transaction,
         'is_edit': True,
-        'scrip': transaction.scrip
+        'scrip': transaction.scrip,
+        'fee_schedule': fees.fee_schedule(),
     }
     return render(request, 'share_buy_form.html', context)
 
@@ -1739,6 +1788,8 @@ def edit_sell_transaction(request, transaction_id):
             transaction.selling_price = selling_price
             transaction.transaction_date = transaction_date
             transaction.save()
+            if transaction.order_id:
+                transaction.order.refresh_from_lots()
             
             messages.success(request, f'Sell transaction updated successfully for {transaction.share.scrip}.')
             return redirect('sharehub_holding_detail', scrip=transaction.share.scrip)
@@ -1810,8 +1861,11 @@ def delete_sell_transaction(request, transaction_id):
         buy_transaction.remaining_units += transaction.units_sold
         buy_transaction.save()
         
-        # Delete the sell transaction
+        # Delete the sell transaction and update (or drop) the order it was part of
+        order = transaction.order
         transaction.delete()
+        if order:
+            order.refresh_from_lots()
         messages.success(request, f'Sell transaction deleted successfully for {scrip}.')
         
         # Redirect to portfolio or holding detail based on redirect_to parameter
@@ -1830,6 +1884,7 @@ def delete_sell_transaction(request, transaction_id):
 
 
 @login_required
+@conditional_portfolio()
 def fee_breakdown_view(request, scrip=None):
     """View for displaying detailed fee breakdown for a specific scrip or transaction"""
     user_purchases = Share_Buy.objects.filter(user=request.user).order_by('-transaction_date', '-id')
@@ -1857,6 +1912,7 @@ def fee_breakdown_view(request, scrip=None):
         buy_transactions.append({
             'transaction': purchase,
             'costs': costs,
+            'total_fees': costs['sebon_fee'] + costs['dp_charge'] + costs['broker_commission'],
             'current_ltp': nepse_ltp_map.get(purchase.scrip, {}).get('ltp', 0)
         })
         total_buy_sebon_fee += costs['sebon_fee']
@@ -1864,7 +1920,7 @@ def fee_breakdown_view(request, scrip=None):
         total_buy_commission += costs['broker_commission']
         total_buy_amount += costs['total_amount']
     
-    # Calculate fee breakdown for sell transactions - Group by transaction_group to show original user actions
+    # Calculate fee breakdown for sell transactions - one per sell order, as the user placed it
     sell_transactions = []
     total_sell_sebon_fee = Decimal('0')
     total_sell_dp_charge = Decimal('0')
@@ -1872,142 +1928,31 @@ def fee_breakdown_view(request, scrip=None):
     total_sell_cgt = Decimal('0')
     total_sell_amount = Decimal('0')
     
-    # Group sell transactions by transaction_group to show original user transactions
-    from collections import defaultdict
-    grouped_sells = defaultdict(list)
-    
-    for transaction in user_sales:
-        # If transaction_group exists, use it; otherwise group by date and price (for old data)
-        group_key = transaction.transaction_group if transaction.transaction_group else f"{transaction.transaction_date}_{transaction.selling_price}"
-        grouped_sells[group_key].append(transaction)
+    # One entry per sell order; its fees, tax and cost basis were stored when it was recorded
+    sell_orders = SellOrder.objects.filter(user=request.user).order_by('-transaction_date', '-id')
+    if scrip:
+        sell_orders = sell_orders.filter(scrip=scrip)
     
-    # Process each group as a single original transaction
-    for group_key, transactions in grouped_sells.items():
-        # Calculate totals for this group (original user transaction)
-        total_units_sold = sum(t.units_sold for t in transactions)
-        selling_price = transactions[0].selling_price  # Same for all in group
-        transaction_date = transactions[0].transaction_date  # Same for all in group
-        
-        # Calculate total buy cost using the overall WACC (not individual transaction WACCs)
-        if scrip:
-            # For scrip-specific view, calculate WACC for this scrip
-            scrip_purchases = user_purchases
-            total_cost = sum(purchase.calculate_costs()['total_amount'] for purchase in scrip_purchases)
-            total_units = sum(purchase.units for purchase in scrip_purchases)
-            wacc_for_scrip = total_cost / total_units if total_units > 0 else Decimal('0')
-            total_buy_cost = wacc_for_scrip * total_units_sold
-        else:
-            # For all transactions view, use individual transaction WACC
-            total_buy_cost = sum(t.calculate_profit_loss()['total_buy_cost'] for t in transactions)
-        
-        # Calculate fees for the ORIGINAL transaction (not summing split fees)
-        total_gross_sale = selling_price * total_units_sold
-        
-        # Calculate fees based on the original total gross sale
-        sebon_fee = total_gross_sale * Decimal('0.00015')
-        dp_charge = Decimal('25.00')  # DP charge is fixed per transaction, not per split
-        
-        # Broker commission calculation based on total gross sale
-        if total_gross_sale <= 50000:
-            broker_rate = Decimal('0.36')
-        elif total_gross_sale <= 500000:
-            broker_rate = Decimal('0.33')
-        elif total_gross_sale <= 2000000:
-            broker_rate = Decimal('0.31')
-        elif total_gross_sale <= 10000000:
-            broker_rate = Decimal('0.27')
-        else:
-            broker_rate = Decimal('0.24')
-            
-        broker_commission = total_gross_sale * (broker_rate / 100)
-        net_sale = total_gross_sale - sebon_fee - dp_charge - broker_commission
-        
-        # Calculate profit/loss with correct WACC-based buy cost
-        profit_before_tax = net_sale - total_buy_cost
-        
-        # Calculate tax based on the representative transaction's holding period
-        representative_transaction = transactions[0]
-        holding_period_days = (transaction_date - representative_transaction.share.transaction_date).days
-        
-        # Tax calculation
-        tax_amount = Decimal('0')
-        if profit_before_tax > 0:
-            if holding_period_days >= 365:  # 1 year or more
-                tax_amount = profit_before_tax * Decimal('0.05')  # 5% for long-term
-            else:  # Less than 1 year
-                tax_amount = profit_before_tax * Decimal('0.075')  # 7.5% for short-term
-        
-        final_profit = profit_before_tax - tax_amount
-        receivable_amount = net_sale - tax_amount
-        
-        # Create a grouped transaction object
-        class GroupedSellTransaction:
-            def __init__(self, transactions, total_units_sold, selling_price, transaction_date):
-                self.transactions = transactions
-                self.units_sold = total_units_sold
-                self.selling_price = selling_price
-                self.transaction_date = transaction_date
-                self.share = transactions[0].share
-                self.transaction_group = transactions[0].transaction_group
-                
-            def get_broker_rate(self):
-                total_amount = self.units_sold * self.selling_price
-                if total_amount <= 50000:
-                    return 0.36
-                elif total_amount <= 500000:
-                    return 0.33
-                elif total_amount <= 2000000:
-                    return 0.31
-                elif total_amount <= 10000000:
-                    return 0.27
-                else:
-                    return 0.24
-        
-        grouped_transaction = GroupedSellTransaction(transactions, total_units_sold, selling_price, transaction_date)
-        
-        # Create costs and P&L data
-        costs = {
-            'sebon_fee': sebon_fee,
-            'dp_charge': dp_charge,
-            'broker_commission': broker_commission,
-            'capital_gains_tax': tax_amount,
-            'net_amount': receivable_amount
-        }
-        
-        pnl = {
-            'gross_sale': total_gross_sale,
-            'sebon_fee': sebon_fee,
-            'dp_charge': dp_charge,
-            'broker_commission': broker_commission,
-            'net_sale': net_sale,
-            'receivable_amount': receivable_amount,
-            'total_buy_cost': total_buy_cost,
-            'profit_before_tax': profit_before_tax,
-            'tax_amount': tax_amount,
-            'final_profit': final_profit,
-            'holding_period_days': holding_period_days,
-            'tax_rate': Decimal('0.05') if holding_period_days >= 365 else Decimal('0.075'),
-            'tax_rate_percentage': 5 if holding_period_days >= 365 else 7.5,
-            'wacc': wacc_for_scrip if scrip else sum(t.calculate_profit_loss()['wacc'] * t.units_sold for t in transactions) / total_units_sold,
-            'original_count': len(transactions),  # Number of original FIFO splits
-        }
-        
+    for order in sell_orders:
         sell_transactions.append({
-            'transaction': grouped_transaction,
-            'costs': costs,
-            'pnl': pnl,
-            'current_ltp': nepse_ltp_map.get(grouped_transaction.share.scrip, {}).get('ltp', 0)
+            'transaction': order,
+            'costs': {
+                'sebon_fee': order.sebon_fee,
+                'dp_charge': order.dp_charge,
+                'broker_commission': order.broker_commission,
+                'capital_gains_tax': order.capital_gains_tax,
+                'net_amount': order.net_amount
+            },
+            'pnl': order.profit_loss(),
+            'current_ltp': nepse_ltp_map.get(order.scrip, {}).get('ltp', 0)
         })
         
         # Add to totals
-        total_sell_sebon_fee += sebon_fee
-        total_sell_dp_charge += dp_charge
-        total_sell_commission += broker_commission
-        total_sell_cgt += tax_amount
-        total_sell_amount += receivable_amount
-    
-    # Sort sell transactions by date (newest first)
-    sell_transactions.sort(key=lambda x: x['transaction'].transaction_date, reverse=True)
+        total_sell_sebon_fee += order.sebon_fee
+        total_sell_dp_charge += order.dp_charge
+        total_sell_commission += order.broker_commission
+        total_sell_cgt += order.capital_gains_tax
+        total_sell_amount += order.net_amount
     
     # Calculate summary data for the scrip
     if scrip:
@@ -2056,12 +2001,43 @@ def fee_breakdown_view(request, scrip=None):
         'remaining_units': remaining_units,
         'wacc': wacc,
         'total_investment': total_investment,
-        'current_ltp': current_ltp
+        'current_ltp': current_ltp,
+        'estimate': _sale_estimate(current_ltp, remaining_units, wacc) if scrip else None,
+        **fragment_keys(request.user),
     }
     
     return render(request, 'fee_breakdown.html', context)
 
 
+def _sale_estimate(ltp, units, wacc):
+    """Fees and profit if units were sold at ltp today, for the fee breakdown page"""
+    if not ltp or units <= 0:
+        return None
+    ltp = Decimal(str(ltp))
+    gross_sale = ltp * units
+    sebon_fee = gross_sale * fees.SEBON_FEE_RATE
+    broker_rate = fees.broker_rate(gross_sale)
+    broker_commission = gross_sale * broker_rate / 100
+    total_fees = sebon_fee + fees.DP_CHARGE + broker_commission
+    net_receivable = gross_sale - total_fees
+    cost_basis = wacc * units
+    estimated_profit = net_receivable - cost_basis
+    return {
+        'gross_sale': gross_sale,
+        'sebon_fee': sebon_fee,
+        'dp_charge': fees.DP_CHARGE,
+        'broker_rate': broker_rate,
+        'broker_commission': broker_commission,
+        'total_fees': total_fees,
+        'net_receivable': net_receivable,
+        'cost_basis': cost_basis,
+        'estimated_profit': estimated_profit,
+        'return_percent': estimated_profit * 100 / cost_basis if cost_basis else 0,
+        'price_change': ltp - wacc,
+        'price_change_percent': (ltp - wacc) * 100 / wacc if wacc else 0,
+    }
+
+
 # Custom Error Handlers
 def custom_404(request, exception):
     """Custom 404 error handler"""
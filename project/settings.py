@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -47,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'authentication.request_profiling.RequestProfilingMiddleware',
+    'authentication.metrics.MetricsMiddleware',
+    'authentication.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,13 +66,20 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Each template is compiled once per process; under runserver the
+            # autoreloader clears the cache when a template changes
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -79,12 +90,59 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql for production; the default SQLite file suits single-node installs
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite').lower()
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'nepse'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Keep connections open between requests, checking them before reuse
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
-}
+    if os.environ.get('DB_POOL', 'False').lower() == 'true':
+        # psycopg's pool (pip install "psycopg[pool]") replaces persistent connections
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+    if os.environ.get('DB_PGBOUNCER', 'False').lower() == 'true':
+        # PgBouncer in transaction mode can't keep a server-side cursor across transactions
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Seconds a writer waits for the write lock before "database is locked"
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+            },
+        }
+    }
+    if os.environ.get('SQLITE_TUNED', 'True').lower() == 'true':
+        # WAL lets readers run while one writer commits; NORMAL only syncs at
+        # checkpoints (durable against app crashes, not power loss); write
+        # transactions take the lock up front instead of failing on upgrade
+        DATABASES['default']['OPTIONS'].update({
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 134217728))};"
+                'PRAGMA temp_store=MEMORY;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+        })
 
 
 # Password validation
@@ -122,6 +180,22 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# With STATIC_MANIFEST=True, collectstatic writes content-hashed copies (base.3f2a9c1e.css),
+# plus .gz/.br variants of the text ones, and {% static %} links to them, so browsers can
+# cache them for a year. Every {% static %} then fails until collectstatic has run, so
+# it is opt-in for deployments that run it (the static_manifest system check verifies)
+STATIC_MANIFEST = os.environ.get('STATIC_MANIFEST', 'False').lower() == 'true'
+if STATIC_MANIFEST:
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'authentication.compression.CompressedManifestStaticFilesStorage'},
+    }
+
+# Let Django serve STATIC_ROOT outside DEBUG (single-node installs without a web server
+# in front); hashed files are sent with a one-year immutable Cache-Control
+SERVE_STATIC = os.environ.get('SERVE_STATIC', 'False').lower() == 'true'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -153,4 +227,74 @@ CSRF_COOKIE_HTTPONLY = True
 
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
-LOGOUT_REDIRECT_URL = '/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/'
+
+# TMS scraping: per-phase overrides for authentication.tms_resources.DEFAULT_RESOURCE_POLICY,
+# e.g. {'data': {'block_types': ['image', 'font', 'media', 'stylesheet']}}
+TMS_RESOURCE_POLICY = {}
+
+# How fetch_tms_data_view runs a sync: 'queue' hands it to `manage.py run_tms_worker`,
+# 'inline' awaits the fetcher inside the (async) view - only sensible under ASGI
+TMS_SYNC_MODE = os.environ.get('TMS_SYNC_MODE', 'queue')
+
+# Run queued TMS syncs in headless Chromium; the captcha is shown on the
+# fetch page and the user's answer is typed back into the login form
+TMS_HEADLESS = os.environ.get('TMS_HEADLESS', 'False').lower() == 'true'
+
+# The answer (TMS username, password and captcha) travels from the web process to
+# run_tms_worker through this cache, never the database: it is deleted as soon as the
+# worker reads it and expires after TMS_LOGIN_ANSWER_TTL seconds otherwise. Both
+# processes must see the same cache, so the default is a private directory on this
+# host; set TMS_LOGIN_CACHE_URL=redis://... when the worker runs elsewhere
+TMS_LOGIN_ANSWER_TTL = int(os.environ.get('TMS_LOGIN_ANSWER_TTL', 60))
+TMS_LOGIN_CACHE_URL = os.environ.get('TMS_LOGIN_CACHE_URL', '')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'tms_login': {
+        'BACKEND': (
+            'django.core.cache.backends.redis.RedisCache' if TMS_LOGIN_CACHE_URL
+            else 'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': TMS_LOGIN_CACHE_URL or os.path.join(tempfile.gettempdir(), 'codebulls-tms-login'),
+        'TIMEOUT': TMS_LOGIN_ANSWER_TTL,
+        'KEY_PREFIX': 'tms-login',
+    },
+}
+
+# Keep the browser cookies of each successful TMS login on the broker account
+# so run_auto_trading can sync it again without a captcha until TMS expires it
+TMS_STORE_SESSIONS = os.environ.get('TMS_STORE_SESSIONS', 'False').lower() == 'true'
+
+# Per-request timing, SQL and duplicate-query records for staff at /profiling/
+# (see authentication.request_profiling); the middleware removes itself when off
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', 'False').lower() == 'true'
+REQUEST_PROFILING_BUFFER_SIZE = int(os.environ.get('REQUEST_PROFILING_BUFFER_SIZE', 200))
+# Share of profiled requests that also run under cProfile, 0 to 1
+REQUEST_PROFILING_SAMPLE_RATE = float(os.environ.get('REQUEST_PROFILING_SAMPLE_RATE', 0))
+
+# Prometheus text metrics at /metrics (see authentication.metrics). Scrapers send
+# "Authorization: Bearer <METRICS_TOKEN>"; without a token only staff can read it.
+# With several worker processes, point METRICS_DIR at a directory they all share.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+# Seconds the portfolio, holding and fee breakdown row fragments stay cached; they are
+# keyed on the user's portfolio version and the market snapshot, so edits show at once
+PORTFOLIO_FRAGMENT_CACHE_SECONDS = int(os.environ.get('PORTFOLIO_FRAGMENT_CACHE_SECONDS', 600))
+
+# Seconds a successful NEPSE price fetch is reused by later requests of the same
+# process; portfolio pages answer 304 while neither it nor the portfolio changed
+MARKET_FEED_CACHE_SECONDS = int(os.environ.get('MARKET_FEED_CACHE_SECONDS', 15))
+
+# Responses smaller than this many bytes are not worth compressing
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+
+# Live prices pushed to open portfolio pages over Server-Sent Events (ASGI only): seconds
+# between feed polls while any page is connected, between keep-alive comments, and the
+# open connections each worker process accepts
+MARKET_STREAM_INTERVAL = float(os.environ.get('MARKET_STREAM_INTERVAL', 15))
+MARKET_STREAM_HEARTBEAT = float(os.environ.get('MARKET_STREAM_HEARTBEAT', 20))
+MARKET_STREAM_MAX_CLIENTS = int(os.environ.get('MARKET_STREAM_MAX_CLIENTS', 1000))
@@ -1,8 +1,12 @@
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from authentication.static_serving import serve_static
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('authentication.urls')),  # Root URLs
@@ -11,6 +15,8 @@ urlpatterns = [
 # Add static files serving for development
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+elif settings.SERVE_STATIC:
+    urlpatterns += [re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_static)]
 
 # Custom error handlers
 handler404 = 'authentication.views.custom_404'